@@ -2,26 +2,47 @@
 数学公式API端点
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import Response
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional, Tuple
+import asyncio
 import base64
-from ..services.math_service import math_service
+import json
+import re
+import uuid
+
+from ..core.config import settings
+from ..services.formula_cache import formula_cache, FORMULA_URL_PREFIX
+from ..services.formula_pool import (
+    formula_pool, fraction_formula, image_cache_key, render_image, render_fraction_image,
+    process_markdown, test_rendering, validate_math
+)
 
 router = APIRouter()
 
+# 公式图片地址：缓存键由公式和渲染参数的摘要组成，同一地址的内容永远不变
+_FORMULA_FILENAME_PATTERN = re.compile(r'^([0-9a-f]{64})\.(png|svg|pdf)$')
+_FORMULA_MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml", "pdf": "application/pdf"}
+_IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _formula_url(cache_key: str) -> str:
+    return FORMULA_URL_PREFIX + cache_key
+
 
 class MathFormulaRequest(BaseModel):
     """数学公式请求模型"""
     formula: str
     font_size: Optional[int] = 12
-    format: Optional[str] = "png"  # png, svg
+    format: Optional[str] = "png"  # png, svg, pdf（SVG、PDF为矢量输出，按 font_size(pt) 排版）
 
 
 class MathFormulaResponse(BaseModel):
     """数学公式响应模型"""
     success: bool
-    image_data: Optional[str] = None  # base64编码的图片数据
+    image_data: Optional[str] = None  # base64编码的图片数据（PNG、SVG或PDF）
+    url: Optional[str] = None  # 可被浏览器和CDN长期缓存的图片地址
     error: Optional[str] = None
 
 
@@ -29,6 +50,8 @@ class MathFormulaResponse(BaseModel):
 async def render_math_formula(request: MathFormulaRequest):
     """
     渲染LaTeX数学公式为图片
+
+    format 为 svg、pdf 时输出与分辨率无关的矢量公式，任意缩放都保持清晰
     
     Args:
         request: 包含LaTeX公式和渲染参数的请求
@@ -36,12 +59,13 @@ async def render_math_formula(request: MathFormulaRequest):
     Returns:
         包含base64编码图片数据的响应
     """
+    output_format = request.format or "png"
+    if output_format not in _FORMULA_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"不支持的输出格式: {output_format}")
+
     try:
-        # 渲染数学公式
-        image_data = math_service.latex_to_image(
-            request.formula, 
-            font_size=request.font_size
-        )
+        # 在公式渲染进程中渲染数学公式
+        image_data = await formula_pool.run(render_image, request.formula, request.font_size, output_format)
         
         if image_data:
             # 将图片数据编码为base64
@@ -49,7 +73,8 @@ async def render_math_formula(request: MathFormulaRequest):
             
             return MathFormulaResponse(
                 success=True,
-                image_data=image_base64
+                image_data=image_base64,
+                url=_formula_url(image_cache_key(request.formula, request.font_size, output_format))
             )
         else:
             return MathFormulaResponse(
@@ -61,6 +86,161 @@ async def render_math_formula(request: MathFormulaRequest):
         raise HTTPException(status_code=500, detail=f"数学公式渲染错误: {str(e)}")
 
 
+class BatchFormulaItem(BaseModel):
+    """批量渲染中的单个公式"""
+    formula: str
+    font_size: Optional[int] = 12
+
+
+class MathBatchRequest(BaseModel):
+    """批量渲染数学公式请求模型"""
+    formulas: List[BatchFormulaItem]
+
+
+def _multipart_body(parts: List[Tuple[str, str, str, bytes]], boundary: str) -> bytes:
+    """把 (字段名, 文件名, 内容类型, 数据) 列表编码为 multipart/form-data 响应体"""
+    chunks = []
+    for name, filename, content_type, data in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename:
+            disposition += f'; filename="{filename}"'
+        chunks.append(
+            f"--{boundary}\r\nContent-Disposition: {disposition}\r\n"
+            f"Content-Type: {content_type}\r\n\r\n".encode('utf-8')
+        )
+        chunks.append(data)
+        chunks.append(b"\r\n")
+    chunks.append(f"--{boundary}--\r\n".encode('utf-8'))
+    return b"".join(chunks)
+
+
+@router.post("/render-batch")
+async def render_math_formula_batch(request: MathBatchRequest):
+    """
+    批量渲染LaTeX数学公式为图片
+
+    重复的公式只渲染一次，各公式在公式渲染进程中并发渲染。
+    响应为 multipart/form-data（浏览器可直接用 response.formData() 解析）：
+    "results" 字段是按请求顺序排列的JSON结果列表，每项的 part 指向图片所在的字段，
+    相同公式的结果指向同一个图片字段
+
+    Args:
+        request: 包含公式和字号列表的请求
+
+    Returns:
+        包含结果列表和PNG图片的multipart响应
+    """
+    if len(request.formulas) > settings.MATH_BATCH_MAX_FORMULAS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"单次最多渲染 {settings.MATH_BATCH_MAX_FORMULAS} 个公式"
+        )
+
+    try:
+        keys = [(item.formula, item.font_size) for item in request.formulas]
+        images = await formula_pool.render_images(keys)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"数学公式渲染错误: {str(e)}")
+
+    parts = []
+    part_names = {}
+    for key, image_data in images.items():
+        if image_data:
+            name = f"formula-{len(part_names)}"
+            part_names[key] = name
+            parts.append((name, f"{name}.png", "image/png", image_data))
+
+    results = []
+    for key in keys:
+        name = part_names.get(key)
+        results.append({
+            "formula": key[0],
+            "font_size": key[1],
+            "success": name is not None,
+            "part": name,
+            "url": _formula_url(image_cache_key(*key)) if name else None,
+            "error": None if name else "数学公式渲染失败"
+        })
+
+    results_part = ("results", None, "application/json", json.dumps(results, ensure_ascii=False).encode('utf-8'))
+    boundary = uuid.uuid4().hex
+    return Response(
+        content=_multipart_body([results_part] + parts, boundary),
+        media_type=f"multipart/form-data; boundary={boundary}"
+    )
+
+
+class MathValidateRequest(BaseModel):
+    """公式语法校验请求模型（formula 和 content 至少提供一个）"""
+    formula: Optional[str] = None
+    content: Optional[str] = None  # 整篇Markdown内容
+
+
+class MathValidateResponse(BaseModel):
+    """公式语法校验响应模型"""
+    valid: bool
+    errors: List[dict] = []  # 错误信息和出错位置，校验文档时还包括行号、列号
+
+
+@router.post("/validate", response_model=MathValidateResponse)
+async def validate_math_formula(request: MathValidateRequest):
+    """
+    校验LaTeX公式语法
+
+    只运行公式解析器，不生成图片，适合编辑时逐字校验。
+    解析只需几毫秒，直接在API进程中进行而不经过公式渲染进程，相同公式的校验结果缓存在API进程中
+
+    Args:
+        request: 单个公式或整篇Markdown内容
+
+    Returns:
+        是否有效以及语法错误列表
+    """
+    if request.formula is None and request.content is None:
+        raise HTTPException(status_code=400, detail="请提供公式或文档内容")
+
+    try:
+        loop = asyncio.get_event_loop()
+        errors = await loop.run_in_executor(None, validate_math, request.formula, request.content)
+        return MathValidateResponse(valid=not errors, errors=errors)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"公式校验错误: {str(e)}")
+
+
+@router.get("/formula/{filename}")
+async def get_formula_image(filename: str, if_none_match: Optional[str] = Header(None)):
+    """
+    按内容摘要获取已渲染的公式图片
+
+    地址来自 /render、/render-batch 返回的 url，摘要包含公式、字号和渲染版本，
+    同一地址的内容永远不变，因此返回强ETag和immutable缓存头，由浏览器和nginx长期缓存。
+    缓存中已淘汰的公式返回404，需重新调用渲染接口
+
+    Args:
+        filename: 公式图片文件名（摘要.扩展名）
+
+    Returns:
+        图片的原始字节
+    """
+    match = _FORMULA_FILENAME_PATTERN.match(filename)
+    if not match:
+        raise HTTPException(status_code=404, detail="公式图片不存在")
+
+    digest, extension = match.groups()
+    headers = {"ETag": f'"{digest}"', "Cache-Control": _IMMUTABLE_CACHE_CONTROL}
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if headers["ETag"] in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+
+    data = formula_cache.get(filename)
+    if data is None:
+        raise HTTPException(status_code=404, detail="公式图片不存在，请重新渲染")
+
+    return Response(content=data, media_type=_FORMULA_MEDIA_TYPES[extension], headers=headers)
+
+
 @router.get("/test")
 async def test_math_rendering():
     """
@@ -71,7 +251,7 @@ async def test_math_rendering():
     """
     try:
         # 测试基本功能
-        test_result = math_service.test_math_rendering()
+        test_result = await formula_pool.run(test_rendering)
         
         if test_result:
             return {
@@ -113,20 +293,20 @@ async def render_fraction(request: FractionRequest):
         包含base64编码图片数据的响应
     """
     try:
-        # 渲染分数
-        image_data = math_service.create_fraction_image(
-            request.numerator,
-            request.denominator,
-            font_size=request.font_size
+        # 在公式渲染进程中渲染分数
+        image_data = await formula_pool.run(
+            render_fraction_image, request.numerator, request.denominator, request.font_size
         )
         
         if image_data:
             # 将图片数据编码为base64
             image_base64 = base64.b64encode(image_data).decode('utf-8')
             
+            formula, font_size = fraction_formula(request.numerator, request.denominator, request.font_size)
             return MathFormulaResponse(
                 success=True,
-                image_data=image_base64
+                image_data=image_base64,
+                url=_formula_url(image_cache_key(formula, font_size))
             )
         else:
             return MathFormulaResponse(
@@ -153,7 +333,7 @@ class ProcessMarkdownResponse(BaseModel):
 @router.post("/process-markdown", response_model=ProcessMarkdownResponse)
 async def process_markdown_math(request: ProcessMarkdownRequest):
     """
-    处理Markdown内容中的数学公式
+    处理Markdown内容中的数学公式，公式替换为 /api/math/formula/ 下的图片地址
     
     Args:
         request: 包含Markdown内容的请求
@@ -163,7 +343,7 @@ async def process_markdown_math(request: ProcessMarkdownRequest):
     """
     try:
         # 处理Markdown中的数学公式
-        processed_content = math_service.process_markdown_math(request.content)
+        processed_content = await formula_pool.run(process_markdown, request.content)
         
         return ProcessMarkdownResponse(
             success=True,
@@ -2,30 +2,42 @@
 PDF生成API端点
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import FileResponse
 import os
 import time
 
 from app.models.schemas import PDFGenerationRequest, PDFGenerationResponse
-from app.services.pdf_service import PDFService
+from app.services.render_service import render_service, RenderCancelledError, RenderLimitError
+from app.services.render_pool import render_pool
+from app.services.render_cost import estimate_render_cost
 
 router = APIRouter()
 
+
+def _create_pdf_service():
+    """创建PDF服务，首次使用时才导入（ReportLab、Markdown等依赖较重，不拖慢API进程启动）"""
+    from app.services.pdf_service import PDFService
+    return PDFService()
+
+
 @router.post("/generate", response_model=PDFGenerationResponse)
-async def generate_pdf(request: PDFGenerationRequest):
+async def generate_pdf(request: PDFGenerationRequest, http_request: Request):
     """
     生成PDF文件
     """
     try:
         start_time = time.time()
         
-        pdf_service = PDFService()
-        pdf_path = await pdf_service.generate_pdf(
-            content=request.content,
-            config=request.layout_config,
-            filename=request.filename
-        )
+        pdf_service = _create_pdf_service()
+        async with render_service.track(request.render_id, http_request) as cancel_token:
+            pdf_path = await pdf_service.generate_pdf(
+                content=request.content,
+                config=request.layout_config,
+                filename=request.filename,
+                cancel_token=cancel_token,
+                sharded=request.sharded
+            )
         
         # 获取文件信息
         file_size = os.path.getsize(pdf_path)
@@ -45,6 +57,10 @@ async def generate_pdf(request: PDFGenerationRequest):
             message="PDF生成成功"
         )
         
+    except RenderCancelledError as e:
+        raise HTTPException(status_code=409, detail=f"PDF生成已取消: {str(e)}")
+    except RenderLimitError as e:
+        raise HTTPException(status_code=422, detail=f"PDF生成超出资源限制: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"PDF生成失败: {str(e)}")
 
@@ -54,7 +70,7 @@ async def download_pdf(filename: str):
     下载PDF文件
     """
     try:
-        pdf_service = PDFService()
+        pdf_service = _create_pdf_service()
         pdf_path = pdf_service.get_pdf_path(filename)
         
         if not os.path.exists(pdf_path):
@@ -72,16 +88,22 @@ async def download_pdf(filename: str):
         raise HTTPException(status_code=500, detail=f"文件下载失败: {str(e)}")
 
 @router.post("/preview")
-async def preview_pdf(request: PDFGenerationRequest):
+async def preview_pdf(request: PDFGenerationRequest, http_request: Request):
     """
     生成PDF预览（返回base64编码的PDF数据）
+
+    客户端断开连接、调用取消接口或以相同render_id发起新预览时，
+    正在进行的渲染会被中止
     """
     try:
-        pdf_service = PDFService()
-        pdf_data = await pdf_service.generate_pdf_preview(
-            content=request.content,
-            config=request.layout_config
-        )
+        pdf_service = _create_pdf_service()
+        async with render_service.track(request.render_id, http_request) as cancel_token:
+            pdf_data = await pdf_service.generate_pdf_preview(
+                content=request.content,
+                config=request.layout_config,
+                cancel_token=cancel_token,
+                sharded=request.sharded
+            )
         
         return {
             "success": True,
@@ -89,16 +111,57 @@ async def preview_pdf(request: PDFGenerationRequest):
             "message": "预览生成成功"
         }
         
+    except RenderCancelledError as e:
+        raise HTTPException(status_code=409, detail=f"预览已取消: {str(e)}")
+    except RenderLimitError as e:
+        raise HTTPException(status_code=422, detail=f"预览超出资源限制: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"预览生成失败: {str(e)}")
 
+@router.post("/cancel/{render_id}")
+async def cancel_render(render_id: str):
+    """
+    取消正在进行的渲染任务
+    """
+    cancelled = render_service.cancel(render_id)
+
+    return {
+        "success": True,
+        "cancelled": cancelled,
+        "message": "渲染已取消" if cancelled else "没有正在进行的渲染任务"
+    }
+
+@router.post("/estimate")
+async def estimate_render(request: PDFGenerationRequest):
+    """
+    估算文档的渲染成本及调度通道
+    """
+    estimate = estimate_render_cost(request.content)
+
+    return {
+        "success": True,
+        "estimate": estimate.to_dict(),
+        "lane": render_pool.lane_for(estimate.seconds)
+    }
+
+@router.get("/workers")
+async def render_workers_status():
+    """
+    获取渲染进程池状态
+    """
+    return {
+        "success": True,
+        "enabled": render_pool.enabled,
+        "stats": render_pool.stats()
+    }
+
 @router.get("/list")
 async def list_pdfs():
     """
     获取已生成的PDF列表
     """
     try:
-        pdf_service = PDFService()
+        pdf_service = _create_pdf_service()
         pdfs = pdf_service.list_generated_pdfs()
         
         return {
@@ -116,7 +179,7 @@ async def delete_pdf(filename: str):
     删除PDF文件
     """
     try:
-        pdf_service = PDFService()
+        pdf_service = _create_pdf_service()
         success = pdf_service.delete_pdf(filename)
         
         if not success:
@@ -35,6 +35,49 @@ class Settings(BaseSettings):
         "right": "2cm"
     }
 
+    # 渲染进程池设置
+    # 每个API工作进程的渲染进程数，0表示在API进程的线程池中渲染；
+    # 进程数随 WEB_CONCURRENCY 成倍增加，默认不启用，由部署按核数设置
+    RENDER_WORKERS: int = 0
+    RENDER_JOB_TIMEOUT: float = 120.0  # 单次渲染的最长时间(秒)
+    RENDER_JOB_MAX_RSS_MB: int = 1536  # 渲染过程中进程内存上限(MB)，超出即终止
+    RENDER_WORKER_MAX_JOBS: int = 50  # 渲染进程处理多少个任务后回收
+    RENDER_WORKER_RECYCLE_RSS_MB: int = 768  # 任务结束后进程内存超过此值(MB)则回收
+    RENDER_CANCEL_GRACE: float = 2.0  # 取消后等待协作式停止的时间(秒)，超时则终止进程
+    RENDER_BATCH_WORKERS: int = 1  # 批处理通道专用进程数（总会保留至少一个交互进程）
+    RENDER_BATCH_COST_THRESHOLD: float = 15.0  # 估算耗时(秒)超过此值的文档进入批处理通道
+    RENDER_QUEUE_AGING_RATE: float = 1.0  # 排队每等待1秒抵扣的估算成本(秒)，防止大任务饥饿
+
+    # 章节片段缓存设置（分片渲染时复用未改动章节的排版结果）
+    FRAGMENT_CACHE_DIR: str = "fragment_cache"
+    FRAGMENT_CACHE_MAX_MB: int = 1024  # 缓存容量上限(MB)，超出后淘汰最久未使用的片段
+
+    # 段落断行结果缓存的条目数（相同段落复用断行结果）
+    PARAGRAPH_LAYOUT_CACHE_SIZE: int = 4096
+
+    # 公式渲染结果缓存设置（公式图片和矢量轮廓，各进程共用）
+    FORMULA_CACHE_DIR: str = "formula_cache"
+    FORMULA_CACHE_MAX_MB: int = 256  # 磁盘缓存容量上限(MB)，超出后淘汰最久未使用的公式
+    FORMULA_CACHE_MEMORY_ITEMS: int = 2048  # 每个进程内存中保留的公式数
+
+    # 公式渲染进程数（数学公式API和生成PDF前的公式预渲染共用），
+    # 0表示数学公式API在API进程的线程池中渲染，PDF中的公式在排版时逐个渲染
+    FORMULA_WORKERS: int = 0
+    MATH_BATCH_MAX_FORMULAS: int = 500  # 批量渲染接口单次请求的公式数上限
+
+    # 渲染进程和公式渲染进程的启动方式，默认在支持的平台（Linux等）上使用forkserver——
+    # 由完成预加载的forkserver进程fork出各进程，共享已导入的依赖、已注册的字体和公式解析器；
+    # 不支持forkserver时（如Windows）退回spawn，设为spawn可强制每个进程重新导入
+    WORKER_START_METHOD: str = "forkserver"
+
+    # 启动预热：注册字体、启动并预热公式渲染进程和PDF渲染进程、试渲染一份小文档，
+    # 预热完成前 /ready 返回503，负载均衡不会把请求转发到未预热的实例
+    WARMUP_ENABLED: bool = True
+    # 多个API工作进程时全部完成预热才报告就绪：各进程预热完成后在目录中写入以进程号命名的标记文件，
+    # gunicorn主进程启动时按工作进程数设置 READY_WORKERS 并清空标记目录
+    READY_WORKERS: int = 1
+    READY_MARKER_DIR: str = "ready_workers"
+
     # 字体设置
     FONT_DIR: str = "fonts"
     DEFAULT_FONT: str = "NotoSansCJK-Regular.ttc"
@@ -3,13 +3,31 @@ PrintMind 后端主应用
 支持文档上传、排版配置、PDF生成等功能
 """
 
+import asyncio
+import sys
+import time
+
+# 记录启动时各阶段的导入耗时；matplotlib、ReportLab等重型依赖在首次使用时才导入
+_import_started = time.perf_counter()
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 import os
 
+_framework_imported = time.perf_counter()
+
 from app.api import documents, pdf, fonts, ai, math
 from app.core.config import settings
+from app.services.render_pool import render_pool
+from app.services.formula_pool import formula_pool
+from app.services.warmup import warmup_service
+
+_app_imported = time.perf_counter()
+
+# 启动报告中检查是否已被导入的重型依赖
+_HEAVY_MODULES = ("matplotlib", "numpy", "reportlab", "markdown", "docx", "aiohttp", "PIL")
 
 # 创建FastAPI应用实例
 app = FastAPI(
@@ -40,6 +58,29 @@ app.include_router(fonts.router, prefix="/api/fonts", tags=["fonts"])
 app.include_router(ai.router, prefix="/api/ai", tags=["ai"])
 app.include_router(math.router, prefix="/api/math", tags=["math"])
 
+@app.on_event("startup")
+async def report_startup_imports():
+    """输出启动导入耗时，以及是否有重型依赖被提前导入"""
+    loaded = [name for name in _HEAVY_MODULES if name in sys.modules]
+    print(f"API进程导入耗时 {(_app_imported - _import_started) * 1000:.0f}ms"
+          f"（框架 {(_framework_imported - _import_started) * 1000:.0f}ms，"
+          f"应用 {(_app_imported - _framework_imported) * 1000:.0f}ms），"
+          f"已导入的重型依赖: {', '.join(loaded) or '无'}")
+
+@app.on_event("startup")
+async def start_warmup():
+    """在后台执行预热，完成前 /ready 返回503"""
+    if settings.WARMUP_ENABLED:
+        app.state.warmup_task = asyncio.create_task(warmup_service.run())
+    else:
+        warmup_service.skip()
+
+@app.on_event("shutdown")
+async def shutdown_render_pool():
+    """关闭渲染进程池和公式预渲染进程池"""
+    render_pool.shutdown()
+    formula_pool.shutdown()
+
 @app.get("/")
 async def root():
     """根路径健康检查"""
@@ -50,6 +91,14 @@ async def health_check():
     """健康检查端点"""
     return {"status": "healthy", "service": "PrintMind API"}
 
+@app.get("/ready")
+async def readiness_check():
+    """就绪检查端点：预热完成前或渲染进程启动失败时返回503，供负载均衡判断实例能否接收请求"""
+    status = warmup_service.status()
+    if not warmup_service.all_ready:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -73,6 +73,8 @@ class PDFGenerationRequest(BaseModel):
     content: str
     layout_config: LayoutConfig
     filename: Optional[str] = None
+    render_id: Optional[str] = Field(default=None, description="渲染任务ID，相同ID的新请求会取消仍在进行的旧渲染")
+    sharded: bool = Field(default=False, description="按一级标题分片并行渲染，每章从新的一页开始，未改动的章节复用缓存")
 
 class PDFGenerationResponse(BaseModel):
     """PDF生成响应"""
@@ -3,7 +3,6 @@ Doubao AI 服务
 提供对话、图像分析等AI功能
 """
 
-import aiohttp
 import asyncio
 import base64
 import json
@@ -38,7 +37,10 @@ class DoubaoAIService:
             "max_tokens": self.max_tokens,
             "temperature": self.temperature
         }
-        
+
+        # aiohttp只在调用AI接口时导入，不拖慢API进程启动
+        import aiohttp
+
         try:
             async with aiohttp.ClientSession() as session:
                 async with session.post(
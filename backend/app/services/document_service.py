@@ -5,7 +5,6 @@
 
 import os
 import aiofiles
-from docx import Document
 from typing import Optional
 import re
 
@@ -58,6 +57,9 @@ class DocumentService:
     
     async def _convert_docx_to_markdown(self, file_path: str) -> str:
         """将DOCX文件转换为Markdown"""
+        # python-docx只在转换DOCX时导入
+        from docx import Document
+
         try:
             doc = Document(file_path)
             markdown_lines = []
@@ -0,0 +1,139 @@
+"""
+公式渲染结果缓存
+按 公式 + 字号 + 分辨率 + 渲染版本 的稳定摘要缓存公式图片和矢量轮廓，
+内存LRU之下是磁盘缓存，不同进程、服务重启后都能命中，
+数学公式API和PDF渲染共用同一份缓存
+"""
+
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from app.core.config import settings
+
+# 每写入多少个文件检查一次磁盘容量
+_PRUNE_INTERVAL = 256
+
+# 公式图片的访问地址前缀，后接 output_key() 得到的缓存键
+FORMULA_URL_PREFIX = "/api/math/formula/"
+
+# 渲染结果发生变化时递增，使缓存中旧的公式失效
+PNG_RENDER_VERSION = 3
+VECTOR_RENDER_VERSION = 1
+
+
+class FormulaCache:
+    """公式渲染结果的两级缓存（内存LRU + 磁盘）"""
+
+    def __init__(self, cache_dir: str, max_bytes: int, memory_items: int):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(kind: str, formula: str, font_size: float, dpi: Optional[int] = None, version: int = 1) -> str:
+        """缓存键：公式和渲染参数的稳定摘要，kind 是渲染结果的文件扩展名（png、json）"""
+        digest = hashlib.sha256(f"{kind}\0v{version}\0{font_size!r}\0{dpi!r}\0{formula}".encode('utf-8'))
+        return f"{digest.hexdigest()}.{kind}"
+
+    def output_key(self, formula: str, font_size: float, output_format: str = 'png') -> str:
+        """公式输出文件的缓存键：PNG按300dpi渲染，矢量轮廓(json)、SVG、PDF与分辨率无关"""
+        if output_format == 'png':
+            return self.key('png', formula, font_size, 300, PNG_RENDER_VERSION)
+        return self.key(output_format, formula, font_size, None, VECTOR_RENDER_VERSION)
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """读取缓存内容，磁盘命中时放入内存并刷新修改时间用于LRU淘汰"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+
+        path = self.path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+
+        self._remember(key, data)
+        return data
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            if key in self._memory:
+                return True
+        return os.path.exists(self.path_for(key))
+
+    def put(self, key: str, data: bytes) -> str:
+        """写入缓存，先写临时文件再原子替换，并发写入同一公式时不会读到不完整的文件"""
+        self._remember(key, data)
+
+        path = self.path_for(key)
+        temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        with self._lock:
+            self._puts += 1
+            should_prune = self._puts % _PRUNE_INTERVAL == 0
+        if should_prune:
+            self.prune()
+        return path
+
+    def _remember(self, key: str, data: bytes):
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def prune(self):
+        """超过容量上限时按最近使用时间淘汰磁盘上的旧文件"""
+        entries = []
+        total = 0
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith('.tmp'):
+                continue
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+# 全局实例
+formula_cache = FormulaCache(
+    settings.FORMULA_CACHE_DIR,
+    settings.FORMULA_CACHE_MAX_MB * 1024 * 1024,
+    settings.FORMULA_CACHE_MEMORY_ITEMS
+)
@@ -0,0 +1,249 @@
+"""
+公式渲染进程池
+matplotlib的公式排版占用CPU且不是线程安全的，数学公式API和PDF公式预渲染都在独立进程中执行，
+不阻塞事件循环，并能利用多个CPU核心。
+生成PDF前先收集文档中所有不重复的 (公式, 字号)，并发转换为矢量轮廓并写入公式缓存，
+排版时从缓存直接取用，相同公式在整个文档中只转换一次。
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import settings
+from .formula_cache import formula_cache
+from .preload import worker_context
+
+# 公式预渲染每批提交的公式数（每个进程），批次之间检查是否已取消
+PRERENDER_BATCH_PER_WORKER = 8
+
+
+def _vector_cache_key(formula: str, font_size: float) -> str:
+    return formula_cache.output_key(formula, font_size, 'json')
+
+
+def image_cache_key(formula: str, font_size: int, output_format: str = 'png') -> str:
+    """公式输出文件的缓存键，也是 /api/math/formula/ 下的文件名"""
+    return formula_cache.output_key(formula, font_size, output_format)
+
+
+def render_formula(formula: str, font_size: float) -> bool:
+    """把公式转换为矢量轮廓写入公式缓存，返回是否转换成功"""
+    # 在子进程中导入，避免主进程为预渲染加载matplotlib
+    from .math_service import math_service
+
+    return math_service.latex_to_vector(formula, font_size) is not None
+
+
+def render_image(formula: str, font_size: int, output_format: str = 'png') -> Optional[bytes]:
+    """把公式渲染为PNG图片，或由矢量轮廓生成SVG、PDF"""
+    from .math_service import math_service
+
+    if output_format == 'svg':
+        return math_service.latex_to_svg(formula, font_size)
+    if output_format == 'pdf':
+        return math_service.latex_to_pdf(formula, font_size)
+    return math_service.latex_to_image(formula, font_size=font_size)
+
+
+def fraction_formula(numerator: str, denominator: str, font_size: int) -> Tuple[str, float]:
+    """分数接口对应的 (公式, 字号)：分数按1.5倍字号渲染，与公式接口共用缓存"""
+    fraction_size = font_size * 3 / 2
+    if fraction_size == int(fraction_size):
+        fraction_size = int(fraction_size)
+    return f"\\frac{{{numerator}}}{{{denominator}}}", fraction_size
+
+
+def render_fraction_image(numerator: str, denominator: str, font_size: int) -> Optional[bytes]:
+    """把分数渲染为PNG图片"""
+    from .math_service import math_service
+
+    formula, fraction_size = fraction_formula(numerator, denominator, font_size)
+    return math_service.latex_to_image(formula, font_size=fraction_size)
+
+
+def process_markdown(content: str) -> str:
+    """把Markdown中的公式替换为公式图片引用"""
+    from .math_service import math_service
+
+    return math_service.process_markdown_math(content)
+
+
+def validate_math(formula: Optional[str], content: Optional[str]) -> List[dict]:
+    """只解析不渲染，检查单个公式或整篇Markdown中公式的语法，返回错误列表（在API进程中调用）"""
+    from .math_service import math_service
+
+    errors = []
+    if formula is not None:
+        error = math_service.validate_formula(formula)
+        if error is not None:
+            errors.append(dict(error, formula=formula))
+    if content is not None:
+        errors.extend(math_service.validate_markdown_math(content))
+    return errors
+
+
+def warm_math():
+    """初始化当前进程的公式渲染（字体缓存、解析器、公式字体）"""
+    from .math_service import math_service
+
+    math_service.warmup()
+
+
+def _init_worker():
+    """公式渲染进程启动时先完成初始化，首个请求不再承担这部分开销"""
+    if settings.WARMUP_ENABLED:
+        warm_math()
+
+
+def _noop():
+    return None
+
+
+def test_rendering() -> bool:
+    """渲染几个示例公式，检查公式渲染功能"""
+    from .math_service import math_service
+
+    return math_service.test_math_rendering()
+
+
+@lru_cache(maxsize=2048)
+def load_formula(formula: str, font_size: float):
+    """排版使用的矢量公式：已预渲染时从缓存读取，否则现场转换，转换失败返回None"""
+    from .math_service import math_service
+
+    return math_service.latex_to_vector(formula, font_size)
+
+
+class FormulaRenderPool:
+    """公式渲染进程池
+
+    渲染进程是守护进程，不能再创建子进程，因此预渲染在API进程中进行，
+    渲染进程排版时从公式缓存的磁盘层读取结果。
+    进程数为0时在API进程的线程池中渲染，由math_service内部的锁保证逐个解析
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.size,
+                    mp_context=worker_context(),
+                    initializer=_init_worker
+                )
+            return self._executor
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """在渲染进程中执行公式渲染函数（未启用时使用线程池），不阻塞事件循环"""
+        loop = asyncio.get_event_loop()
+        if not self.enabled:
+            return await loop.run_in_executor(None, func, *args)
+
+        executor = self._get_executor()
+        try:
+            return await loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            # 渲染进程异常退出，下次使用时重建进程池
+            self._reset(executor)
+            raise
+
+    async def render_images(self, requests: Iterable[Tuple[str, int]]) -> Dict[Tuple[str, int], Optional[bytes]]:
+        """并发把 (公式, 字号) 列表渲染为PNG图片，返回 {(公式, 字号): 图片数据}，渲染失败的为None
+
+        重复的请求只渲染一次，公式缓存中已有的图片直接在当前进程读取
+        """
+        images = {}
+        pending = []
+        for request in dict.fromkeys(requests):
+            image_data = formula_cache.get(image_cache_key(*request))
+            if image_data is not None:
+                images[request] = image_data
+            else:
+                pending.append(request)
+
+        results = await asyncio.gather(*[
+            self.run(render_image, formula, font_size) for formula, font_size in pending
+        ], return_exceptions=True)
+
+        for request, result in zip(pending, results):
+            if isinstance(result, BaseException):
+                print(f"公式渲染失败: {request[0]}: {result}")
+                result = None
+            images[request] = result
+        return images
+
+    async def render(self, requests: Iterable[Tuple[str, float]], cancel_token=None) -> List[Tuple[str, float]]:
+        """并发转换 (公式, 字号) 列表，返回已在缓存中的 (公式, 字号)
+
+        重复的请求只转换一次，缓存中已有的公式不再转换。
+        公式分批提交，cancel_token 被取消后不再提交剩余的公式
+        """
+        cached = []
+        pending = []
+        for request in dict.fromkeys(requests):
+            if formula_cache.contains(_vector_cache_key(*request)):
+                cached.append(request)
+            else:
+                pending.append(request)
+
+        if not pending:
+            return cached
+
+        executor = self._get_executor()
+        loop = asyncio.get_event_loop()
+        batch_size = self.size * PRERENDER_BATCH_PER_WORKER
+        for start in range(0, len(pending), batch_size):
+            if cancel_token is not None and cancel_token.cancelled:
+                break
+            batch = pending[start:start + batch_size]
+            results = await asyncio.gather(*[
+                loop.run_in_executor(executor, render_formula, formula, font_size)
+                for formula, font_size in batch
+            ], return_exceptions=True)
+
+            for request, result in zip(batch, results):
+                if isinstance(result, BrokenProcessPool):
+                    # 渲染进程异常退出，下次使用时重建进程池
+                    self._reset(executor)
+                elif isinstance(result, BaseException):
+                    print(f"公式预渲染失败: {request[0]}: {result}")
+                elif result:
+                    cached.append(request)
+        return cached
+
+    async def warmup(self):
+        """启动全部公式渲染进程并等待其完成初始化；未启用进程池时在API进程中初始化"""
+        if not self.enabled:
+            await self.run(warm_math)
+            return
+        # 同时提交与进程数相同的任务，进程池会逐个创建进程，而每个进程先执行初始化
+        await asyncio.gather(*[self.run(_noop) for _ in range(self.size)])
+
+    def _reset(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        """关闭进程池"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 全局实例
+formula_pool = FormulaRenderPool(settings.FORMULA_WORKERS)
@@ -0,0 +1,111 @@
+"""
+章节PDF片段缓存
+按 章节内容 + 排版配置 + 引用的图片文件 + 渲染版本 的哈希缓存只含内容的PDF片段，
+分片渲染时直接复用已缓存的章节，再统一拼接页码和页眉
+"""
+
+import hashlib
+import os
+import shutil
+import uuid
+from typing import Iterable
+
+from app.core.config import settings
+from app.models.schemas import LayoutConfig
+
+# 排版结果发生变化时递增，使旧的片段缓存失效
+RENDER_VERSION = 8
+
+
+def _link_or_copy(source: str, dest: str):
+    """建立硬链接，文件系统不支持时复制"""
+    try:
+        os.link(source, dest)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(source, dest)
+
+
+class FragmentCache:
+    """章节PDF片段的磁盘缓存"""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, content: str, config: LayoutConfig, dependencies: Iterable[tuple] = ()) -> str:
+        """计算片段的缓存键，dependencies 是章节引用的外部文件的状态（如图片的修改时间和大小）"""
+        digest = hashlib.sha256()
+        digest.update(f"v{RENDER_VERSION}\0".encode('utf-8'))
+        digest.update(config.model_dump_json().encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(repr(list(dependencies)).encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(content.encode('utf-8'))
+        return digest.hexdigest()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pdf")
+
+    def temp_path_for(self, key: str) -> str:
+        """渲染中的临时文件路径，完成后通过 put() 原子地放入缓存"""
+        return os.path.join(self.cache_dir, f"{key}.{uuid.uuid4().hex[:8]}.tmp")
+
+    def checkout(self, key: str, dest_path: str) -> bool:
+        """把已缓存的片段链接到 dest_path 供当前任务使用，返回是否命中
+
+        之后其他请求的 prune() 删除缓存文件也不影响当前任务读取，命中时刷新修改时间用于LRU淘汰
+        """
+        path = self.path_for(key)
+        try:
+            _link_or_copy(path, dest_path)
+        except OSError:
+            return False
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return True
+
+    def put(self, key: str, temp_path: str) -> str:
+        """把渲染完成的临时文件放入缓存，temp_path 保留给当前任务使用"""
+        path = self.path_for(key)
+        staging_path = self.temp_path_for(key)
+        try:
+            _link_or_copy(temp_path, staging_path)
+            os.replace(staging_path, path)
+        finally:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+        return path
+
+    def prune(self):
+        """超过容量上限时按最近使用时间淘汰旧片段"""
+        entries = []
+        total = 0
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.pdf'):
+                continue
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+# 全局实例
+fragment_cache = FragmentCache(settings.FRAGMENT_CACHE_DIR, settings.FRAGMENT_CACHE_MAX_MB * 1024 * 1024)
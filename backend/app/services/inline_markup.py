@@ -0,0 +1,134 @@
+"""
+行内标记渲染
+把行内语法（字体span、（（…））、粗体、斜体、连续空格、行内公式）
+一次扫描转换为ReportLab段落标记，正文段落和答案解析框共用
+"""
+
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 行内语法：字体span和（（…））整体匹配，内容递归转换；
+# *、_ 连续出现的标记按行配对为粗体或斜体，连续空格转换为&nbsp;
+_INLINE_PATTERN = re.compile(
+    r'<span style="font-family:\s*(?P<font>[^"]+)">(?P<font_text>.*?)</span>'
+    r'|（（(?P<emphasis>.*?)））'
+    r'|(?P<markers>\*+|_+)'
+    r'|(?P<spaces>  +)'
+    r'|(?P<newline>\n)'
+)
+
+# 行内公式 $...$
+_MATH_PATTERN = re.compile(r'\$([^$\n]+?)\$')
+
+# 答案框中替换为标签图片的文字
+_ANSWER_LABEL_PATTERN = re.compile(r'(答案：|解析：)')
+_ANSWER_LABEL_PARTS = {
+    '答案：': 'answer_image',
+    '解析：': 'key_point_image',
+}
+
+
+def _pair_markers(parts: List[str], runs: Dict[str, List[List[int]]]):
+    """把一行内的 *、_ 标记替换为粗体、斜体标签，并清空 runs
+
+    与依次替换 **…**、__…__、*…*、_…_ 的结果一致：每个连续段从左到右切分为两个字符的粗体标记，
+    粗体标记按顺序两两配对，多出的最后一个粗体标记和剩余的单个字符再按顺序两两配对为斜体，
+    仍未配对的字符保留原样
+    """
+    for marker_runs in runs.values():
+        bold_markers = [run[i:i + 2] for run in marker_runs for i in range(0, len(run) - 1, 2)]
+        singles = [run[-1] for run in marker_runs if len(run) % 2]
+        if len(bold_markers) % 2:
+            singles.extend(bold_markers.pop())
+            singles.sort()
+
+        for i in range(0, len(bold_markers), 2):
+            opening, closing = bold_markers[i], bold_markers[i + 1]
+            parts[opening[0]], parts[opening[1]] = '<b>', ''
+            parts[closing[0]], parts[closing[1]] = '</b>', ''
+        for i in range(0, len(singles) - 1, 2):
+            parts[singles[i]], parts[singles[i + 1]] = '<i>', '</i>'
+        marker_runs.clear()
+
+
+class InlineMarkupRenderer:
+    """行内标记渲染器
+
+    map_font 把span中的font-family映射为已注册字体，
+    emphasis_font 是（（…））使用的楷体字体，
+    replace_math 为True时把行内公式替换为占位文字。
+    转换结果按文本做LRU缓存，重复出现的片段（如固定的题目说明）只转换一次。
+    """
+
+    def __init__(self, map_font: Callable[[str], str], emphasis_font: str,
+                 replace_math: bool = False, cache_size: int = 4096):
+        self.map_font = map_font
+        self.emphasis_font = emphasis_font
+        self.replace_math = replace_math
+        self.render = lru_cache(maxsize=cache_size)(self._render)
+
+    def _render(self, text: str) -> str:
+        if self.replace_math and '$' in text:
+            text = _MATH_PATTERN.sub('[数学公式]', text)
+        return self._convert(text)
+
+    def _convert(self, text: str) -> str:
+        if not text:
+            return text
+
+        parts: List[str] = []
+        # 当前行中各标记字符的连续段，元素为标记字符在 parts 中的下标
+        runs: Dict[str, List[List[int]]] = {'*': [], '_': []}
+        position = 0
+        for match in _INLINE_PATTERN.finditer(text):
+            parts.append(text[position:match.start()])
+            position = match.end()
+
+            font = match.group('font')
+            if font is not None:
+                parts.append(f'<font name="{self.map_font(font)}">{self._convert(match.group("font_text"))}</font>')
+                continue
+
+            emphasis = match.group('emphasis')
+            if emphasis is not None:
+                # 橘色楷体文字，保留一个括号
+                parts.append(f'<font color="#FF8C00" name="{self.emphasis_font}">（{self._convert(emphasis)}）</font>')
+                continue
+
+            markers = match.group('markers')
+            if markers is not None:
+                runs[markers[0]].append(list(range(len(parts), len(parts) + len(markers))))
+                parts.extend(markers)
+                continue
+
+            spaces = match.group('spaces')
+            if spaces is not None:
+                # 保留多个空格：连续空格转换为&nbsp;，单个空格不变
+                parts.append('&nbsp;' * len(spaces))
+                continue
+
+            # 标记不跨行配对
+            _pair_markers(parts, runs)
+            parts.append(match.group())
+
+        parts.append(text[position:])
+        _pair_markers(parts, runs)
+        return ''.join(parts)
+
+    def split_answer_labels(self, text: str) -> List[Tuple[str, Optional[str]]]:
+        """把"答案："和"解析："拆分为标签图片
+
+        返回 ('text', 转换后的文本)、('answer_image', None)、('key_point_image', None) 的混合列表
+        """
+        parts = []
+        segments = _ANSWER_LABEL_PATTERN.split(text)
+        has_labels = len(segments) > 1
+
+        for index, segment in enumerate(segments):
+            if index % 2:
+                parts.append((_ANSWER_LABEL_PARTS[segment], None))
+            elif segment.strip() or (index == 0 and has_labels and segment):
+                parts.append(('text', self.render(segment)))
+
+        return parts
@@ -7,25 +7,104 @@ import re
 import os
 import io
 import base64
-import tempfile
-from typing import Optional, Tuple
+import hashlib
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 import matplotlib
 # 设置matplotlib使用非交互式后端，避免GUI问题
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 from matplotlib import mathtext
+from matplotlib.font_manager import FontProperties
+from matplotlib.path import Path
+from matplotlib.textpath import text_to_path
 import numpy as np
+from PIL import Image
+
+from .formula_cache import formula_cache, FORMULA_URL_PREFIX, PNG_RENDER_VERSION, VECTOR_RENDER_VERSION
+from .formula_pool import fraction_formula
+from .vector_formula import VectorFormula
+from . import text_formula
+
+# PNG公式四周的留白(英寸)
+PNG_PADDING_INCHES = 0.02
+
+# 矢量公式四周的留白(pt)，与PNG输出的留白一致
+VECTOR_FORMULA_PADDING = PNG_PADDING_INCHES * 72
+
+# 公式校验结果缓存的条目数
+VALIDATION_CACHE_SIZE = 4096
+
+# 文档中的块级公式和行内公式，与PDF排版时的识别规则一致
+_DISPLAY_MATH_PATTERN = re.compile(r'\$\$([^$]+?)\$\$')
+_INLINE_MATH_PATTERN = re.compile(r'\$([^$\n]+?)\$')
+_PARSE_ERROR_POSITION = re.compile(r'\(at char (\d+)\)')
+
+# 公式字体（Computer Modern），随每次渲染的字体属性传入，不修改全局的rcParams
+MATH_FONTFAMILY = 'cm'
+
+
+def _path_commands(vertices, codes) -> List[tuple]:
+    """把matplotlib路径转换为PDF路径指令，二次贝塞尔曲线转换为三次曲线"""
+    commands = []
+    current = (0.0, 0.0)
+    index = 0
+    while index < len(codes):
+        code = codes[index]
+        if code == Path.MOVETO or code == Path.LINETO:
+            current = (round(float(vertices[index][0]), 1), round(float(vertices[index][1]), 1))
+            commands.append(('m' if code == Path.MOVETO else 'l',) + current)
+            index += 1
+        elif code == Path.CURVE3:
+            (cx, cy), (ex, ey) = vertices[index], vertices[index + 1]
+            end = (round(float(ex), 1), round(float(ey), 1))
+            commands.append((
+                'c',
+                round(current[0] + (cx - current[0]) * 2 / 3, 1), round(current[1] + (cy - current[1]) * 2 / 3, 1),
+                round(ex + (cx - ex) * 2 / 3, 1), round(ey + (cy - ey) * 2 / 3, 1)
+            ) + end)
+            current = end
+            index += 2
+        elif code == Path.CURVE4:
+            points = [(round(float(x), 1), round(float(y), 1)) for x, y in vertices[index:index + 3]]
+            commands.append(('c',) + points[0] + points[1] + points[2])
+            current = points[2]
+            index += 3
+        else:
+            commands.append(('h',))
+            index += 1
+    return commands
 
 
 class MathFormulaService:
     """数学公式处理服务"""
 
     def __init__(self):
-        # 设置matplotlib参数
-        plt.rcParams['font.size'] = 12
-        plt.rcParams['mathtext.fontset'] = 'cm'  # Computer Modern字体
-        plt.rcParams['mathtext.rm'] = 'serif'
+        # 直接把公式栅格化到紧凑外框的解析器，不经过pyplot的全局图形状态
+        self._raster_parser = mathtext.MathTextParser('agg')
+        # matplotlib的公式解析器不是线程安全的，同一进程内的解析逐个进行
+        self._parse_lock = threading.Lock()
+        # 只解析和排版、不栅格化的解析器，用于校验公式
+        self._path_parser = mathtext.MathTextParser('path')
+        # 校验结果缓存在调用校验的进程中，编辑时重复提交的公式不再解析
+        self.validate_formula = lru_cache(maxsize=VALIDATION_CACHE_SIZE)(self._validate_formula)
+
+    def _render_png(self, formula: str, font_size: float, dpi: int) -> bytes:
+        """解析并排版一次公式，按排版外框直接栅格化为透明背景的黑色PNG"""
+        prop = FontProperties(size=font_size, math_fontfamily=MATH_FONTFAMILY)
+        with self._parse_lock:
+            parse = self._raster_parser.parse(f'${formula}$', dpi=dpi, prop=prop)
+        alpha = np.asarray(parse.image)
+        padding = round(PNG_PADDING_INCHES * dpi)
+        height, width = alpha.shape
+
+        rgba = np.zeros((height + 2 * padding, width + 2 * padding, 4), dtype=np.uint8)
+        rgba[padding:padding + height, padding:padding + width, 3] = alpha
+
+        buf = io.BytesIO()
+        Image.fromarray(rgba, 'RGBA').save(buf, format='png', dpi=(dpi, dpi))
+        return buf.getvalue()
         
     def latex_to_image(self, latex_formula: str, font_size: int = 12, dpi: int = 300) -> Optional[bytes]:
         """
@@ -39,60 +118,186 @@ class MathFormulaService:
         Returns:
             PNG图片的字节数据，如果转换失败返回None
         """
+        key = formula_cache.key('png', latex_formula, font_size, dpi, PNG_RENDER_VERSION)
+        image_data = formula_cache.get(key)
+        if image_data is not None:
+            return image_data
+
         try:
             # 清理公式字符串
             formula = self._clean_latex_formula(latex_formula)
 
             # 调整字体大小以匹配PDF文档
             # matplotlib的字体大小需要调整以匹配ReportLab的字体大小
-            # 使用更小的系数以保持合适的显示大小，同时提高清晰度
-            adjusted_font_size = font_size * 0.5
-
-            # 创建图形
-            fig, ax = plt.subplots(figsize=(1, 1))
-            ax.axis('off')
-
-            # 渲染数学公式
-            text = ax.text(0.5, 0.5, f'${formula}$',
-                          fontsize=adjusted_font_size,
-                          ha='center', va='center',
-                          transform=ax.transAxes)
-
-            # 获取文本边界框
-            fig.canvas.draw()
-            bbox = text.get_window_extent(renderer=fig.canvas.get_renderer())
-
-            # 转换为数据坐标
-            bbox_data = bbox.transformed(ax.transData.inverted())
-
-            # 设置图形大小以适应文本，减少边距
-            width = bbox_data.width * 1.05  # 减少边距
-            height = bbox_data.height * 1.05
-
-            # 重新创建适当大小的图形
-            plt.close(fig)
-            fig, ax = plt.subplots(figsize=(max(width, 0.3), max(height, 0.2)))
-            ax.axis('off')
-
-            # 重新渲染公式
-            ax.text(0.5, 0.5, f'${formula}$',
-                   fontsize=adjusted_font_size,
-                   ha='center', va='center',
-                   transform=ax.transAxes)
-
-            # 保存为字节流，降低DPI以减小文件大小并更好匹配文档
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', dpi=dpi, bbox_inches='tight',
-                       pad_inches=0.02, transparent=True)  # 减少padding
-            plt.close(fig)
-
-            buf.seek(0)
-            return buf.getvalue()
-            
+            # 使用更小的系数以保持合适的显示大小，同时提高清晰度；
+            # 简单算式直接用公式字体绘制，其余公式由matplotlib排版
+            image_data = (text_formula.render_png(formula, font_size * 0.5, dpi)
+                          or self._render_png(formula, font_size * 0.5, dpi))
+            self._cache_put(key, image_data)
+            return image_data
+
         except Exception as e:
             print(f"LaTeX公式转换失败: {e}")
             return None
     
+    def latex_to_image_url(self, latex_formula: str, font_size: int = 12) -> Optional[str]:
+        """将LaTeX公式转换为PNG图片，返回 /api/math/formula/ 下的图片地址，转换失败返回None
+
+        不返回缓存文件的路径：缓存文件随时可能被淘汰，也不应暴露服务器上的目录
+        """
+        key = formula_cache.output_key(latex_formula, font_size)
+        if not formula_cache.contains(key) and not self.latex_to_image(latex_formula, font_size):
+            return None
+        return FORMULA_URL_PREFIX + key
+
+    def output_cache_key(self, latex_formula: str, font_size: float, output_format: str = 'png') -> str:
+        """公式输出文件的缓存键"""
+        return formula_cache.output_key(latex_formula, font_size, output_format)
+
+    def latex_to_svg(self, latex_formula: str, font_size: float = 12) -> Optional[bytes]:
+        """
+        将LaTeX公式转换为SVG，公式按 font_size(pt) 排版，任意缩放都保持清晰
+
+        Args:
+            latex_formula: LaTeX公式字符串
+            font_size: 公式字号(pt)
+
+        Returns:
+            SVG的字节数据，如果转换失败返回None
+        """
+        key = self.output_cache_key(latex_formula, font_size, 'svg')
+        data = formula_cache.get(key)
+        if data is not None:
+            return data
+
+        vector = self.latex_to_vector(latex_formula, font_size)
+        if vector is None:
+            return None
+        data = vector.to_svg().encode('utf-8')
+        self._cache_put(key, data)
+        return data
+
+    def latex_to_pdf(self, latex_formula: str, font_size: float = 12) -> Optional[bytes]:
+        """
+        将LaTeX公式转换为页面大小与公式外框一致的单页矢量PDF
+
+        Args:
+            latex_formula: LaTeX公式字符串
+            font_size: 公式字号(pt)
+
+        Returns:
+            PDF的字节数据，如果转换失败返回None
+        """
+        key = self.output_cache_key(latex_formula, font_size, 'pdf')
+        data = formula_cache.get(key)
+        if data is not None:
+            return data
+
+        vector = self.latex_to_vector(latex_formula, font_size)
+        if vector is None:
+            return None
+
+        # 在使用时导入，pdf_service依赖本模块
+        from .pdf_service import FormulaCanvas
+
+        buf = io.BytesIO()
+        canvas = FormulaCanvas(buf, pagesize=(vector.width, vector.height), invariant=1)
+        canvas.drawFormula(vector, 0, 0)
+        canvas.showPage()
+        canvas.save()
+        data = buf.getvalue()
+        self._cache_put(key, data)
+        return data
+
+    def _cache_put(self, key: str, data: bytes):
+        try:
+            formula_cache.put(key, data)
+        except OSError as e:
+            print(f"写入公式缓存失败: {e}")
+
+    def latex_to_vector(self, latex_formula: str, font_size: float = 12) -> Optional[VectorFormula]:
+        """
+        将LaTeX公式转换为矢量字形轮廓，嵌入PDF后任意缩放都保持清晰
+
+        Args:
+            latex_formula: LaTeX公式字符串
+            font_size: 公式字号(pt)
+
+        Returns:
+            VectorFormula，如果转换失败返回None
+        """
+        cache_key = formula_cache.key('json', latex_formula, font_size, None, VECTOR_RENDER_VERSION)
+        data = formula_cache.get(cache_key)
+        if data is not None:
+            return VectorFormula.from_json(data.decode('utf-8'))
+
+        try:
+            formula = self._clean_latex_formula(latex_formula)
+            with self._parse_lock:
+                glyph_info, glyph_map, rect_paths = text_to_path.get_glyphs_mathtext(
+                    FontProperties(math_fontfamily=MATH_FONTFAMILY), f'${formula}$'
+                )
+
+            # 字形按字号100排版，统一换算为实际字号
+            unit = font_size / text_to_path.FONT_SCALE
+            glyphs = {}
+            glyph_keys = {}
+            for glyph_id, (vertices, codes) in glyph_map.items():
+                outline = vertices[codes != Path.CLOSEPOLY]
+                if not len(outline):
+                    continue
+                key = hashlib.sha1(glyph_id.encode('utf-8')).hexdigest()[:12]
+                bbox = tuple(round(float(value), 1) for value in (*outline.min(axis=0), *outline.max(axis=0)))
+                glyphs[key] = (bbox, _path_commands(vertices, codes))
+                glyph_keys[glyph_id] = key
+
+            placements = []
+            boxes = []
+            for glyph_id, x, y, scale in glyph_info:
+                key = glyph_keys.get(glyph_id)
+                if key is None:
+                    continue
+                x0, y0, x1, y1 = glyphs[key][0]
+                placements.append((key, x * unit, y * unit, scale * unit))
+                boxes.append(((x + x0 * scale) * unit, (y + y0 * scale) * unit,
+                              (x + x1 * scale) * unit, (y + y1 * scale) * unit))
+
+            rects = []
+            for vertices, _ in rect_paths:
+                (x0, y0), (x1, y1) = vertices[0], vertices[2]
+                rects.append((x0 * unit, y0 * unit, (x1 - x0) * unit, (y1 - y0) * unit))
+                boxes.append((x0 * unit, y0 * unit, x1 * unit, y1 * unit))
+
+            if not boxes:
+                return None
+
+            # 以轮廓的外框加留白作为公式的尺寸，基线在 y=0
+            padding = VECTOR_FORMULA_PADDING
+            min_x = min(box[0] for box in boxes)
+            min_y = min(box[1] for box in boxes)
+            max_x = max(box[2] for box in boxes)
+            max_y = max(box[3] for box in boxes)
+            offset_x = padding - min_x
+            offset_y = padding - min_y
+
+            vector = VectorFormula(
+                hashlib.sha1(f"{font_size!r}\0{formula}".encode('utf-8')).hexdigest()[:16],
+                round(max_x - min_x + 2 * padding, 3),
+                round(max_y - min_y + 2 * padding, 3),
+                round(offset_y, 3),
+                [(key, round(x + offset_x, 3), round(y + offset_y, 3), round(scale, 5))
+                 for key, x, y, scale in placements],
+                [(round(x + offset_x, 3), round(y + offset_y, 3), round(width, 3), round(height, 3))
+                 for x, y, width, height in rects],
+                glyphs
+            )
+            self._cache_put(cache_key, vector.to_json().encode('utf-8'))
+            return vector
+
+        except Exception as e:
+            print(f"LaTeX公式矢量化失败: {e}")
+            return None
+
     def _clean_latex_formula(self, formula: str) -> str:
         """清理LaTeX公式字符串"""
         # 移除外层的$符号
@@ -153,55 +358,26 @@ class MathFormulaService:
     def _replace_inline_math(self, match) -> str:
         """替换行内数学公式"""
         formula = match.group(1)
-        image_data = self.latex_to_image(formula, font_size=12)
-        
-        if image_data:
-            # 保存图片到临时文件
-            temp_file = self._save_temp_image(image_data, f"inline_math_{hash(formula)}")
-            if temp_file:
-                return f"![]({temp_file})"
-        
+        image_url = self.latex_to_image_url(formula, font_size=12)
+        if image_url:
+            return f"![]({image_url})"
+
         # 如果转换失败，返回原始文本
         return f"${formula}$"
-    
+
     def _replace_display_math(self, match) -> str:
         """替换块级数学公式"""
         formula = match.group(1)
-        image_data = self.latex_to_image(formula, font_size=14)
-        
-        if image_data:
-            # 保存图片到临时文件
-            temp_file = self._save_temp_image(image_data, f"display_math_{hash(formula)}")
-            if temp_file:
-                return f"\n![]({temp_file})\n"
-        
+        image_url = self.latex_to_image_url(formula, font_size=14)
+        if image_url:
+            return f"\n![]({image_url})\n"
+
         # 如果转换失败，返回原始文本
         return f"$${formula}$$"
-    
-    def _save_temp_image(self, image_data: bytes, filename_prefix: str) -> Optional[str]:
-        """保存图片到临时文件"""
-        try:
-            # 创建临时目录
-            temp_dir = os.path.join(tempfile.gettempdir(), 'printmind_math')
-            os.makedirs(temp_dir, exist_ok=True)
-            
-            # 生成文件名
-            filename = f"{filename_prefix}.png"
-            filepath = os.path.join(temp_dir, filename)
-            
-            # 保存图片
-            with open(filepath, 'wb') as f:
-                f.write(image_data)
-            
-            return filepath
-            
-        except Exception as e:
-            print(f"保存数学公式图片失败: {e}")
-            return None
-    
+
     def create_fraction_image(self, numerator: str, denominator: str, font_size: int = 12) -> Optional[bytes]:
         """
-        创建分数图片
+        创建分数图片，与公式渲染共用公式缓存
         
         Args:
             numerator: 分子
@@ -211,33 +387,82 @@ class MathFormulaService:
         Returns:
             PNG图片的字节数据
         """
-        try:
-            # 使用与主要渲染方法相同的字体大小调整
-            adjusted_font_size = font_size * 0.75
-
-            fig, ax = plt.subplots(figsize=(2, 1))
-            ax.axis('off')
-
-            # 渲染分数
-            fraction_text = f"$\\frac{{{numerator}}}{{{denominator}}}$"
-            ax.text(0.5, 0.5, fraction_text,
-                   fontsize=adjusted_font_size,
-                   ha='center', va='center',
-                   transform=ax.transAxes)
-
-            # 保存为字节流
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', dpi=300, bbox_inches='tight',
-                       pad_inches=0.02, transparent=True)
-            plt.close(fig)
-
-            buf.seek(0)
-            return buf.getvalue()
-            
-        except Exception as e:
-            print(f"分数图片创建失败: {e}")
-            return None
+        # 分数按1.5倍字号渲染（latex_to_image 再缩小一半），与原先的0.75倍字号一致
+        formula, fraction_size = fraction_formula(numerator, denominator, font_size)
+        return self.latex_to_image(formula, font_size=fraction_size)
     
+    def _validate_formula(self, latex_formula: str) -> Optional[dict]:
+        """
+        只解析公式、不栅格化，检查公式语法
+
+        Args:
+            latex_formula: LaTeX公式字符串
+
+        Returns:
+            公式有效时返回None，否则返回 {"message": 错误信息, "position": 公式中的出错位置}
+        """
+        formula = self._clean_latex_formula(latex_formula)
+        error = None
+        # 简单算式一定能够排版，不必解析
+        if not text_formula.is_simple_formula(formula):
+            try:
+                with self._parse_lock:
+                    self._path_parser.parse(f'${formula}$', prop=FontProperties(math_fontfamily=MATH_FONTFAMILY))
+            except ValueError as e:
+                lines = str(e).strip().splitlines()
+                message = lines[-1] if lines else str(e)
+                match = _PARSE_ERROR_POSITION.search(message)
+                message = _PARSE_ERROR_POSITION.split(message)[0].split(': ', 1)[-1].strip().rstrip(',')
+                error = {"message": message, "position": int(match.group(1)) if match else 0}
+        return error
+
+    def validate_markdown_math(self, content: str) -> List[dict]:
+        """
+        检查Markdown内容中所有公式的语法
+
+        Args:
+            content: 包含LaTeX公式的Markdown内容
+
+        Returns:
+            错误列表，每项包含公式、是否块级公式、错误信息，
+            以及出错位置在文档中的偏移(offset)和行号、列号(从1开始)
+        """
+        spans = []
+        for match in _DISPLAY_MATH_PATTERN.finditer(content):
+            spans.append((match.start(1), match.group(1), True))
+        # 块级公式已识别的部分不再按行内公式匹配
+        masked = _DISPLAY_MATH_PATTERN.sub(lambda match: ' ' * len(match.group(0)), content)
+        for match in _INLINE_MATH_PATTERN.finditer(masked):
+            spans.append((match.start(1), match.group(1), False))
+
+        errors = []
+        for start, formula, display in sorted(spans):
+            error = self.validate_formula(formula)
+            if error is None:
+                continue
+            offset = start + min(error["position"], len(formula))
+            line_start = content.rfind('\n', 0, offset) + 1
+            errors.append({
+                "formula": formula,
+                "display": display,
+                "message": error["message"],
+                "position": error["position"],
+                "offset": offset,
+                "line": content.count('\n', 0, offset) + 1,
+                "column": offset - line_start + 1
+            })
+        return errors
+
+    def warmup(self):
+        """不经过公式缓存解析并排版示例公式，提前完成matplotlib字体缓存、公式解析器和公式字体的初始化"""
+        formula = r'\frac{x^2}{\sqrt{2}} + \sum_{i=1}^{n} \alpha_i'
+        prop = FontProperties(math_fontfamily=MATH_FONTFAMILY)
+        self._render_png(formula, 12, 100)
+        with self._parse_lock:
+            text_to_path.get_glyphs_mathtext(prop, f'${formula}$')
+            self._path_parser.parse(f'${formula}$', prop=prop)
+        text_formula.render_png(r'\frac{1}{2} + 3', 6, 100)
+
     def test_math_rendering(self) -> bool:
         """测试数学公式渲染功能"""
         try:
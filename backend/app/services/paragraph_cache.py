@@ -0,0 +1,113 @@
+"""
+段落排版缓存
+练习册中大量重复相同的段落（题目说明、答案/解析行、选项行），
+按 (段落标记, 样式, 可用宽度) 缓存断行结果，相同段落直接复用，不再重复断行
+"""
+
+import threading
+import weakref
+from collections import OrderedDict
+from copy import deepcopy
+from typing import Any, Optional, Tuple
+
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.platypus import Paragraph
+from reportlab.rl_config import _FUZZ
+
+from app.core.config import settings
+
+# wrap() 计算并在绘制、拆分时使用的属性（frags仍由各段落自己持有）
+_LAYOUT_ATTRIBUTES = ('width', 'height', 'blPara', '_wrapWidths',
+                      '_width_max', '_splitLongWordCount', '_hyphenations')
+
+
+class ParagraphLayoutCache:
+    """段落断行结果的LRU缓存"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._style_signatures = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def style_signature(self, style: ParagraphStyle) -> str:
+        """样式的取值签名，内容相同的样式对象得到相同的签名"""
+        signature = self._style_signatures.get(style)
+        if signature is None:
+            signature = repr(sorted(
+                (key, value) for key, value in style.__dict__.items() if key not in ('name', 'parent')
+            ))
+            self._style_signatures[style] = signature
+        return signature
+
+    def get(self, key: Tuple) -> Optional[dict]:
+        with self._lock:
+            layout = self._entries.get(key)
+            if layout is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return layout
+
+    def put(self, key: Tuple, layout: dict):
+        with self._lock:
+            self._entries[key] = layout
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class CachedParagraph(Paragraph):
+    """断行结果可在相同段落间共享的Paragraph
+
+    缓存的断行结果由多个段落共用，而拆分段落时ReportLab会修改行内的文本片段，
+    因此使用共享结果的段落在拆分前会先重新断行得到独立的结果。
+    """
+
+    _shared_layout = False
+
+    def _layout_key(self, availWidth) -> Optional[Tuple[Any, ...]]:
+        # 拆分产生的段落没有原始文本，不参与缓存
+        if not isinstance(self.text, str) or getattr(self, '_splitpara', 0):
+            return None
+        return (self.text, self.bulletText, paragraph_layout_cache.style_signature(self.style), availWidth)
+
+    def wrap(self, availWidth, availHeight):
+        key = self._layout_key(availWidth)
+        # 宽度不足时 Paragraph.wrap 返回 (0, 0x7fffffff)，让框架拒绝放入该段落，不使用缓存
+        if key is None or availWidth < _FUZZ:
+            return Paragraph.wrap(self, availWidth, availHeight)
+
+        layout = paragraph_layout_cache.get(key)
+        if layout is None:
+            Paragraph.wrap(self, availWidth, availHeight)
+            layout = {name: getattr(self, name) for name in _LAYOUT_ATTRIBUTES if hasattr(self, name)}
+            paragraph_layout_cache.put(key, layout)
+        else:
+            self.__dict__.update(layout)
+        self._shared_layout = True
+        return self.width, self.height
+
+    def split(self, availWidth, availHeight):
+        if self._shared_layout:
+            # 文本片段可能被缓存中的断行结果引用，复制后重新断行
+            self.frags = deepcopy(self.frags)
+            Paragraph.wrap(self, availWidth, availHeight)
+            self._shared_layout = False
+        return Paragraph.split(self, availWidth, availHeight)
+
+
+# 全局实例
+paragraph_layout_cache = ParagraphLayoutCache(settings.PARAGRAPH_LAYOUT_CACHE_SIZE)
@@ -7,7 +7,7 @@ import os
 import uuid
 import base64
 import markdown
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator
 import asyncio
 import time
 from io import BytesIO
@@ -27,14 +27,237 @@ from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER, TA_LEFT, TA_RIGHT
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+from reportlab.pdfgen.canvas import Canvas, FILL_NON_ZERO
+from reportlab.lib.abag import ABag
 import re
 import platform
-from .math_service import math_service
+import threading
+import weakref
+from functools import lru_cache
+from xml.sax.saxutils import escape
+from .vector_formula import VectorFormula
+from .render_service import CancelToken
+from .render_pool import render_pool
+from .fragment_cache import fragment_cache
+from .inline_markup import InlineMarkupRenderer
+from .paragraph_cache import CachedParagraph
+from .formula_pool import formula_pool, load_formula
+from .text_formula import TextFormula, text_formula, is_simple_formula
+from . import text_metrics
 
 from app.models.schemas import LayoutConfig
 from app.core.config import settings
 
 
+# 行内公式的最大宽度
+INLINE_MATH_MAX_WIDTH = 400
+
+# 块级公式的字号和最大宽度
+DISPLAY_MATH_FONT_SIZE = 20
+DISPLAY_MATH_MAX_WIDTH = 200
+
+# 行内公式在段落文本中的占位符
+_FORMULA_PLACEHOLDER_PATTERN = re.compile('\ue000(\\d+)\ue001')
+
+# 行内公式 $...$ 和块级公式 $$...$$
+_INLINE_MATH_PATTERN = re.compile(r'\$([^$\n]+?)\$')
+_DISPLAY_MATH_PATTERN = re.compile(r'\$\$([^$]+?)\$\$')
+
+# Markdown图片和HTML img标签引用的图片
+_IMAGE_REFERENCE_PATTERN = re.compile(r'!\[.*?\]\((.*?)\)|<img\s+[^>]*src=["\']([^"\']+)["\'][^>]*>')
+
+# 出现任一字符即说明文本可能含有行内标记（公式、HTML/XML、粗斜体、双括号、连续空格）
+_INLINE_MARKUP_PATTERN = re.compile(r'[$<>&*_]|（（|  ')
+
+# 标签图片所在目录（考虑不同的工作目录）
+_LABEL_IMAGE_DIRS = (
+    "answer_images",
+    "../answer_images",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "answer_images"),
+)
+
+
+@lru_cache(maxsize=None)
+def _find_label_image(name: str) -> Optional[tuple]:
+    """查找标签图片（如 answer_label）并读取像素尺寸，返回 (路径, 宽, 高)，找不到时返回None
+
+    每个进程只查找一次，多进程部署时在预加载阶段完成，子进程直接复用结果
+    """
+    for directory in _LABEL_IMAGE_DIRS:
+        for suffix in ("", "_small", "_large"):
+            path = os.path.join(directory, f"{name}{suffix}.png")
+            if os.path.exists(path):
+                with PILImage.open(path) as pil_img:
+                    return (path,) + pil_img.size
+    return None
+
+
+def _label_image(name: str, max_width: float) -> Optional[Image]:
+    """按可用宽度创建标签图片：最大40像素或10%宽度，不放大"""
+    found = _find_label_image(name)
+    if found is None:
+        return None
+    path, orig_width, orig_height = found
+    target_width = min(40, max_width * 0.1)
+    scale_ratio = min(target_width / orig_width, 1.0)
+    return Image(path, width=orig_width * scale_ratio, height=orig_height * scale_ratio)
+
+
+class PlainParagraph(CachedParagraph):
+    """不含行内标记的纯文本段落
+
+    跳过行内Markdown替换和Paragraph的XML解析，
+    直接用按样式缓存的文本片段模板构造段落，排版结果与普通Paragraph相同
+    """
+
+    _frag_templates = weakref.WeakKeyDictionary()
+
+    def __init__(self, text: str, style: ParagraphStyle, bulletText=None, frags=None, **kwargs):
+        # 分页拆分时ReportLab会带着已拆好的frags重新构造本类，此时直接沿用
+        if frags is None:
+            template = self._frag_templates.get(style)
+            if template is None:
+                template = Paragraph('x', style).frags[0]
+                self._frag_templates[style] = template
+            # 与Paragraph的文本清理一致：合并连续空白
+            text = ' '.join(text.split())
+            frags = [template.clone(text=text)]
+        CachedParagraph.__init__(self, text, style, bulletText, frags, **kwargs)
+
+    @staticmethod
+    def is_plain(text: str) -> bool:
+        """一次扫描判断文本是否不含任何行内标记"""
+        return bool(text.strip()) and _INLINE_MARKUP_PATTERN.search(text) is None
+
+
+class InlineFormulaParagraph(CachedParagraph):
+    """含行内矢量公式的段落
+
+    公式在文本中以占位符表示，解析完段落标记后替换为与<img>相同的行内元素，
+    断行和对齐方式与内嵌图片一致，绘制时由 FormulaCanvas 画出矢量轮廓。
+    样式须按字断行（wordWrap='CJK'），见 _inline_math_style
+    """
+
+    def __init__(self, text: str, style: ParagraphStyle, formulas=(), bulletText=None, frags=None, **kwargs):
+        # 分页拆分时ReportLab会带着已替换好的frags重新构造本类
+        self.formulas = tuple(formulas)
+        CachedParagraph.__init__(self, text, style, bulletText, frags, **kwargs)
+        if frags is None:
+            self.frags = self._insert_formulas(self.frags)
+
+    def _insert_formulas(self, frags: List) -> List:
+        result = []
+        for frag in frags:
+            text = getattr(frag, 'text', '')
+            if '\ue000' not in text:
+                result.append(frag)
+                continue
+            for index, part in enumerate(_FORMULA_PLACEHOLDER_PATTERN.split(text)):
+                if index % 2 == 0:
+                    if part:
+                        result.append(frag.clone(text=part))
+                    continue
+                formula, width, height = self.formulas[int(part)]
+                # 按字断行时ReportLab对文本为空的行内元素取ord()会出错，用对象替换符占位（绘制时不输出文字）；
+                # 公式基线与文字基线对齐
+                result.append(frag.clone(text='\ufffc', cbDefn=ABag(
+                    kind='img', image=formula, width=width, height=height,
+                    valign=-formula.descent * height / formula.height
+                )))
+        return result
+
+    def _layout_key(self, availWidth):
+        key = CachedParagraph._layout_key(self, availWidth)
+        if key is None:
+            return None
+        return key + (tuple((formula.key, width) for formula, width, _ in self.formulas),)
+
+
+class VectorFormulaFlowable(Flowable):
+    """块级矢量公式（包括直接排版的简单算式）"""
+
+    def __init__(self, formula, width: float, height: float):
+        Flowable.__init__(self)
+        self.formula = formula
+        self.width = width
+        self.height = height
+        self.hAlign = 'CENTER'
+
+    def wrap(self, availWidth, availHeight):
+        return self.width, self.height
+
+    def draw(self):
+        self.canv.drawImage(self.formula, 0, 0, self.width, self.height)
+
+
+class FormulaCanvas(Canvas):
+    """可以绘制矢量公式的画布
+
+    每个字形和每个公式在文档中只定义一次PDF表单对象，公式引用字形表单，
+    之后各处出现的同一公式都引用公式表单；段落中的行内公式经由 drawImage 绘制，因此在这里一并处理。
+    直接排版的简单算式（TextFormula）用公式字体输出文字、用矩形画分数线
+    """
+
+    def drawImage(self, image, x, y, width=None, height=None, *args, **kwargs):
+        if isinstance(image, (VectorFormula, TextFormula)):
+            self.drawFormula(image, x, y, width, height)
+            return image.width, image.height
+        return Canvas.drawImage(self, image, x, y, width, height, *args, **kwargs)
+
+    def drawFormula(self, formula, x: float, y: float,
+                    width: Optional[float] = None, height: Optional[float] = None):
+        if isinstance(formula, VectorFormula):
+            name = f"math_{formula.key}"
+            if not self.hasForm(name):
+                self._defineFormula(name, formula)
+
+        self.saveState()
+        self.translate(x, y)
+        if width and height and (width != formula.width or height != formula.height):
+            self.scale(width / formula.width, height / formula.height)
+        if isinstance(formula, VectorFormula):
+            self.doForm(name)
+        else:
+            self.setFillColorRGB(0, 0, 0)
+            for text, font_name, font_size, text_x, text_y in formula.runs:
+                self.setFont(font_name, font_size)
+                self.drawString(text_x, text_y, text)
+            for rect_x, rect_y, rect_width, rect_height in formula.rects:
+                self.rect(rect_x, rect_y, rect_width, rect_height, stroke=0, fill=1)
+        self.restoreState()
+
+    def _defineFormula(self, name: str, formula: VectorFormula):
+        for key, (bbox, commands) in formula.glyphs.items():
+            glyph_name = f"glyph_{key}"
+            if self.hasForm(glyph_name):
+                continue
+            self.beginForm(glyph_name, *bbox)
+            path = self.beginPath()
+            for command in commands:
+                op = command[0]
+                if op == 'm':
+                    path.moveTo(*command[1:])
+                elif op == 'l':
+                    path.lineTo(*command[1:])
+                elif op == 'c':
+                    path.curveTo(*command[1:])
+                else:
+                    path.close()
+            self.drawPath(path, stroke=0, fill=1, fillMode=FILL_NON_ZERO)
+            self.endForm()
+
+        self.beginForm(name, 0, 0, formula.width, formula.height)
+        self.setFillColorRGB(0, 0, 0)
+        for key, glyph_x, glyph_y, scale in formula.placements:
+            self.saveState()
+            self.transform(scale, 0, 0, scale, glyph_x, glyph_y)
+            self.doForm(f"glyph_{key}")
+            self.restoreState()
+        for rect_x, rect_y, rect_width, rect_height in formula.rects:
+            self.rect(rect_x, rect_y, rect_width, rect_height, stroke=0, fill=1)
+        self.endForm()
+
+
 class MathFormulaFlowable(Flowable):
     """数学公式Flowable，用于在PDF中嵌入数学公式图片"""
 
@@ -238,7 +461,6 @@ class NumberedListItem(Flowable):
 
             # 绘制列表项文字 - 使用Paragraph来支持HTML格式
             try:
-                from reportlab.platypus import Paragraph
                 from reportlab.lib.styles import ParagraphStyle
 
                 # 创建临时样式用于列表项文字
@@ -259,7 +481,7 @@ class NumberedListItem(Flowable):
                 text_width = self.width - text_x - 10  # 减去右边距
 
                 # 创建Paragraph对象来渲染HTML格式的文字
-                para = Paragraph(self.text, list_text_style)
+                para = CachedParagraph(self.text, list_text_style)
                 para_width, para_height = para.wrap(text_width, self.height)
 
                 # 计算文字垂直位置，使序号圆形与文本第一行对齐
@@ -296,9 +518,77 @@ class NumberedListItem(Flowable):
         canvas.restoreState()
 
 
+class AlignedImage(Flowable):
+    """在整行宽度内按对齐方式放置的单张图片
+
+    直接计算图片的横向位置，不再为了对齐而套一层单行Table
+    """
+
+    def __init__(self, image: Flowable, alignment: str = 'CENTER'):
+        Flowable.__init__(self)
+        self.image = image
+        self.alignment = alignment
+        self.image_width = 0
+
+    def wrap(self, availWidth, availHeight):
+        self.image_width, self.height = self.image.wrap(availWidth, availHeight)
+        self.width = availWidth
+        return self.width, self.height
+
+    def draw(self):
+        if self.alignment == 'LEFT':
+            x = 0
+        elif self.alignment == 'RIGHT':
+            x = self.width - self.image_width
+        else:
+            x = (self.width - self.image_width) / 2
+        self.image.drawOn(self.canv, x, 0)
+
+
+class ImageRow(Flowable):
+    """横向并排的一行元素（图片或图片说明），顶部对齐
+
+    从 left_offset 开始按列宽依次排列，列之间留 spacing 间距，
+    位置直接计算得出，替代只用于排列的单行Table
+    """
+
+    def __init__(self, cells: list, col_widths: List[float], spacing: float = 20, left_offset: float = 0,
+                 min_width: float = 0, top_padding: float = 0, bottom_padding: float = 0):
+        Flowable.__init__(self)
+        self.cells = cells
+        self.col_widths = col_widths
+        self.spacing = spacing
+        self.left_offset = left_offset
+        self.min_width = min_width
+        self.top_padding = top_padding
+        self.bottom_padding = bottom_padding
+        self.hAlign = 'LEFT'
+        self._cell_heights: List[float] = []
+
+    def wrap(self, availWidth, availHeight):
+        self._cell_heights = [
+            cell.wrap(col_width, availHeight)[1]
+            for cell, col_width in zip(self.cells, self.col_widths)
+        ]
+        content_width = self.left_offset + sum(self.col_widths) + self.spacing * max(len(self.col_widths) - 1, 0)
+        self.width = max(content_width, self.min_width)
+        self.height = self.top_padding + max(self._cell_heights, default=0) + self.bottom_padding
+        return self.width, self.height
+
+    def draw(self):
+        x = self.left_offset
+        top = self.height - self.top_padding
+        for cell, col_width, cell_height in zip(self.cells, self.col_widths, self._cell_heights):
+            cell.drawOn(self.canv, x, top - cell_height)
+            x += col_width + self.spacing
+
+
 class AnswerAnalysisBox(Flowable):
     """答案及解析内容框 - 带圆角矩形背景的自适应高度文本框，支持多段落"""
 
+    # 按字体名共享的行内标记渲染器
+    _markup_renderers: Dict[str, InlineMarkupRenderer] = {}
+
     def __init__(self, text, style, config: LayoutConfig = None):
         Flowable.__init__(self)
         self.text = text
@@ -336,9 +626,6 @@ class AnswerAnalysisBox(Flowable):
         # 计算文本区域的可用宽度（减去内边距和边框）
         text_width = availWidth - (self.padding * 2) - (self.border_width * 2)
 
-        # 处理多段落内容，支持图片
-        from reportlab.platypus import Paragraph
-
         # 分割文本为段落
         paragraphs = self.text.split('\n')
         self.content_objects = []  # 存储段落和图片对象
@@ -384,7 +671,7 @@ class AnswerAnalysisBox(Flowable):
                     # 添加图片前的文本
                     if before_img:
                         before_text = self._process_inline_markdown(before_img)
-                        para = Paragraph(before_text, self.style)
+                        para = CachedParagraph(before_text, self.style)
                         para_width, para_height = para.wrap(text_width, availHeight)
                         self.content_objects.append(('paragraph', para))
                         total_height += para_height + (self.style.spaceAfter or 6)
@@ -403,7 +690,7 @@ class AnswerAnalysisBox(Flowable):
                     # 添加图片后的文本
                     if after_img:
                         after_text = self._process_inline_markdown(after_img)
-                        para = Paragraph(after_text, self.style)
+                        para = CachedParagraph(after_text, self.style)
                         para_width, para_height = para.wrap(text_width, availHeight)
                         self.content_objects.append(('paragraph', para))
                         total_height += para_height + (self.style.spaceAfter or 6)
@@ -418,7 +705,7 @@ class AnswerAnalysisBox(Flowable):
                     for part_type, part_content in text_parts:
                         if part_type == 'text' and part_content.strip():
                             # 文本部分
-                            para = Paragraph(part_content, self.style)
+                            para = CachedParagraph(part_content, self.style)
                             para_width, para_height = para.wrap(text_width, availHeight)
                             self.content_objects.append(('paragraph', para))
                             total_height += para_height + (self.style.spaceAfter or 6)
@@ -441,7 +728,7 @@ class AnswerAnalysisBox(Flowable):
                 else:
                     # 普通文本段落 - 只处理Markdown格式
                     para_text = self._process_inline_markdown(para_text)
-                    para = Paragraph(para_text, self.style)
+                    para = CachedParagraph(para_text, self.style)
                     para_width, para_height = para.wrap(text_width, availHeight)
 
                     self.content_objects.append(('paragraph', para))
@@ -459,57 +746,45 @@ class AnswerAnalysisBox(Flowable):
 
         return (self.width, self.height)
 
-    def _process_inline_markdown(self, text: str) -> str:
-        """处理行内Markdown格式"""
-
-        # 处理HTML字体标签 - 支持用户自定义字体
-        # 匹配 <span style="font-family: FontName">text</span> 格式
-        def replace_font_span(match):
-            font_family = match.group(1)
-            content = match.group(2)
-            # 获取已注册的字体列表
-            from reportlab.pdfbase import pdfmetrics
-            registered_fonts = pdfmetrics.getRegisteredFontNames()
-
-            # 字体映射 - 只支持指定的5种字体
-            if 'KaiTi' in font_family or '楷体' in font_family:
-                if 'KaiTi' in registered_fonts:
-                    mapped_font = 'KaiTi'
-                elif 'STKaiti' in registered_fonts:
-                    mapped_font = 'STKaiti'
-                else:
-                    mapped_font = self.style.fontName
-            elif 'Alibaba PuHuiTi' in font_family or '阿里巴巴' in font_family or '普惠' in font_family:
-                mapped_font = 'ChineseFont'  # 阿里巴巴普惠体映射到默认中文字体
-            elif 'SimSun' in font_family or '宋体' in font_family:
-                mapped_font = 'ChineseFont'
-            elif 'Arial' in font_family:
-                mapped_font = 'Helvetica'
-            elif 'Times' in font_family:
-                mapped_font = 'Times-Roman'
-            else:
-                mapped_font = self.style.fontName  # 默认使用当前字体
-            return f'<font name="{mapped_font}">{content}</font>'
-
-        text = re.sub(r'<span style="font-family:\s*([^"]+)">(.*?)</span>', replace_font_span, text)
-
-        # 双括号文本 - 橘色楷体文字，保留一个括号
-        kaiti_font = self.style.fontName  # 使用当前样式的字体
-        text = re.sub(r'（（(.*?)））', rf'<font color="#FF8C00" name="{kaiti_font}">（\1）</font>', text)
-
-        # 粗体
-        text = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', text)
-        text = re.sub(r'__(.*?)__', r'<b>\1</b>', text)
+    @property
+    def markup(self) -> InlineMarkupRenderer:
+        """答案框使用的行内标记渲染器，按字体共享以复用转换缓存"""
+        font_name = self.style.fontName
+        renderer = self._markup_renderers.get(font_name)
+        if renderer is None:
+            renderer = InlineMarkupRenderer(
+                lambda font_family: self._map_font_family(font_family, font_name),
+                font_name  # 双括号文本使用当前样式的字体
+            )
+            self._markup_renderers[font_name] = renderer
+        return renderer
 
-        # 斜体
-        text = re.sub(r'\*(.*?)\*', r'<i>\1</i>', text)
-        text = re.sub(r'_(.*?)_', r'<i>\1</i>', text)
+    @staticmethod
+    def _map_font_family(font_family: str, default_font: str) -> str:
+        """将字体名称映射到已注册的字体，未知字体使用当前字体"""
+        from reportlab.pdfbase import pdfmetrics
+        registered_fonts = pdfmetrics.getRegisteredFontNames()
 
-        # 保留多个空格 - 将连续的空格转换为&nbsp;实体
-        # 但保留单个空格不变，只转换多个连续空格
-        text = re.sub(r'  +', lambda m: '&nbsp;' * len(m.group(0)), text)
+        # 字体映射 - 只支持指定的5种字体
+        if 'KaiTi' in font_family or '楷体' in font_family:
+            if 'KaiTi' in registered_fonts:
+                return 'KaiTi'
+            elif 'STKaiti' in registered_fonts:
+                return 'STKaiti'
+            return default_font
+        elif 'Alibaba PuHuiTi' in font_family or '阿里巴巴' in font_family or '普惠' in font_family:
+            return 'ChineseFont'  # 阿里巴巴普惠体映射到默认中文字体
+        elif 'SimSun' in font_family or '宋体' in font_family:
+            return 'ChineseFont'
+        elif 'Arial' in font_family:
+            return 'Helvetica'
+        elif 'Times' in font_family:
+            return 'Times-Roman'
+        return default_font  # 默认使用当前字体
 
-        return text
+    def _process_inline_markdown(self, text: str) -> str:
+        """处理行内Markdown格式"""
+        return self.markup.render(text)
 
     def _collect_consecutive_images_for_answer_box(self, paragraphs: list, start_index: int) -> list:
         """收集答案框中连续的图片段落"""
@@ -578,7 +853,7 @@ class AnswerAnalysisBox(Flowable):
                 else:
                     # 当前行已满，创建行布局
                     if current_row_images:
-                        row_height = self._create_answer_box_image_row_table(current_row_images, available_width, spacing_between_images)
+                        row_height = self._create_answer_box_image_row(current_row_images, available_width, spacing_between_images)
                         total_height += row_height + 10  # 行间距
 
                     # 开始新行
@@ -592,226 +867,44 @@ class AnswerAnalysisBox(Flowable):
 
         # 处理最后一行
         if current_row_images:
-            row_height = self._create_answer_box_image_row_table(current_row_images, available_width, spacing_between_images)
+            row_height = self._create_answer_box_image_row(current_row_images, available_width, spacing_between_images)
             total_height += row_height + 10  # 行间距
 
         return total_height
 
-    def _create_answer_box_image_row_table(self, row_images: list, available_width: float, image_spacing: float = 10) -> float:
-        """创建答案框中的图片行表格，返回行高度"""
-        from reportlab.platypus import Table, TableStyle
-
-        # 计算列宽
+    def _create_answer_box_image_row(self, row_images: list, available_width: float, image_spacing: float = 10) -> float:
+        """创建答案框中居中的图片行，返回行高度"""
         total_image_width = sum(img['width'] for img in row_images)
         spacing_count = len(row_images) - 1
         spacing_width = spacing_count * image_spacing if spacing_count > 0 else 0
         remaining_width = available_width - total_image_width - spacing_width
 
-        # 构建表格数据和列宽
-        table_data = []
-        col_widths = []
-
-        # 如果有剩余宽度，在两侧添加空白以居中显示
-        if remaining_width > 0:
-            left_padding = remaining_width / 2
-            col_widths.append(left_padding)
-            table_data.append('')
-
-        # 添加图片和间距
-        for i, img_info in enumerate(row_images):
-            table_data.append(img_info['element'])
-            col_widths.append(img_info['width'])
-
-            # 添加图片间距（除了最后一张图片）
-            if i < len(row_images) - 1:
-                table_data.append('')
-                col_widths.append(image_spacing)  # 使用配置的间距宽度
-
-        # 如果有剩余宽度，在右侧添加空白
-        if remaining_width > 0:
-            table_data.append('')
-            col_widths.append(remaining_width / 2)
-
-        # 创建表格
-        img_table = Table([table_data], colWidths=col_widths)
-        img_table.setStyle(TableStyle([
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 0),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 0),
-            ('TOPPADDING', (0, 0), (-1, -1), 0),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
-        ]))
-        img_table.hAlign = 'CENTER'
+        # 如果有剩余宽度，左侧留出一半以居中显示
+        image_row = ImageRow(
+            [img['element'] for img in row_images],
+            [img['width'] for img in row_images],
+            spacing=image_spacing,
+            left_offset=remaining_width / 2 if remaining_width > 0 else 0
+        )
 
         # 添加到内容对象列表
-        self.content_objects.append(('image_row_table', img_table))
+        self.content_objects.append(('image_row', image_row))
 
-        # 计算表格高度
+        # 计算行高度
         max_img_height = max(getattr(img['element'], 'drawHeight', getattr(img['element'], '_height', 100)) for img in row_images)
         return max_img_height
 
     def _process_text_with_answer_replacement(self, text: str) -> list:
         """处理文本，将"答案："和"解析："替换为图片，返回文本片段和图片的混合列表"""
-        parts = []
-
-        # 先处理"解析："
-        if '解析：' in text:
-            key_point_segments = text.split('解析：')
-            temp_text = ""
-            for i, segment in enumerate(key_point_segments):
-                temp_text += segment
-                if i < len(key_point_segments) - 1:
-                    temp_text += '##KEY_POINT_PLACEHOLDER##'
-            text = temp_text
-
-        # 再处理"答案："
-        if '答案：' in text:
-            answer_segments = text.split('答案：')
-            temp_text = ""
-            for i, segment in enumerate(answer_segments):
-                temp_text += segment
-                if i < len(answer_segments) - 1:
-                    temp_text += '##ANSWER_PLACEHOLDER##'
-            text = temp_text
-
-        # 按占位符分割并处理
-        current_text = text
-        while '##KEY_POINT_PLACEHOLDER##' in current_text or '##ANSWER_PLACEHOLDER##' in current_text:
-            # 找到最早出现的占位符
-            key_point_pos = current_text.find('##KEY_POINT_PLACEHOLDER##')
-            answer_pos = current_text.find('##ANSWER_PLACEHOLDER##')
-
-            if key_point_pos == -1:
-                key_point_pos = float('inf')
-            if answer_pos == -1:
-                answer_pos = float('inf')
-
-            if key_point_pos < answer_pos:
-                # 处理解析
-                before_text = current_text[:key_point_pos]
-                if before_text:
-                    processed_text = self._process_inline_markdown(before_text)
-                    parts.append(('text', processed_text))
-
-                # 添加解析图片
-                parts.append(('key_point_image', None))
-
-                # 获取解析图片后的文本
-                after_placeholder = current_text[key_point_pos + len('##KEY_POINT_PLACEHOLDER##'):]
-
-                # 查找下一个占位符的位置
-                next_key_point_pos = after_placeholder.find('##KEY_POINT_PLACEHOLDER##')
-                next_answer_pos = after_placeholder.find('##ANSWER_PLACEHOLDER##')
-
-                # 找到最近的占位符位置
-                next_placeholder_pos = float('inf')
-                if next_key_point_pos != -1:
-                    next_placeholder_pos = min(next_placeholder_pos, next_key_point_pos)
-                if next_answer_pos != -1:
-                    next_placeholder_pos = min(next_placeholder_pos, next_answer_pos)
-
-                if next_placeholder_pos == float('inf'):
-                    # 没有更多占位符，处理所有剩余文本
-                    if after_placeholder.strip():
-                        processed_text = self._process_inline_markdown(after_placeholder)
-                        parts.append(('text', processed_text))
-                    current_text = ""
-                else:
-                    # 有下一个占位符，只处理到下一个占位符之前的文本
-                    immediate_text = after_placeholder[:next_placeholder_pos]
-                    if immediate_text.strip():
-                        processed_text = self._process_inline_markdown(immediate_text)
-                        parts.append(('text', processed_text))
-                    current_text = after_placeholder[next_placeholder_pos:]
-
-            else:
-                # 处理答案
-                before_text = current_text[:answer_pos]
-                if before_text:
-                    processed_text = self._process_inline_markdown(before_text)
-                    parts.append(('text', processed_text))
-
-                # 添加答案图片
-                parts.append(('answer_image', None))
-
-                # 获取答案图片后的文本
-                after_placeholder = current_text[answer_pos + len('##ANSWER_PLACEHOLDER##'):]
-
-                # 查找下一个占位符的位置
-                next_key_point_pos = after_placeholder.find('##KEY_POINT_PLACEHOLDER##')
-                next_answer_pos = after_placeholder.find('##ANSWER_PLACEHOLDER##')
-
-                # 找到最近的占位符位置
-                next_placeholder_pos = float('inf')
-                if next_key_point_pos != -1:
-                    next_placeholder_pos = min(next_placeholder_pos, next_key_point_pos)
-                if next_answer_pos != -1:
-                    next_placeholder_pos = min(next_placeholder_pos, next_answer_pos)
-
-                if next_placeholder_pos == float('inf'):
-                    # 没有更多占位符，处理所有剩余文本
-                    if after_placeholder.strip():
-                        processed_text = self._process_inline_markdown(after_placeholder)
-                        parts.append(('text', processed_text))
-                    current_text = ""
-                else:
-                    # 有下一个占位符，只处理到下一个占位符之前的文本
-                    immediate_text = after_placeholder[:next_placeholder_pos]
-                    if immediate_text.strip():
-                        processed_text = self._process_inline_markdown(immediate_text)
-                        parts.append(('text', processed_text))
-                    current_text = after_placeholder[next_placeholder_pos:]
-
-        # 处理剩余文本（如果有的话）
-        if current_text.strip():
-            processed_text = self._process_inline_markdown(current_text)
-            parts.append(('text', processed_text))
-
-        return parts
+        return self.markup.split_answer_labels(text)
 
     def _create_answer_image(self, max_width: float) -> Optional[Image]:
         """创建答案标签图片"""
         try:
-            # 查找答案图片路径（考虑不同的工作目录）
-            answer_image_paths = [
-                "answer_images/answer_label.png",
-                "answer_images/answer_label_small.png",
-                "answer_images/answer_label_large.png",
-                "../answer_images/answer_label.png",
-                "../answer_images/answer_label_small.png",
-                "../answer_images/answer_label_large.png",
-                os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "answer_images", "answer_label.png"),
-                os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "answer_images", "answer_label_small.png"),
-                os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "answer_images", "answer_label_large.png"),
-            ]
-
-            # 找到第一个存在的答案图片
-            answer_image_path = None
-            for path in answer_image_paths:
-                if os.path.exists(path):
-                    answer_image_path = path
-                    break
-
-            if not answer_image_path:
+            img = _label_image("answer_label", max_width)
+            if img is None:
                 print("未找到答案标签图片")
-                return None
-
-            # 使用PIL检查图片尺寸
-            with PILImage.open(answer_image_path) as pil_img:
-                orig_width, orig_height = pil_img.size
-
-                # 计算合适的尺寸（答案图片应该比较小，缩小50%）
-                target_width = min(40, max_width * 0.1)  # 最大40像素或10%宽度（缩小50%）
-                scale_ratio = min(target_width / orig_width, 1.0)  # 不放大
-
-                new_width = orig_width * scale_ratio
-                new_height = orig_height * scale_ratio
-
-                # 创建ReportLab Image对象
-                img = Image(answer_image_path, width=new_width, height=new_height)
-                return img
-
+            return img
         except Exception as e:
             print(f"创建答案图片失败: {e}")
             return None
@@ -819,45 +912,10 @@ class AnswerAnalysisBox(Flowable):
     def _create_key_point_image(self, max_width: float) -> Optional[Image]:
         """创建重难点剖析标签图片"""
         try:
-            # 查找重难点剖析图片路径（考虑不同的工作目录）
-            key_point_image_paths = [
-                "answer_images/key_point_label.png",
-                "answer_images/key_point_label_small.png",
-                "answer_images/key_point_label_large.png",
-                "../answer_images/key_point_label.png",
-                "../answer_images/key_point_label_small.png",
-                "../answer_images/key_point_label_large.png",
-                os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "answer_images", "key_point_label.png"),
-                os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "answer_images", "key_point_label_small.png"),
-                os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "answer_images", "key_point_label_large.png"),
-            ]
-
-            # 找到第一个存在的重难点剖析图片
-            key_point_image_path = None
-            for path in key_point_image_paths:
-                if os.path.exists(path):
-                    key_point_image_path = path
-                    break
-
-            if not key_point_image_path:
+            img = _label_image("key_point_label", max_width)
+            if img is None:
                 print("未找到重难点剖析标签图片")
-                return None
-
-            # 使用PIL检查图片尺寸
-            with PILImage.open(key_point_image_path) as pil_img:
-                orig_width, orig_height = pil_img.size
-
-                # 计算合适的尺寸（重难点剖析图片应该比较小，与答案图片相同尺寸）
-                target_width = min(40, max_width * 0.1)  # 最大40像素或10%宽度（与答案图片相同）
-                scale_ratio = min(target_width / orig_width, 1.0)  # 不放大
-
-                new_width = orig_width * scale_ratio
-                new_height = orig_height * scale_ratio
-
-                # 创建ReportLab Image对象
-                img = Image(key_point_image_path, width=new_width, height=new_height)
-                return img
-
+            return img
         except Exception as e:
             print(f"创建重难点剖析图片失败: {e}")
             return None
@@ -867,27 +925,7 @@ class AnswerAnalysisBox(Flowable):
         if '答案' not in text:
             return text
 
-        # 查找答案图片路径（考虑不同的工作目录）
-        answer_image_paths = [
-            "answer_images/answer_label.png",
-            "answer_images/answer_label_small.png",
-            "answer_images/answer_label_large.png",
-            "../answer_images/answer_label.png",
-            "../answer_images/answer_label_small.png",
-            "../answer_images/answer_label_large.png",
-            os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "answer_images", "answer_label.png"),
-            os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "answer_images", "answer_label_small.png"),
-            os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "answer_images", "answer_label_large.png"),
-        ]
-
-        # 找到第一个存在的答案图片
-        answer_image_path = None
-        for path in answer_image_paths:
-            if os.path.exists(path):
-                answer_image_path = os.path.abspath(path)
-                break
-
-        if answer_image_path:
+        if _find_label_image("answer_label") is not None:
             # 使用橙色粗体方括号标记替换"答案"
             # 这样既醒目又与原有的双括号样式保持一致
             styled_answer = '<font color="#FF8C00"><b>【答案】</b></font>'
@@ -1206,12 +1244,12 @@ class AnswerAnalysisBox(Flowable):
                         current_y -= 5  # 图片间距
                         i += 1
 
-                    elif content_type == 'image_row_table':
-                        # 图片行表格
-                        table_width, table_height = content_obj.wrap(content_width, self.height)
-                        current_y -= table_height
+                    elif content_type == 'image_row':
+                        # 图片行
+                        row_width, row_height = content_obj.wrap(content_width, self.height)
+                        current_y -= row_height
                         content_obj.drawOn(canvas, content_x, current_y)
-                        current_y -= 10  # 表格间距
+                        current_y -= 10  # 行间距
                         i += 1
 
                     else:
@@ -1261,12 +1299,19 @@ class AnswerAnalysisBox(Flowable):
 class ColorBandPageTemplate(PageTemplate):
     """带有顶部和底部色条的页面模板，包含页眉和页码"""
 
-    def __init__(self, id, frames, pagesize, **kwargs):
+    def __init__(self, id, frames, pagesize, decorate: bool = True, **kwargs):
         super().__init__(id, frames, pagesize=pagesize, **kwargs)
         self.pagesize = pagesize
+        # 分片渲染时只排版内容，色条、页眉和页码在合并时统一绘制
+        self.decorate = decorate
 
     def beforeDrawPage(self, canvas, doc):
         """在绘制页面内容之前绘制色条、页眉和页码"""
+        if self.decorate:
+            self.draw_decorations(canvas, canvas.getPageNumber())
+
+    def draw_decorations(self, canvas, page_num: int):
+        """绘制指定页码的色条、页眉和页码（奇偶页布局不同）"""
         # 获取页面尺寸
         page_width, page_height = self.pagesize
 
@@ -1287,9 +1332,6 @@ class ColorBandPageTemplate(PageTemplate):
         # 绘制底部色条（高度为0.8cm）
         canvas.rect(0, 0, page_width, bottom_band_height, fill=1, stroke=0)
 
-        # 获取当前页码
-        page_num = canvas.getPageNumber()
-
         # 页眉文字
         header_text = "非学而思课堂材料，学员自由领取。"
 
@@ -1369,12 +1411,126 @@ class ColorBandPageTemplate(PageTemplate):
         canvas.restoreState()
 
 
+class LazyLines:
+    """按需切分的文本行序列
+
+    与 content.split('\n') 的结果一致，但只在访问时才切分，
+    并通过 release() 丢弃已处理的行，避免一次性持有全部行。
+    """
+
+    def __init__(self, content: str):
+        self._content = content
+        self._pos = 0
+        self._base = 0  # _buffer[0] 对应的行号
+        self._buffer: List[str] = []
+
+    def _read_until(self, index: int) -> bool:
+        content = self._content
+        while self._base + len(self._buffer) <= index:
+            if self._pos > len(content):
+                return False
+            end = content.find('\n', self._pos)
+            if end == -1:
+                end = len(content)
+            self._buffer.append(content[self._pos:end])
+            self._pos = end + 1
+        return True
+
+    def has(self, index: int) -> bool:
+        """第index行是否存在"""
+        return self._read_until(index)
+
+    def __getitem__(self, index: int) -> str:
+        if index < self._base or not self._read_until(index):
+            raise IndexError(index)
+        return self._buffer[index - self._base]
+
+    def release(self, index: int):
+        """丢弃第index行之前的所有行"""
+        if index > self._base:
+            del self._buffer[:index - self._base]
+            self._base = index
+
+
+class StreamingStory:
+    """按需从生成器取出元素的故事列表
+
+    实现 BaseDocTemplate.build 使用到的列表操作，排版时才逐个生成元素，
+    已排版的元素随即释放，超大文档的峰值内存因此基本保持不变。
+    """
+
+    def __init__(self, flowables: Iterator[Flowable], lookahead: int = 4):
+        self._source = flowables
+        self._buffer: List[Flowable] = []
+        self._lookahead = lookahead
+        self._exhausted = False
+
+    def _fill(self, count: int):
+        while not self._exhausted and len(self._buffer) < count:
+            try:
+                self._buffer.append(next(self._source))
+            except StopIteration:
+                self._exhausted = True
+
+    def __len__(self):
+        # 预读少量元素；如果末尾元素要求与下一个元素同页(keepWithNext)，继续预读。
+        # 与 BaseDocTemplate.handle_keepWithNext 一样通过 getKeepWithNext() 判断，包括来自段落样式的设置
+        self._fill(self._lookahead)
+        while not self._exhausted and self._buffer and self._buffer[-1].getKeepWithNext():
+            self._fill(len(self._buffer) + 1)
+        return len(self._buffer)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.stop is not None:
+                self._fill(index.stop)
+            return self._buffer[index]
+        self._fill(index + 1)
+        return self._buffer[index]
+
+    def __setitem__(self, index, value):
+        self._buffer[index] = value
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            if index.stop is not None:
+                self._fill(index.stop)
+        else:
+            self._fill(index + 1)
+        del self._buffer[index]
+
+    def insert(self, index: int, flowable: Flowable):
+        self._buffer.insert(index, flowable)
+
+
+class CancellableDocTemplate(BaseDocTemplate):
+    """支持协作式取消的文档模板，每排版一个元素前检查取消令牌"""
+
+    def __init__(self, filename, cancel_token: Optional[CancelToken] = None, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.cancel_token = cancel_token
+
+    def build(self, flowables, filename=None, canvasmaker=FormulaCanvas):
+        super().build(flowables, filename, canvasmaker)
+
+    def handle_flowable(self, flowables):
+        """排版下一个元素前检查是否已取消"""
+        if self.cancel_token is not None:
+            self.cancel_token.raise_if_cancelled()
+        super().handle_flowable(flowables)
+
+
 class PDFService:
     """PDF生成服务类"""
 
+    _font_lock = threading.Lock()
+    _fonts_registered = False
+
     def __init__(self):
         self.output_dir = "generated_pdfs"
         self.image_cache_dir = "image_cache"
+        self._inline_markup: Optional[InlineMarkupRenderer] = None
+        self._inline_math_styles = weakref.WeakKeyDictionary()
         os.makedirs(self.output_dir, exist_ok=True)
         os.makedirs(self.image_cache_dir, exist_ok=True)
 
@@ -1386,8 +1542,14 @@ class PDFService:
             'Legal': legal
         }
 
-        # 注册中文字体
-        self._register_chinese_fonts()
+        # 注册中文字体（每个进程只注册一次，重复解析字体文件会拖慢每次请求）
+        with PDFService._font_lock:
+            if not PDFService._fonts_registered:
+                self._register_chinese_fonts()
+                PDFService._fonts_registered = True
+
+        # 段落断行使用按字体缓存的字宽（每个进程只安装一次）
+        text_metrics.install()
 
     def _register_chinese_fonts(self):
         """注册中文字体"""
@@ -1612,14 +1774,19 @@ class PDFService:
         self,
         content: str,
         config: LayoutConfig,
-        filename: Optional[str] = None
+        filename: Optional[str] = None,
+        cancel_token: Optional[CancelToken] = None,
+        sharded: bool = False
     ) -> str:
         """
         生成PDF文件
+
+        sharded=True 时按一级标题分片并行渲染，每章从新的一页开始
         """
 
-        # 预处理：下载网络图片
+        # 预处理：下载网络图片，并发预渲染公式
         await self._preprocess_images(content)
+        await self._prerender_formulas(content, config, cancel_token)
 
         # 生成文件名
         if not filename:
@@ -1629,12 +1796,180 @@ class PDFService:
 
         pdf_path = os.path.join(self.output_dir, filename)
 
-        # 在线程池中生成PDF以避免阻塞
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self._generate_pdf_sync, content, config, pdf_path)
+        # 在渲染进程中生成PDF以避免阻塞
+        if sharded:
+            await self._run_sharded_render(content, config, pdf_path, cancel_token)
+        else:
+            await self._run_render(content, config, pdf_path, cancel_token)
 
         return pdf_path
 
+    async def _run_render(self, content: str, config: LayoutConfig, output_path: str,
+                          cancel_token: Optional[CancelToken] = None, decorate: bool = True):
+        """在渲染进程池中执行渲染（未启用时使用线程池），协程被取消时同时取消渲染"""
+        if render_pool.enabled:
+            await render_pool.render(content, config, output_path, cancel_token, decorate=decorate)
+            return
+
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self._generate_pdf_sync, content, config, output_path,
+                                       cancel_token, decorate)
+        except asyncio.CancelledError:
+            if cancel_token is not None:
+                cancel_token.cancel("渲染协程已被取消")
+            raise
+
+    def _split_into_shards(self, content: str) -> List[str]:
+        """在一级标题处切分文档，每个分片以一个一级标题开始
+
+        去掉分片末尾的空行，使同一章节在文档中任意位置都得到相同的内容（及缓存键）
+        """
+        shards = []
+        current: List[str] = []
+
+        for line in content.split('\n'):
+            if line.strip().startswith('# ') and any(l.strip() for l in current):
+                shards.append('\n'.join(current).rstrip())
+                current = []
+            current.append(line)
+
+        if any(l.strip() for l in current):
+            shards.append('\n'.join(current).rstrip())
+
+        return shards
+
+    async def _run_sharded_render(self, content: str, config: LayoutConfig, output_path: str,
+                                  cancel_token: Optional[CancelToken] = None):
+        """按一级标题分片，在多个渲染进程中并行排版，再合并并统一绘制页眉页码
+
+        每个章节的排版结果按内容和配置缓存，未改动的章节直接复用缓存片段
+        """
+        shards = self._split_into_shards(content)
+        if len(shards) < 2:
+            await self._run_render(content, config, output_path, cancel_token)
+            return
+
+        try:
+            import pypdf  # noqa: F401
+        except ImportError:
+            print("未安装pypdf，分片渲染回退为整体渲染")
+            await self._run_render(content, config, output_path, cancel_token)
+            return
+
+        cancel_token = cancel_token or CancelToken()
+        keys = [fragment_cache.key(shard, config, self._image_dependencies(shard)) for shard in shards]
+        unique_shards = dict(zip(keys, shards))
+
+        # 当前任务使用的片段文件：命中的缓存片段链接到这里，其余章节渲染到这里，
+        # 拼接前其他请求淘汰缓存文件也不影响。只渲染缓存中没有的章节，相同章节只渲染一次
+        temp_paths = {key: fragment_cache.temp_path_for(key) for key in unique_shards}
+        missing = {
+            key: shard for key, shard in unique_shards.items()
+            if not fragment_cache.checkout(key, temp_paths[key])
+        }
+        fragment_paths = [temp_paths[key] for key in keys]
+        if len(missing) < len(unique_shards):
+            print(f"章节片段缓存命中 {len(unique_shards) - len(missing)}/{len(unique_shards)}")
+
+        failures = []
+
+        async def render_shard(key: str, shard: str):
+            try:
+                await self._run_render(shard, config, temp_paths[key], cancel_token, decorate=False)
+            except BaseException as e:
+                # 任一分片失败时取消其余分片
+                failures.append(e)
+                cancel_token.cancel("其他分片渲染失败")
+                raise
+
+        try:
+            tasks = [asyncio.ensure_future(render_shard(key, shard)) for key, shard in missing.items()]
+            if tasks:
+                try:
+                    await asyncio.wait(tasks)
+                except asyncio.CancelledError:
+                    # 请求被取消时也要等其余分片停止，之后才能清理它们写入的临时文件
+                    cancel_token.cancel("渲染已取消")
+                    await asyncio.wait(tasks)
+                    raise
+            for task in tasks:
+                # 取走各分片的异常，失败原因以最先失败的分片为准
+                if not task.cancelled():
+                    task.exception()
+            if failures:
+                raise failures[0]
+
+            for key in missing:
+                fragment_cache.put(key, temp_paths[key])
+
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self._stitch_fragments, fragment_paths, config, output_path)
+        finally:
+            for path in temp_paths.values():
+                if os.path.exists(path):
+                    os.remove(path)
+
+        if missing:
+            fragment_cache.prune()
+
+    def _image_dependencies(self, content: str) -> List[tuple]:
+        """内容引用的图片的 (引用, 修改时间, 大小)，图片文件改变后章节片段缓存随之失效"""
+        dependencies = []
+        for markdown_src, html_src in _IMAGE_REFERENCE_PATTERN.findall(content):
+            img_src = self._parse_image_size(markdown_src)[0] if markdown_src else html_src
+            image_path = self._resolve_image_path(img_src)
+            try:
+                stat = os.stat(image_path) if image_path else None
+            except OSError:
+                stat = None
+            if stat is None:
+                dependencies.append((img_src, None, None))
+            else:
+                dependencies.append((img_src, stat.st_mtime_ns, stat.st_size))
+        return dependencies
+
+    def _stitch_fragments(self, fragment_paths: List[str], config: LayoutConfig, output_path: str) -> int:
+        """按顺序合并只含内容的PDF片段，并按最终页码绘制色条、页眉和页码，返回总页数"""
+        from pypdf import PdfReader, PdfWriter
+
+        readers = [PdfReader(path) for path in fragment_paths]
+        total_pages = sum(len(reader.pages) for reader in readers)
+
+        # 一次性生成全部页面的装饰层，页码连续，奇偶页布局随之正确
+        decorations = PdfReader(self._render_page_decorations(total_pages, config))
+
+        writer = PdfWriter()
+        page_index = 0
+        for reader in readers:
+            for page in reader.pages:
+                # 装饰层放在内容下方，与整体渲染时先画色条再画内容一致
+                page.merge_page(decorations.pages[page_index], over=False)
+                writer.add_page(page)
+                page_index += 1
+
+        with open(output_path, 'wb') as f:
+            writer.write(f)
+
+        return total_pages
+
+    def _render_page_decorations(self, page_count: int, config: LayoutConfig) -> BytesIO:
+        """生成只包含色条、页眉和页码的PDF，页码从1开始"""
+        from reportlab.pdfgen import canvas as pdf_canvas
+
+        page_size = self.page_sizes.get(config.page_format, A4)
+        template = ColorBandPageTemplate(id='decorations', frames=[], pagesize=page_size)
+
+        buffer = BytesIO()
+        canv = pdf_canvas.Canvas(buffer, pagesize=page_size)
+        for page_num in range(1, page_count + 1):
+            template.draw_decorations(canv, page_num)
+            canv.showPage()
+        canv.save()
+
+        buffer.seek(0)
+        return buffer
+
     async def _preprocess_images(self, content: str):
         """预处理内容中的图片，下载网络图片到缓存"""
         # 查找所有图片引用 (Markdown格式)
@@ -1655,8 +1990,12 @@ class PDFService:
             if img_src.startswith(('http://', 'https://')):
                 await self._download_image(img_src)
 
-    def _generate_pdf_sync(self, content: str, config: LayoutConfig, output_path: str):
-        """同步生成PDF"""
+    def _generate_pdf_sync(self, content: str, config: LayoutConfig, output_path: str,
+                           cancel_token: Optional[CancelToken] = None, decorate: bool = True):
+        """同步生成PDF，cancel_token被取消时抛出RenderCancelledError
+
+        decorate=False 时只排版内容，不绘制色条、页眉和页码（用于分片渲染）
+        """
 
         # 获取页面尺寸
         page_size = self.page_sizes.get(config.page_format, A4)
@@ -1675,9 +2014,10 @@ class PDFService:
         left_margin = config.margin_left * cm
         right_margin = config.margin_right * cm
 
-        # 创建基础文档模板
-        doc = BaseDocTemplate(
+        # 创建基础文档模板（支持取消）
+        doc = CancellableDocTemplate(
             output_path,
+            cancel_token=cancel_token,
             pagesize=page_size,
             topMargin=top_margin,
             bottomMargin=bottom_margin,
@@ -1698,7 +2038,8 @@ class PDFService:
         template = ColorBandPageTemplate(
             id='main',
             frames=[frame],
-            pagesize=page_size
+            pagesize=page_size,
+            decorate=decorate
         )
 
         # 添加页面模板到文档
@@ -1707,8 +2048,8 @@ class PDFService:
         # 创建样式
         styles = self._create_styles(config)
 
-        # 解析Markdown并转换为PDF元素
-        story = self._markdown_to_pdf_elements(content, styles, config)
+        # 解析Markdown并流式生成PDF元素，排版消费到哪里才生成到哪里
+        story = StreamingStory(self._iter_pdf_elements(content, styles, config, cancel_token))
 
         # 构建PDF
         doc.build(story)
@@ -1777,17 +2118,24 @@ class PDFService:
             'heading3': heading3_style
         }
     
-    def _markdown_to_pdf_elements(self, content: str, styles: Dict[str, ParagraphStyle], config: LayoutConfig) -> List:
-        """将Markdown内容转换为PDF元素"""
+    def _iter_pdf_elements(self, content: str, styles: Dict[str, ParagraphStyle], config: LayoutConfig,
+                           cancel_token: Optional[CancelToken] = None) -> Iterator[Flowable]:
+        """逐块解析Markdown并按需生成PDF元素，供流式排版使用"""
 
         # 预处理：将LaTeX数学公式转换为图片
         content = self._process_math_formulas(content, config)
 
-        story = []
-        lines = content.split('\n')
+        lines = LazyLines(content)
 
         i = 0
-        while i < len(lines):
+        while lines.has(i):
+            # 已处理的行不再保留
+            lines.release(i)
+
+            # 每处理一个块之前检查渲染是否已被取消
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+
             # 保留原始行内容，用于后续处理
             original_line = lines[i]
             # 创建去除空格的版本用于判断行类型
@@ -1795,7 +2143,7 @@ class PDFService:
 
             if not line:
                 # 空行
-                story.append(Spacer(1, 6))
+                yield Spacer(1, 6)
                 i += 1
                 continue
 
@@ -1820,7 +2168,7 @@ class PDFService:
                     # 处理连续图片的并排显示
                     row_layout = self._create_image_row_layout(consecutive_images, styles, config)
                     if row_layout:
-                        story.extend(row_layout)
+                        yield from row_layout
 
                     # 跳过已处理的图片行
                     i += len(consecutive_images)
@@ -1867,24 +2215,24 @@ class PDFService:
                                 allowWidows=0,
                                 allowOrphans=0
                             )
-                            story.append(Paragraph(alt_text, caption_style))
+                            yield CachedParagraph(alt_text, caption_style)
 
                         if align == 'left':
                             # 左对齐：创建自定义的左对齐图片容器
                             img_container = self._create_aligned_image_container(img_element, 'LEFT')
-                            story.append(img_container)
+                            yield img_container
                         elif align == 'right':
                             # 右对齐：创建自定义的右对齐图片容器
                             img_container = self._create_aligned_image_container(img_element, 'RIGHT')
-                            story.append(img_container)
+                            yield img_container
                         else:
                             # 居中对齐（默认）
                             img_container = self._create_aligned_image_container(img_element, 'CENTER')
-                            story.append(img_container)
+                            yield img_container
                     else:
                         # 如果图片处理失败，显示alt文本
                         if alt_text:
-                            story.append(Paragraph(f"[图片: {alt_text}]", styles['normal']))
+                            yield CachedParagraph(f"[图片: {alt_text}]", styles['normal'])
                     i += 1
                     continue
 
@@ -1902,15 +2250,15 @@ class PDFService:
                     styles['heading1'],
                     background_image_path if os.path.exists(background_image_path) else None
                 )
-                story.append(heading_element)
+                yield heading_element
                 # 添加60px间距
-                story.append(Spacer(1, 60))
+                yield Spacer(1, 60)
             elif line.startswith('## '):
                 text = line[3:].strip()
-                story.append(Paragraph(text, styles['heading2']))
+                yield CachedParagraph(text, styles['heading2'])
             elif line.startswith('### '):
                 text = line[4:].strip()
-                story.append(Paragraph(text, styles['heading3']))
+                yield CachedParagraph(text, styles['heading3'])
 
             # 编号列表处理
             elif re.match(r'^\d+\.\s+', line):
@@ -1935,9 +2283,9 @@ class PDFService:
                         styles['normal'],
                         background_image_path if os.path.exists(background_image_path) else None
                     )
-                    story.append(list_item)
+                    yield list_item
                     # 添加小间距
-                    story.append(Spacer(1, 5))
+                    yield Spacer(1, 5)
 
             # 答案及解析框处理 - 支持多段落内容
             elif line.strip().startswith('/'):
@@ -1953,7 +2301,7 @@ class PDFService:
                     else:
                         # 多行格式，跳过到结束斜杠
                         i += 1
-                        while i < len(lines):
+                        while lines.has(i):
                             current_line = lines[i].strip()
                             if current_line.endswith('/'):
                                 # 找到结束斜杠，跳出循环
@@ -1976,7 +2324,7 @@ class PDFService:
                             content_lines.append(current_line[1:])  # 去掉开始的斜杠
 
                         i += 1
-                        while i < len(lines):
+                        while lines.has(i):
                             current_line = lines[i].strip()
                             if current_line.endswith('/'):
                                 # 找到结束斜杠
@@ -2006,9 +2354,9 @@ class PDFService:
 
                         # 创建答案及解析框
                         answer_box = AnswerAnalysisBox(full_text, answer_style, config)
-                        story.append(answer_box)
+                        yield answer_box
                         # 添加间距
-                        story.append(Spacer(1, 10))
+                        yield Spacer(1, 10)
 
 
 
@@ -2017,7 +2365,7 @@ class PDFService:
                 # 收集连续的非空行作为一个段落，使用原始行内容保持空格
                 paragraph_lines = [original_line]
                 i += 1
-                while i < len(lines) and lines[i].strip() and not lines[i].strip().startswith('#') and not re.match(r'!\[(.*?)\]\((.*?)\)', lines[i].strip()) and not re.match(r'^\d+\.\s+', lines[i].strip()) and not re.match(r'^/.*/$', lines[i].strip()):
+                while lines.has(i) and lines[i].strip() and not lines[i].strip().startswith('#') and not re.match(r'!\[(.*?)\]\((.*?)\)', lines[i].strip()) and not re.match(r'^\d+\.\s+', lines[i].strip()) and not re.match(r'^/.*/$', lines[i].strip()):
                     # 保留原始行内容，不使用strip()以保持空格
                     paragraph_lines.append(lines[i])
                     i += 1
@@ -2030,18 +2378,19 @@ class PDFService:
                 if '$' in paragraph_text:
                     # 处理包含数学公式的段落
                     math_elements = self._process_paragraph_with_latex(paragraph_text, styles['normal'])
-                    story.extend(math_elements)
+                    yield from math_elements
+                elif PlainParagraph.is_plain(paragraph_text):
+                    # 纯文本段落，跳过行内格式处理和XML解析
+                    yield PlainParagraph(paragraph_text, styles['normal'])
                 else:
                     # 处理简单的Markdown格式
                     paragraph_text = self._process_inline_markdown(paragraph_text)
                     # 普通段落处理
-                    story.append(Paragraph(paragraph_text, styles['normal']))
+                    yield CachedParagraph(paragraph_text, styles['normal'])
                 continue
 
             i += 1
 
-        return story
-
     def _parse_image_size(self, img_src_full: str) -> tuple[str, dict]:
         """解析图片路径和尺寸参数
 
@@ -2146,58 +2495,16 @@ class PDFService:
             scale_ratio = min(width_ratio, height_ratio, 1.0)  # 不放大图片
             return orig_width * scale_ratio, orig_height * scale_ratio
 
-    def _create_aligned_image_container(self, img_element: Image, alignment: str) -> Table:
+    def _create_aligned_image_container(self, img_element: Image, alignment: str) -> AlignedImage:
         """创建对齐的图片容器，确保与文本边界对齐"""
-        from reportlab.platypus import Table, TableStyle
-
-        if alignment == 'LEFT':
-            # 左对齐：图片在左侧，右侧填充空白
-            img_table = Table([[img_element, '']], colWidths=[None, '*'])
-            img_table.setStyle(TableStyle([
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),   # 整个表格左对齐
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),   # 整个表格顶部对齐
-                ('LEFTPADDING', (0, 0), (-1, -1), 0),  # 所有单元格左侧无内边距
-                ('RIGHTPADDING', (0, 0), (-1, -1), 0), # 所有单元格右侧无内边距
-                ('TOPPADDING', (0, 0), (-1, -1), 0),   # 所有单元格顶部无内边距
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 0), # 所有单元格底部无内边距
-            ]))
-            # 设置表格本身的对齐方式
-            img_table.hAlign = 'LEFT'
-        elif alignment == 'RIGHT':
-            # 右对齐：左侧填充空白，图片在右侧
-            img_table = Table([['', img_element]], colWidths=['*', None])
-            img_table.setStyle(TableStyle([
-                ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),  # 整个表格右对齐
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),   # 整个表格顶部对齐
-                ('LEFTPADDING', (0, 0), (-1, -1), 0),  # 所有单元格左侧无内边距
-                ('RIGHTPADDING', (0, 0), (-1, -1), 0), # 所有单元格右侧无内边距
-                ('TOPPADDING', (0, 0), (-1, -1), 0),   # 所有单元格顶部无内边距
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 0), # 所有单元格底部无内边距
-            ]))
-            # 设置表格本身的对齐方式
-            img_table.hAlign = 'RIGHT'
-        else:  # CENTER
-            # 居中对齐：两侧等宽填充
-            img_table = Table([['', img_element, '']], colWidths=['*', None, '*'])
-            img_table.setStyle(TableStyle([
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'), # 整个表格居中对齐
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),   # 整个表格顶部对齐
-                ('LEFTPADDING', (0, 0), (-1, -1), 0),  # 所有单元格左侧无内边距
-                ('RIGHTPADDING', (0, 0), (-1, -1), 0), # 所有单元格右侧无内边距
-                ('TOPPADDING', (0, 0), (-1, -1), 0),   # 所有单元格顶部无内边距
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 0), # 所有单元格底部无内边距
-            ]))
-            # 设置表格本身的对齐方式
-            img_table.hAlign = 'CENTER'
-
-        return img_table
-
-    def _collect_consecutive_images(self, lines: list, start_index: int) -> list:
+        return AlignedImage(img_element, alignment)
+
+    def _collect_consecutive_images(self, lines: "LazyLines", start_index: int) -> list:
         """收集连续的图片行"""
         consecutive_images = []
         i = start_index
 
-        while i < len(lines):
+        while lines.has(i):
             line = lines[i].strip()
 
             # 检查是否是图片语法 (Markdown 或 HTML)
@@ -2288,11 +2595,10 @@ class PDFService:
                     # 当前行已满，创建行布局
                     if current_row_images:
                         # 添加图片说明（放在图片上方）
-                        captions = self._create_image_row_captions(current_row_images, styles, available_width)
+                        captions = self._create_image_row_captions(current_row_images, styles, available_width, spacing_between_images)
                         story_elements.extend(captions)
 
-                        row_table = self._create_image_row_table(current_row_images, available_width, spacing_between_images)
-                        story_elements.append(row_table)
+                        story_elements.append(self._create_image_row(current_row_images, available_width, spacing_between_images))
 
                     # 开始新行
                     current_row_images = [{
@@ -2337,86 +2643,40 @@ class PDFService:
                         allowWidows=0,
                         allowOrphans=0
                     )
-                    story_elements.append(Paragraph(img_info['alt_text'], caption_style))
+                    story_elements.append(CachedParagraph(img_info['alt_text'], caption_style))
 
                 story_elements.append(img_container)
             else:
                 # 多张图片，创建行布局
                 # 添加图片说明（放在图片上方）
-                captions = self._create_image_row_captions(current_row_images, styles, available_width)
+                captions = self._create_image_row_captions(current_row_images, styles, available_width, spacing_between_images)
                 story_elements.extend(captions)
 
-                row_table = self._create_image_row_table(current_row_images, available_width, spacing_between_images)
-                story_elements.append(row_table)
+                story_elements.append(self._create_image_row(current_row_images, available_width, spacing_between_images))
 
         return story_elements
 
-    def _create_image_row_table(self, row_images: list, available_width: float, image_spacing: float = 20) -> Table:
-        """创建图片行表格"""
-        from reportlab.platypus import Table, TableStyle
-
-        # 计算列宽
-        total_image_width = sum(img['width'] for img in row_images)
-        spacing_count = len(row_images) - 1
-        spacing_width = spacing_count * image_spacing if spacing_count > 0 else 0
+    def _create_image_row(self, row_images: list, available_width: float, image_spacing: float = 20) -> ImageRow:
+        """创建并排的图片行，左侧留出50像素的固定边距"""
+        return ImageRow(
+            [img['element'] for img in row_images],
+            [img['width'] for img in row_images],
+            spacing=image_spacing,
+            left_offset=50,
+            min_width=available_width
+        )
 
-        # 构建表格数据和列宽
-        table_data = []
-        col_widths = []
-
-        # 添加左侧50像素的固定边距
-        left_margin = 50
-        col_widths.append(left_margin)
-        table_data.append('')
-
-        # 添加图片和间距
-        for i, img_info in enumerate(row_images):
-            table_data.append(img_info['element'])
-            col_widths.append(img_info['width'])
-
-            # 添加图片间距（除了最后一张图片）
-            if i < len(row_images) - 1:
-                table_data.append('')
-                col_widths.append(image_spacing)  # 使用配置的间距宽度
-
-        # 添加右侧剩余空间
-        right_space = available_width - left_margin - total_image_width - spacing_width
-        if right_space > 0:
-            table_data.append('')
-            col_widths.append(right_space)
-
-        # 创建表格
-        img_table = Table([table_data], colWidths=col_widths)
-        img_table.setStyle(TableStyle([
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 0),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 0),
-            ('TOPPADDING', (0, 0), (-1, -1), 0),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
-        ]))
-        img_table.hAlign = 'LEFT'
-
-        return img_table
-
-    def _create_image_row_captions(self, row_images: list, styles: dict, available_width: float = 400) -> list:
-        """创建图片行的说明文字"""
+    def _create_image_row_captions(self, row_images: list, styles: dict, available_width: float = 400,
+                                   image_spacing: float = 20) -> list:
+        """创建图片行的说明文字，每条说明与下方对应的图片对齐"""
         captions = []
 
         # 检查是否有任何图片有说明文字
         has_captions = any(img['alt_text'] for img in row_images)
 
         if has_captions:
-            # 创建说明文字的表格布局，与图片表格保持一致
-            caption_data = []
-            col_widths = []
-
-            # 添加左侧50像素的固定边距
-            left_margin = 50
-            col_widths.append(left_margin)
-            caption_data.append('')
-
-            for i, img_info in enumerate(row_images):
+            caption_paras = []
+            for img_info in row_images:
                 caption_text = img_info['alt_text'] if img_info['alt_text'] else ''
 
                 if caption_text:
@@ -2432,40 +2692,21 @@ class PDFService:
                         allowWidows=0,
                         allowOrphans=0
                     )
-                    caption_para = Paragraph(caption_text, caption_style)
+                    caption_para = CachedParagraph(caption_text, caption_style)
                 else:
-                    caption_para = Paragraph('', styles['normal'])
-
-                caption_data.append(caption_para)
-                col_widths.append(img_info['width'])
-
-                # 添加间距列（除了最后一张图片）
-                if i < len(row_images) - 1:
-                    caption_data.append('')
-                    col_widths.append(20)
-
-            # 计算右侧剩余空间
-            total_image_width = sum(img['width'] for img in row_images)
-            spacing_count = len(row_images) - 1
-            spacing_width = spacing_count * 20 if spacing_count > 0 else 0
-            right_space = available_width - left_margin - total_image_width - spacing_width
-            if right_space > 0:
-                caption_data.append('')
-                col_widths.append(right_space)
-
-            # 创建说明文字表格
-            caption_table = Table([caption_data], colWidths=col_widths)
-            caption_table.setStyle(TableStyle([
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                ('LEFTPADDING', (0, 0), (-1, -1), 0),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 0),
-                ('TOPPADDING', (0, 0), (-1, -1), 2),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ]))
-            caption_table.hAlign = 'LEFT'
-
-            captions.append(caption_table)
+                    caption_para = CachedParagraph('', styles['normal'])
+
+                caption_paras.append(caption_para)
+
+            captions.append(ImageRow(
+                caption_paras,
+                [img['width'] for img in row_images],
+                spacing=image_spacing,
+                left_offset=50,
+                min_width=available_width,
+                top_padding=2,
+                bottom_padding=12
+            ))
 
         return captions
 
@@ -2475,93 +2716,99 @@ class PDFService:
         # 在段落处理时再进行转换
         return content
 
-    def _save_math_image(self, image_data: bytes, filename_prefix: str) -> Optional[str]:
-        """保存数学公式图片到临时文件"""
-        try:
-            import tempfile
-
-            # 创建临时目录
-            temp_dir = os.path.join(tempfile.gettempdir(), 'printmind_math')
-            os.makedirs(temp_dir, exist_ok=True)
-
-            # 生成文件名
-            filename = f"{filename_prefix}.png"
-            filepath = os.path.join(temp_dir, filename)
-
-            # 保存图片
-            with open(filepath, 'wb') as f:
-                f.write(image_data)
-
-            return filepath
-
-        except Exception as e:
-            print(f"保存数学公式图片失败: {e}")
-            return None
-
-    def _process_inline_markdown(self, text: str) -> str:
-        """处理行内Markdown格式"""
-
-        # 处理LaTeX数学公式
-        text = self._process_latex_formulas_inline(text)
-
-        # 处理HTML字体标签 - 支持用户自定义字体
-        # 匹配 <span style="font-family: FontName">text</span> 格式
-        def replace_font_span(match):
-            font_family = match.group(1)
-            content = match.group(2)
-            # 将字体名称映射到已注册的字体
-            mapped_font = self._map_font_family(font_family)
-            return f'<font name="{mapped_font}">{content}</font>'
+    def _collect_formulas(self, content: str, config: LayoutConfig) -> List[tuple]:
+        """按正文段落的划分方式收集文档中需要渲染的 (公式, 字号)，顺序与排版时一致
 
-        text = re.sub(r'<span style="font-family:\s*([^"]+)">(.*?)</span>', replace_font_span, text)
+        直接排版的简单算式不需要预渲染，不在其中
+        """
+        formulas = []
+        paragraph_lines = []
 
-        # 处理几何图形标记
-        text = self._process_geometric_shapes(text)
+        def flush():
+            text = ' '.join(paragraph_lines)
+            paragraph_lines.clear()
+            if '$$' in text:
+                # 含块级公式的段落中只渲染块级公式
+                formulas.extend((formula, DISPLAY_MATH_FONT_SIZE) for formula in _DISPLAY_MATH_PATTERN.findall(text)
+                                if not is_simple_formula(formula))
+            elif '$' in text:
+                formulas.extend((formula, config.font_size) for formula in _INLINE_MATH_PATTERN.findall(text)
+                                if not is_simple_formula(formula))
+
+        for raw_line in content.split('\n'):
+            line = raw_line.strip()
+            if (not line or line.startswith('#') or line.startswith('<img') or re.match(r'!\[(.*?)\]\((.*?)\)', line)
+                    or re.match(r'^\d+\.\s+', line) or re.match(r'^/.*/$', line)):
+                flush()
+                continue
+            paragraph_lines.append(raw_line)
+        flush()
 
-        # 双括号文本 - 橘色楷体文字，保留一个括号
-        # 获取可用的楷体字体名称
-        kaiti_font = self._get_available_kaiti_font()
-        text = re.sub(r'（（(.*?)））', rf'<font color="#FF8C00" name="{kaiti_font}">（\1）</font>', text)
+        return formulas
 
-        # 粗体
-        text = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', text)
-        text = re.sub(r'__(.*?)__', r'<b>\1</b>', text)
+    async def _prerender_formulas(self, content: str, config: LayoutConfig,
+                                  cancel_token: Optional[CancelToken] = None):
+        """在排版前并发转换文档中所有不重复的公式，排版时从公式缓存直接取用
 
-        # 斜体
-        text = re.sub(r'\*(.*?)\*', r'<i>\1</i>', text)
-        text = re.sub(r'_(.*?)_', r'<i>\1</i>', text)
+        渲染已被取消（或被新请求取代）时跳过，预渲染过程中被取消则不再提交剩余的公式
+        """
+        if not formula_pool.enabled or '$' not in content:
+            return
+        if cancel_token is not None and cancel_token.cancelled:
+            return
 
-        # 保留多个空格 - 将连续的空格转换为&nbsp;实体
-        # 但保留单个空格不变，只转换多个连续空格
-        text = re.sub(r'  +', lambda m: '&nbsp;' * len(m.group(0)), text)
+        formulas = self._collect_formulas(content, config)
+        if not formulas:
+            return
 
+        start_time = time.time()
+        rendered = await formula_pool.render(formulas, cancel_token)
+        print(f"公式预渲染完成: {len(formulas)} 个公式，{len(set(formulas))} 个不重复，成功 {len(rendered)} 个，"
+              f"耗时 {time.time() - start_time:.2f}s")
 
-        return text
+    def _inline_formula(self, formula: str, style: ParagraphStyle) -> Optional[tuple]:
+        """行内公式的 (矢量公式, 宽度, 高度)，公式字号与正文一致，转换失败返回None
 
-    def _process_latex_formulas_inline(self, text: str) -> str:
-        """处理行内LaTeX数学公式，直接替换为占位符"""
-        try:
-            # 处理行内数学公式 $...$
-            def replace_inline_math(match):
-                formula = match.group(1)
-                # 直接返回简单的占位符
-                return "[数学公式]"
+        简单算式直接用公式字体排版，其余公式转换为矢量轮廓
+        """
+        vector = text_formula(formula, style.fontSize) or load_formula(formula, style.fontSize)
+        if vector is None:
+            return None
 
-            # 处理块级数学公式 $$...$$
-            def replace_display_math(match):
-                formula = match.group(1)
-                # 块级公式也返回占位符
-                return "[数学公式]"
+        # 过宽的公式等比缩小
+        width, height = vector.width, vector.height
+        if width > INLINE_MATH_MAX_WIDTH:
+            height *= INLINE_MATH_MAX_WIDTH / width
+            width = INLINE_MATH_MAX_WIDTH
+        return vector, width, height
 
-            # 应用替换
-            text = re.sub(r'\$([^$\n]+?)\$', replace_inline_math, text)
-            text = re.sub(r'\$\$([^$]+?)\$\$', replace_display_math, text)
+    def _inline_math_style(self, style: ParagraphStyle) -> ParagraphStyle:
+        """含行内公式的段落样式
 
-            return text
+        行高随公式图片增大，避免与上下行重叠；按字断行，
+        否则公式后整段不含空格的中文会被当作一个词整体移到下一行，两端对齐时留下大段空白
+        """
+        math_style = self._inline_math_styles.get(style)
+        if math_style is None:
+            math_style = ParagraphStyle(f"{style.name}InlineMath", parent=style,
+                                        autoLeading='max', wordWrap='CJK')
+            self._inline_math_styles[style] = math_style
+        return math_style
+
+    @property
+    def inline_markup(self) -> InlineMarkupRenderer:
+        """正文使用的行内标记渲染器（字体注册完成后首次使用时创建）"""
+        if self._inline_markup is None:
+            self._inline_markup = InlineMarkupRenderer(
+                self._map_font_family,
+                self._get_available_kaiti_font(),
+                replace_math=True
+            )
+        return self._inline_markup
 
-        except Exception as e:
-            print(f"LaTeX公式处理失败: {e}")
-            return text
+    def _process_inline_markdown(self, text: str) -> str:
+        """处理行内Markdown格式"""
+        return self.inline_markup.render(text)
 
     def _process_math_markers(self, text: str) -> str:
         """处理数学公式标记，直接替换为占位符文本"""
@@ -2600,14 +2847,14 @@ class PDFService:
                     if i % 2 == 0:
                         # 文本部分
                         if part.strip():
-                            elements.append(Paragraph(part.strip(), style))
+                            elements.append(CachedParagraph(part.strip(), style))
                     else:
                         # 数学公式路径
                         img_element = self._process_image_for_pdf(part, max_width=400, max_height=200)
                         if img_element:
                             elements.append(img_element)
                         else:
-                            elements.append(Paragraph("[数学公式加载失败]", style))
+                            elements.append(CachedParagraph("[数学公式加载失败]", style))
                 return elements
 
             # 处理行内数学公式
@@ -2625,7 +2872,7 @@ class PDFService:
                         # 数学公式路径
                         # 先添加当前累积的文本
                         if current_text.strip():
-                            elements.append(Paragraph(current_text.strip(), style))
+                            elements.append(CachedParagraph(current_text.strip(), style))
                             current_text = ""
 
                         # 添加数学公式图片
@@ -2633,20 +2880,20 @@ class PDFService:
                         if img_element:
                             elements.append(img_element)
                         else:
-                            elements.append(Paragraph("[公式]", style))
+                            elements.append(CachedParagraph("[公式]", style))
 
                 # 添加剩余的文本
                 if current_text.strip():
-                    elements.append(Paragraph(current_text.strip(), style))
+                    elements.append(CachedParagraph(current_text.strip(), style))
 
                 return elements
 
             # 如果没有数学公式，返回普通段落
-            return [Paragraph(text, style)]
+            return [CachedParagraph(text, style)]
 
         except Exception as e:
             print(f"创建数学公式段落失败: {e}")
-            return [Paragraph(text.replace('[INLINE_MATH:', '[公式:').replace('[DISPLAY_MATH:', '[公式:'), style)]
+            return [CachedParagraph(text.replace('[INLINE_MATH:', '[公式:').replace('[DISPLAY_MATH:', '[公式:'), style)]
 
     def _process_paragraph_with_latex(self, text: str, style: ParagraphStyle) -> List:
         """处理包含LaTeX数学公式的段落"""
@@ -2655,97 +2902,64 @@ class PDFService:
         try:
             # 首先处理块级公式 $$...$$
             if '$$' in text:
-                parts = re.split(r'\$\$([^$]+?)\$\$', text)
+                parts = _DISPLAY_MATH_PATTERN.split(text)
                 for i, part in enumerate(parts):
                     if i % 2 == 0:
                         # 文本部分，不再递归处理
                         if part.strip():
                             # 普通文本，直接处理
                             processed_text = self._process_inline_markdown(part)
-                            elements.append(Paragraph(processed_text, style))
+                            elements.append(CachedParagraph(processed_text, style))
                     else:
                         # 块级数学公式
                         formula = part
-                        image_data = math_service.latex_to_image(formula, font_size=10)  # 提高字体大小以增加清晰度
-                        if image_data:
-                            temp_file = self._save_math_image(image_data, f"display_math_{hash(formula)}")
-                            if temp_file:
-                                img_element = self._process_image_for_pdf(temp_file, max_width=200, max_height=100)  # 缩小50%
-                                if img_element:
-                                    elements.append(img_element)
-                                else:
-                                    elements.append(Paragraph("[数学公式加载失败]", style))
-                            else:
-                                elements.append(Paragraph("[数学公式保存失败]", style))
+                        vector = (text_formula(formula, DISPLAY_MATH_FONT_SIZE, True)
+                                  or load_formula(formula, DISPLAY_MATH_FONT_SIZE))
+                        if vector:
+                            # 过宽的公式等比缩小
+                            scale = min(DISPLAY_MATH_MAX_WIDTH / vector.width, 1.0)
+                            elements.append(VectorFormulaFlowable(vector, vector.width * scale, vector.height * scale))
                         else:
-                            elements.append(Paragraph(f"$${formula}$$", style))
+                            elements.append(CachedParagraph(f"$${formula}$$", style))
                 return elements
 
-            # 处理行内公式 $...$
+            # 处理行内公式 $...$：公式以行内矢量图形的形式放在同一个段落里
             if '$' in text:
-                # 分割文本和行内公式，创建多个元素
-                parts = re.split(r'\$([^$\n]+?)\$', text)
-                current_text = ""
+                formulas = []
 
-                for i, part in enumerate(parts):
-                    if i % 2 == 0:
-                        # 文本部分
-                        current_text += part
-                    else:
-                        # 行内数学公式
-                        formula = part
-                        print(f"处理行内公式: {formula}")
+                def replace_formula(match):
+                    formulas.append(match.group(1))
+                    return f"\ue000{len(formulas) - 1}\ue001"
 
-                        # 先添加当前累积的文本
-                        if current_text.strip():
-                            processed_text = self._process_inline_markdown(current_text)
-                            elements.append(Paragraph(processed_text, style))
-                            current_text = ""
+                # 先用占位符替换公式，使跨越公式的行内格式（如粗体）仍能正确转换
+                text_with_placeholders = _INLINE_MATH_PATTERN.sub(replace_formula, text)
+                if not formulas:
+                    return [CachedParagraph(self._process_inline_markdown(text), style)]
 
-                        # 添加数学公式图片
-                        image_data = math_service.latex_to_image(formula, font_size=10)
-                        if image_data:
-                            temp_file = self._save_math_image(image_data, f"inline_math_{hash(formula)}")
-                            if temp_file:
-                                print(f"行内公式图片保存到: {temp_file}")
-                                img_element = self._process_image_for_pdf(temp_file, max_width=100, max_height=30)
-                                if img_element:
-                                    elements.append(img_element)
-                                else:
-                                    current_text += "[公式]"
-                            else:
-                                current_text += "[公式]"
-                        else:
-                            current_text += f"${formula}$"
+                processed_text = self._process_inline_markdown(text_with_placeholders)
 
-                # 添加剩余的文本
-                if current_text.strip():
-                    processed_text = self._process_inline_markdown(current_text)
-                    elements.append(Paragraph(processed_text, style))
+                # 转换成功的公式保留占位符并重新编号，失败的公式显示原文
+                inline_formulas = []
 
-                return elements
+                def place_formula(match):
+                    formula = formulas[int(match.group(1))]
+                    inline_formula = self._inline_formula(formula, style)
+                    if inline_formula is None:
+                        return escape(f"${formula}$")
+                    inline_formulas.append(inline_formula)
+                    return f"\ue000{len(inline_formulas) - 1}\ue001"
+
+                processed_text = _FORMULA_PLACEHOLDER_PATTERN.sub(place_formula, processed_text)
+                return [InlineFormulaParagraph(processed_text, self._inline_math_style(style), inline_formulas)]
 
             # 如果没有数学公式，返回普通段落
             processed_text = self._process_inline_markdown(text)
-            return [Paragraph(processed_text, style)]
+            return [CachedParagraph(processed_text, style)]
 
         except Exception as e:
             print(f"处理LaTeX段落失败: {e}")
             processed_text = self._process_inline_markdown(text)
-            return [Paragraph(processed_text, style)]
-
-    def _process_geometric_shapes(self, text: str) -> str:
-        """处理几何图形标记"""
-
-        # 直接识别Unicode几何图形字符
-        # □ - 正方形（空心正方形）
-        # ○ - 圆形（空心圆形）
-
-        # 不使用font标签，直接保持原始字符，让ReportLab使用当前字体渲染
-        # 这样可以避免基线偏移问题
-        return text
-
-
+            return [CachedParagraph(processed_text, style)]
 
     def _map_font_family(self, font_family: str) -> str:
         """将字体名称映射到已注册的字体"""
@@ -2793,54 +3007,51 @@ class PDFService:
         """同步处理图片（用于PDF生成）"""
         return self._process_image_sync_with_params(img_src, alt_text, {})
 
+    def _resolve_image_path(self, img_src: str) -> Optional[str]:
+        """图片引用对应的本地文件：网络图片取下载缓存，本地图片依次尝试不同目录，找不到时返回None"""
+        # 判断是网络图片还是本地图片
+        if img_src.startswith(('http://', 'https://')):
+            # 网络图片 - 尝试从缓存获取
+            parsed_url = urlparse(img_src)
+            filename = os.path.basename(parsed_url.path)
+            if not filename or '.' not in filename:
+                filename = f"image_{uuid.uuid4().hex[:8]}.jpg"
+
+            cache_path = os.path.join(self.image_cache_dir, filename)
+            return cache_path if os.path.exists(cache_path) else None
+
+        # 本地图片
+        # 尝试相对于不同目录的路径
+        possible_paths = [
+            img_src,  # 原始路径
+            os.path.join("test_images", os.path.basename(img_src)),  # test_images目录（相对于backend）
+            os.path.join("uploads", img_src),  # uploads目录
+            os.path.join("uploads", os.path.basename(img_src)),  # uploads目录中的文件名
+            os.path.join("..", img_src),  # 相对于上级目录
+            os.path.join("..", "backend", img_src),  # 相对于项目根目录的backend
+        ]
+
+        for path in possible_paths:
+            if os.path.exists(path):
+                return path
+        return None
+
     def _process_image_sync_with_params(self, img_src: str, alt_text: str = "", params: dict = None) -> Optional[Image]:
         """同步处理图片（用于PDF生成），支持参数"""
         try:
-            image_path = None
             params = params or {}
 
-            # 判断是网络图片还是本地图片
-            if img_src.startswith(('http://', 'https://')):
-                # 网络图片 - 尝试从缓存获取
-                parsed_url = urlparse(img_src)
-                filename = os.path.basename(parsed_url.path)
-                if not filename or '.' not in filename:
-                    filename = f"image_{uuid.uuid4().hex[:8]}.jpg"
-
-                cache_path = os.path.join(self.image_cache_dir, filename)
-
-                if os.path.exists(cache_path):
-                    image_path = cache_path
-                else:
+            image_path = self._resolve_image_path(img_src)
+            if not image_path:
+                if img_src.startswith(('http://', 'https://')):
                     # 网络图片但未缓存，跳过（在实际应用中可以考虑同步下载）
                     print(f"网络图片未缓存，跳过: {img_src}")
-                    return None
-            else:
-                # 本地图片
-                # 尝试相对于不同目录的路径
-                possible_paths = [
-                    img_src,  # 原始路径
-                    os.path.join("test_images", os.path.basename(img_src)),  # test_images目录（相对于backend）
-                    os.path.join("uploads", img_src),  # uploads目录
-                    os.path.join("uploads", os.path.basename(img_src)),  # uploads目录中的文件名
-                    os.path.join("..", img_src),  # 相对于上级目录
-                    os.path.join("..", "backend", img_src),  # 相对于项目根目录的backend
-                ]
-
-                for path in possible_paths:
-                    if os.path.exists(path):
-                        image_path = path
-                        break
-
-                if not image_path:
+                else:
                     print(f"本地图片文件未找到: {img_src}")
-                    return None
+                return None
 
             # 处理图片
-            if image_path:
-                return self._process_image_for_pdf_with_params(image_path, params)
-
-            return None
+            return self._process_image_for_pdf_with_params(image_path, params)
 
         except Exception as e:
             print(f"处理图片失败 {img_src}: {e}")
@@ -2908,11 +3119,14 @@ class PDFService:
             print(f"处理图片失败 {image_path}: {e}")
             return None
 
-    async def generate_pdf_preview(self, content: str, config: LayoutConfig) -> str:
+    async def generate_pdf_preview(self, content: str, config: LayoutConfig,
+                                   cancel_token: Optional[CancelToken] = None,
+                                   sharded: bool = False) -> str:
         """生成PDF预览（返回base64编码）"""
 
-        # 预处理：下载网络图片
+        # 预处理：下载网络图片，并发预渲染公式
         await self._preprocess_images(content)
+        await self._prerender_formulas(content, config, cancel_token)
 
         # 生成临时PDF
         temp_filename = f"preview_{uuid.uuid4().hex[:8]}.pdf"
@@ -2920,8 +3134,10 @@ class PDFService:
 
         try:
             # 生成PDF
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(None, self._generate_pdf_sync, content, config, temp_path)
+            if sharded:
+                await self._run_sharded_render(content, config, temp_path, cancel_token)
+            else:
+                await self._run_render(content, config, temp_path, cancel_token)
 
             # 读取PDF并转换为base64
             with open(temp_path, 'rb') as f:
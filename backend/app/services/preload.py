@@ -0,0 +1,53 @@
+"""
+多进程部署的预加载
+创建子进程前一次性完成重型初始化：导入ReportLab和matplotlib、注册字体、查找标签图片素材、
+建立matplotlib字体缓存并初始化公式解析器。子进程fork后以写时复制方式共享这部分内存，
+进程之间通过磁盘上的公式缓存和章节片段缓存共享渲染结果。
+
+两处使用：
+- gunicorn主进程（preload_app）在fork出各API工作进程前调用 preload()
+- 渲染进程和公式渲染进程由forkserver启动（默认），forkserver导入 PRELOAD_MODULE 后再fork出各进程
+"""
+
+import gc
+import multiprocessing
+import time
+
+from app.core.config import settings
+
+# forkserver启动时导入的模块，导入即执行 preload()
+PRELOAD_MODULE = "app.services.preloaded"
+
+_preloaded = False
+
+
+def preload():
+    """完成可在进程间共享的初始化，同一进程内重复调用不会重复执行"""
+    global _preloaded
+    if _preloaded:
+        return
+    started = time.perf_counter()
+
+    from .pdf_service import PDFService, _find_label_image
+    from .math_service import math_service
+
+    PDFService()
+    _find_label_image("answer_label")
+    _find_label_image("key_point_label")
+    math_service.warmup()
+
+    # 把预加载的对象移出垃圾回收的扫描范围，子进程回收垃圾时不再改写这些对象所在的内存页
+    gc.collect()
+    gc.freeze()
+    _preloaded = True
+    print(f"预加载完成，耗时 {time.perf_counter() - started:.2f}s")
+
+
+def worker_context():
+    """渲染进程和公式渲染进程使用的多进程上下文，不支持forkserver的平台退回spawn"""
+    if (settings.WORKER_START_METHOD == "forkserver"
+            and "forkserver" in multiprocessing.get_all_start_methods()):
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([PRELOAD_MODULE])
+        return context
+    return multiprocessing.get_context("spawn")
@@ -0,0 +1,7 @@
+"""
+forkserver的预加载模块：导入时完成预加载，由此fork出的渲染进程共享已初始化的内存
+"""
+
+from .preload import preload
+
+preload()
@@ -0,0 +1,90 @@
+"""
+渲染成本估算
+在渲染前快速扫描文档，统计块、公式、图片等数量并估算渲染耗时，
+供渲染进程池进行短任务优先调度
+"""
+
+import re
+from typing import Any, Dict
+
+# 公式：块级 $$...$$ 或行内 $...$
+_FORMULA_PATTERN = re.compile(r'\$\$[^$]+?\$\$|\$[^$\n]+?\$')
+# 图片：Markdown ![alt](src) 或 HTML <img src="...">
+_IMAGE_PATTERN = re.compile(r'!\[[^\]]*\]\(([^)\s]*)[^)]*\)|<img\s+[^>]*src=["\']([^"\']+)["\']')
+# 会开始一个新块的行首标记
+_BLOCK_START_PATTERN = re.compile(r'#{1,3} |\d+\.\s|/|!\[|<img\s')
+
+# 各类元素的估算耗时(秒)，根据实际渲染的粗略测量得到
+BASE_COST = 0.05
+COST_PER_KILOCHAR = 0.02
+COST_PER_BLOCK = 0.002
+COST_PER_FORMULA = 0.03
+COST_PER_IMAGE = 0.01
+COST_PER_REMOTE_IMAGE = 0.2
+COST_PER_ANSWER_BOX = 0.005
+
+
+class RenderCostEstimate:
+    """渲染成本估算结果"""
+
+    def __init__(self, characters: int = 0, blocks: int = 0, formulas: int = 0,
+                 images: int = 0, remote_images: int = 0, answer_boxes: int = 0):
+        self.characters = characters
+        self.blocks = blocks
+        self.formulas = formulas
+        self.images = images
+        self.remote_images = remote_images
+        self.answer_boxes = answer_boxes
+
+    @property
+    def seconds(self) -> float:
+        """估算的渲染耗时(秒)"""
+        return (
+            BASE_COST
+            + self.characters / 1000 * COST_PER_KILOCHAR
+            + self.blocks * COST_PER_BLOCK
+            + self.formulas * COST_PER_FORMULA
+            + self.images * COST_PER_IMAGE
+            + self.remote_images * COST_PER_REMOTE_IMAGE
+            + self.answer_boxes * COST_PER_ANSWER_BOX
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "characters": self.characters,
+            "blocks": self.blocks,
+            "formulas": self.formulas,
+            "images": self.images,
+            "remote_images": self.remote_images,
+            "answer_boxes": self.answer_boxes,
+            "estimated_seconds": round(self.seconds, 3)
+        }
+
+
+def estimate_render_cost(content: str) -> RenderCostEstimate:
+    """快速扫描文档，估算渲染成本"""
+    estimate = RenderCostEstimate(characters=len(content))
+
+    # 统计块数量：空行之后的首个非空行，或带有块标记的行
+    previous_blank = True
+    for line in content.split('\n'):
+        stripped = line.strip()
+        if not stripped:
+            previous_blank = True
+            continue
+        if previous_blank or _BLOCK_START_PATTERN.match(stripped):
+            estimate.blocks += 1
+        if stripped.startswith('/'):
+            estimate.answer_boxes += 1
+        previous_blank = False
+
+    estimate.formulas = len(_FORMULA_PATTERN.findall(content))
+
+    for markdown_src, html_src in _IMAGE_PATTERN.findall(content):
+        src = markdown_src or html_src
+        if src.startswith(('http://', 'https://')):
+            estimate.remote_images += 1
+        else:
+            estimate.images += 1
+
+    return estimate
@@ -0,0 +1,467 @@
+"""
+PDF渲染进程池
+在独立进程中执行渲染，由看门狗强制执行单次任务的时间和内存上限，
+并在处理一定数量的任务或内存增长后回收渲染进程。
+任务按估算成本短任务优先调度，超大文档进入单独的批处理通道。
+"""
+
+import asyncio
+import gc
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from .render_cost import estimate_render_cost
+from .preload import worker_context
+from .render_service import CancelToken, RenderCancelledError, RenderLimitError
+
+# 调度通道
+LANE_INTERACTIVE = 'interactive'
+LANE_BATCH = 'batch'
+
+
+def _process_rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """读取进程的常驻内存(MB)，不支持的平台返回None"""
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _render_worker_main(conn, cancel_event, max_jobs: int, recycle_rss_mb: float):
+    """渲染进程主循环：逐个接收任务并渲染，达到回收条件后退出"""
+    # 在子进程中导入，避免与pdf_service循环导入
+    from .pdf_service import PDFService
+    import matplotlib.pyplot as plt
+
+    pdf_service = PDFService()
+    jobs_done = 0
+
+    if settings.WARMUP_ENABLED:
+        # 先完整排版一份小文档，首个任务不再承担字体解析、素材加载和公式渲染的初始化
+        from .warmup import warm_render
+        try:
+            warm_render(pdf_service)
+        except Exception as e:
+            print(f"渲染进程预热失败: {e}")
+        plt.close('all')
+        gc.collect()
+
+    # 通知父进程初始化完成，之后才开始计算任务耗时
+    conn.send(('ready', None, False))
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if job is None:
+            break
+
+        # 取消标记由监督线程在发送任务前清除，任务送达前到达的取消不会丢失
+        content, config, output_path, options = job
+        cancel_token = CancelToken(cancel_event)
+
+        try:
+            pdf_service._generate_pdf_sync(content, config, output_path, cancel_token, **options)
+            status, detail = 'ok', None
+        except RenderCancelledError as e:
+            status, detail = 'cancelled', str(e)
+        except Exception as e:
+            status, detail = 'error', str(e)
+        finally:
+            # 清理matplotlib图形状态，避免在长期运行的进程中累积
+            plt.close('all')
+            gc.collect()
+
+        jobs_done += 1
+        rss = _process_rss_mb()
+        recycle = jobs_done >= max_jobs or (rss is not None and rss > recycle_rss_mb)
+
+        try:
+            conn.send((status, detail, recycle))
+        except (BrokenPipeError, OSError):
+            break
+        if recycle:
+            break
+
+    conn.close()
+
+
+class RenderJob:
+    """渲染任务"""
+
+    def __init__(self, content: str, config, output_path: str, cancel_token: CancelToken,
+                 cost: float = 0.0, lane: str = LANE_INTERACTIVE, options: Optional[Dict[str, Any]] = None):
+        self.content = content
+        self.config = config
+        self.output_path = output_path
+        self.cancel_token = cancel_token
+        self.options = options or {}
+        self.cost = cost
+        self.lane = lane
+        self.future: Future = Future()
+        self.submitted_at = time.monotonic()
+
+
+class RenderScheduler:
+    """渲染任务调度队列
+
+    每个通道内按估算成本短任务优先（SJF）出队，
+    等待时间会按 aging_rate 抵扣成本，避免大任务被无限推迟。
+    """
+
+    def __init__(self, aging_rate: float = 1.0):
+        self.aging_rate = aging_rate
+        self._cond = threading.Condition()
+        self._lanes: Dict[str, List[RenderJob]] = {LANE_INTERACTIVE: [], LANE_BATCH: []}
+        self._closed = False
+
+    def put(self, job: RenderJob):
+        with self._cond:
+            self._lanes[job.lane].append(job)
+            self._cond.notify_all()
+
+    def get(self, lanes: Tuple[str, ...]) -> Optional[RenderJob]:
+        """按通道优先级取出下一个任务，队列关闭时返回None"""
+        with self._cond:
+            while not self._closed:
+                for lane in lanes:
+                    jobs = self._lanes[lane]
+                    if jobs:
+                        now = time.monotonic()
+                        job = min(jobs, key=lambda j: j.cost - (now - j.submitted_at) * self.aging_rate)
+                        jobs.remove(job)
+                        return job
+                self._cond.wait()
+            return None
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def sizes(self) -> Dict[str, int]:
+        with self._cond:
+            return {lane: len(jobs) for lane, jobs in self._lanes.items()}
+
+
+class RenderWorker:
+    """渲染进程句柄"""
+
+    def __init__(self, context, max_jobs: int, recycle_rss_mb: float):
+        self.conn, child_conn = context.Pipe()
+        self.cancel_event = context.Event()
+        self.process = context.Process(
+            target=_render_worker_main,
+            args=(child_conn, self.cancel_event, max_jobs, recycle_rss_mb),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.jobs_done = 0
+
+    def wait_ready(self, timeout: float) -> bool:
+        """等待渲染进程完成初始化"""
+        try:
+            if self.conn.poll(timeout):
+                status, _, _ = self.conn.recv()
+                return status == 'ready'
+        except (EOFError, OSError):
+            pass
+        return False
+
+    def rss_mb(self) -> Optional[float]:
+        return _process_rss_mb(self.process.pid)
+
+    def stop(self, timeout: float = 2.0):
+        """通知渲染进程退出，超时则强制终止"""
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.kill()
+        self.conn.close()
+
+    def kill(self):
+        """强制终止渲染进程"""
+        self.process.kill()
+        self.process.join()
+
+
+class RenderWorkerPool:
+    """渲染进程池
+
+    每个进程槽位由一个监督线程负责：取出任务、发送给渲染进程，
+    并作为看门狗轮询任务耗时、进程内存和取消状态。
+    """
+
+    def __init__(
+        self,
+        size: int,
+        job_timeout: float,
+        job_max_rss_mb: float,
+        max_jobs_per_worker: int,
+        recycle_rss_mb: float,
+        cancel_grace: float = 2.0,
+        poll_interval: float = 0.1,
+        startup_timeout: float = 60.0,
+        batch_workers: int = 0,
+        batch_cost_threshold: float = float('inf'),
+        aging_rate: float = 1.0
+    ):
+        self.size = size
+        self.job_timeout = job_timeout
+        self.job_max_rss_mb = job_max_rss_mb
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.recycle_rss_mb = recycle_rss_mb
+        self.cancel_grace = cancel_grace
+        self.poll_interval = poll_interval
+        self.startup_timeout = startup_timeout
+        # 至少保留一个只处理交互任务的进程
+        self.batch_workers = max(0, min(batch_workers, size - 1))
+        self.batch_cost_threshold = batch_cost_threshold
+
+        self._context = worker_context()
+        self._scheduler = RenderScheduler(aging_rate)
+        self._workers: List[Optional[RenderWorker]] = [None] * size
+        self._threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+        self._prestart = False
+        self._slots_started = [threading.Event() for _ in range(size)]
+        self._stats = {"completed": 0, "failed": 0, "cancelled": 0, "killed": 0, "recycled": 0}
+        # 多个监督线程同时更新统计数据
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "RenderWorkerPool":
+        return cls(
+            size=settings.RENDER_WORKERS,
+            job_timeout=settings.RENDER_JOB_TIMEOUT,
+            job_max_rss_mb=settings.RENDER_JOB_MAX_RSS_MB,
+            max_jobs_per_worker=settings.RENDER_WORKER_MAX_JOBS,
+            recycle_rss_mb=settings.RENDER_WORKER_RECYCLE_RSS_MB,
+            cancel_grace=settings.RENDER_CANCEL_GRACE,
+            batch_workers=settings.RENDER_BATCH_WORKERS,
+            batch_cost_threshold=settings.RENDER_BATCH_COST_THRESHOLD,
+            aging_rate=settings.RENDER_QUEUE_AGING_RATE
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def start(self):
+        """启动监督线程（渲染进程在首次使用时创建）"""
+        with self._start_lock:
+            if self._threads:
+                return
+            for slot in range(self.size):
+                thread = threading.Thread(target=self._supervise, args=(slot,),
+                                          name=f"render-supervisor-{slot}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    async def warmup(self):
+        """启动监督线程并预先创建全部渲染进程，等待各进程完成预热"""
+        if not self.enabled:
+            return
+        self._prestart = True
+        self.start()
+        loop = asyncio.get_event_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(None, event.wait) for event in self._slots_started
+        ])
+
+    def shutdown(self):
+        """停止所有监督线程和渲染进程"""
+        self._scheduler.close()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def lane_for(self, cost: float) -> str:
+        """根据估算成本选择调度通道"""
+        if self.batch_workers and cost >= self.batch_cost_threshold:
+            return LANE_BATCH
+        return LANE_INTERACTIVE
+
+    def _slot_lanes(self, slot: int) -> Tuple[str, ...]:
+        """槽位可处理的通道（按优先级排序），最后batch_workers个槽位为批处理槽位"""
+        if slot >= self.size - self.batch_workers:
+            return (LANE_BATCH, LANE_INTERACTIVE)
+        return (LANE_INTERACTIVE,)
+
+    async def render(self, content: str, config, output_path: str,
+                     cancel_token: Optional[CancelToken] = None, cost: Optional[float] = None,
+                     **options):
+        """提交渲染任务并等待完成，未提供成本时自动估算
+
+        options 会作为关键字参数传给 PDFService._generate_pdf_sync
+        """
+        self.start()
+        if cost is None:
+            cost = estimate_render_cost(content).seconds
+        job = RenderJob(content, config, output_path, cancel_token or CancelToken(),
+                        cost=cost, lane=self.lane_for(cost), options=options)
+        self._scheduler.put(job)
+        try:
+            await asyncio.wrap_future(job.future)
+        except asyncio.CancelledError:
+            job.cancel_token.cancel("渲染协程已被取消")
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        """进程池运行状态"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        workers = []
+        for worker in self._workers:
+            if worker is not None and worker.process.is_alive():
+                workers.append({
+                    "pid": worker.process.pid,
+                    "jobs_done": worker.jobs_done,
+                    "rss_mb": worker.rss_mb()
+                })
+        return {
+            "size": self.size,
+            "batch_workers": self.batch_workers,
+            "queued": self._scheduler.sizes(),
+            "workers": workers,
+            **stats
+        }
+
+    def _supervise(self, slot: int):
+        """槽位监督循环"""
+        lanes = self._slot_lanes(slot)
+        if self._prestart:
+            # 在监督线程中创建进程，不会与该槽位的任务同时创建
+            try:
+                self._get_worker(slot)
+            except Exception as e:
+                print(f"渲染进程预启动失败: {e}")
+        self._slots_started[slot].set()
+
+        while True:
+            job = self._scheduler.get(lanes)
+            if job is None:
+                break
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            if job.cancel_token.cancelled:
+                self._finish(job, RenderCancelledError(job.cancel_token.reason or "渲染已取消"))
+                continue
+
+            try:
+                self._run_job(slot, job)
+            except Exception as e:
+                self._discard_worker(slot, kill=True)
+                self._finish(job, e)
+
+        worker = self._workers[slot]
+        if worker is not None:
+            worker.stop()
+            self._workers[slot] = None
+
+    def _get_worker(self, slot: int) -> RenderWorker:
+        worker = self._workers[slot]
+        if worker is None or not worker.process.is_alive():
+            worker = RenderWorker(self._context, self.max_jobs_per_worker, self.recycle_rss_mb)
+            if not worker.wait_ready(self.startup_timeout):
+                worker.kill()
+                raise RuntimeError("渲染进程启动失败")
+            self._workers[slot] = worker
+        return worker
+
+    def _discard_worker(self, slot: int, kill: bool = False):
+        worker = self._workers[slot]
+        self._workers[slot] = None
+        if worker is None:
+            return
+        if kill:
+            worker.kill()
+            self._count("killed")
+        else:
+            worker.process.join(timeout=5)
+            self._count("recycled")
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _finish(self, job: RenderJob, error: Optional[BaseException] = None):
+        if error is None:
+            self._count("completed")
+            job.future.set_result(None)
+        else:
+            key = "cancelled" if isinstance(error, RenderCancelledError) else "failed"
+            self._count(key)
+            job.future.set_exception(error)
+
+    def _run_job(self, slot: int, job: RenderJob):
+        """在渲染进程中执行任务，同时充当看门狗"""
+        worker = self._get_worker(slot)
+        worker.cancel_event.clear()
+        worker.conn.send((job.content, job.config, job.output_path, job.options))
+        started = time.monotonic()
+        cancel_sent_at = None
+
+        while True:
+            if worker.conn.poll(self.poll_interval):
+                try:
+                    status, detail, recycle = worker.conn.recv()
+                except EOFError:
+                    self._discard_worker(slot, kill=True)
+                    self._finish(job, RuntimeError("渲染进程异常退出"))
+                    return
+
+                worker.jobs_done += 1
+                if recycle:
+                    self._discard_worker(slot)
+
+                if status == 'ok':
+                    self._finish(job)
+                elif status == 'cancelled':
+                    self._finish(job, RenderCancelledError(detail))
+                else:
+                    self._finish(job, RuntimeError(detail))
+                return
+
+            if not worker.process.is_alive():
+                self._discard_worker(slot, kill=True)
+                self._finish(job, RuntimeError(f"渲染进程异常退出(exitcode={worker.process.exitcode})"))
+                return
+
+            now = time.monotonic()
+            if now - started > self.job_timeout:
+                self._discard_worker(slot, kill=True)
+                self._finish(job, RenderLimitError(f"渲染超时（超过{self.job_timeout:g}秒）"))
+                return
+
+            rss = worker.rss_mb()
+            if rss is not None and rss > self.job_max_rss_mb:
+                self._discard_worker(slot, kill=True)
+                self._finish(job, RenderLimitError(f"渲染内存超限（{rss:.0f}MB > {self.job_max_rss_mb:g}MB）"))
+                return
+
+            if job.cancel_token.cancelled:
+                if cancel_sent_at is None:
+                    # 先请求协作式取消
+                    worker.cancel_event.set()
+                    cancel_sent_at = now
+                elif now - cancel_sent_at > self.cancel_grace:
+                    # 超过宽限时间仍未停止，直接终止渲染进程
+                    self._discard_worker(slot, kill=True)
+                    self._finish(job, RenderCancelledError(job.cancel_token.reason or "渲染已取消"))
+                    return
+
+
+# 全局实例（渲染进程在首次提交任务时才会创建）
+render_pool = RenderWorkerPool.from_settings()
@@ -0,0 +1,122 @@
+"""
+PDF渲染任务控制服务
+负责渲染任务的登记、取消，以及客户端断开连接的检测
+"""
+
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+
+class RenderCancelledError(Exception):
+    """渲染任务已被取消"""
+
+
+class RenderLimitError(Exception):
+    """渲染任务超出时间或内存限制，渲染进程已被终止"""
+
+
+class CancelToken:
+    """协作式取消令牌
+
+    渲染线程在构建故事和排版每个元素之间检查该令牌，
+    一旦被取消就抛出 RenderCancelledError 终止渲染。
+    渲染进程中传入 multiprocessing.Event 即可跨进程取消。
+    """
+
+    def __init__(self, event=None):
+        self._event = event if event is not None else threading.Event()
+        self.reason: Optional[str] = None
+
+    def cancel(self, reason: str = "渲染已取消"):
+        """取消渲染"""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """是否已被取消"""
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        """如果已被取消则抛出异常"""
+        if self._event.is_set():
+            raise RenderCancelledError(self.reason or "渲染已取消")
+
+
+class RenderService:
+    """渲染任务控制服务类"""
+
+    def __init__(self, disconnect_poll_interval: float = 0.25):
+        self.disconnect_poll_interval = disconnect_poll_interval
+        self._active: Dict[str, CancelToken] = {}
+        self._lock = threading.Lock()
+
+    def begin(self, render_id: Optional[str] = None) -> CancelToken:
+        """登记一个渲染任务，同一render_id下仍在进行的旧任务会被取消"""
+        token = CancelToken()
+        if render_id:
+            with self._lock:
+                previous = self._active.get(render_id)
+                self._active[render_id] = token
+            if previous is not None:
+                previous.cancel("已被新的渲染请求取代")
+        return token
+
+    def finish(self, render_id: Optional[str], token: CancelToken):
+        """注销渲染任务（只注销仍属于该令牌的登记）"""
+        if not render_id:
+            return
+        with self._lock:
+            if self._active.get(render_id) is token:
+                del self._active[render_id]
+
+    def cancel(self, render_id: str) -> bool:
+        """显式取消渲染任务，返回是否找到正在进行的任务"""
+        with self._lock:
+            token = self._active.pop(render_id, None)
+        if token is None:
+            return False
+        token.cancel("客户端取消了渲染")
+        return True
+
+    def active_count(self) -> int:
+        """正在进行的已登记渲染任务数量"""
+        with self._lock:
+            return len(self._active)
+
+    async def watch_disconnect(self, http_request, token: CancelToken):
+        """轮询客户端连接状态，断开时取消渲染"""
+        while not token.cancelled:
+            if await http_request.is_disconnected():
+                token.cancel("客户端已断开连接")
+                return
+            await asyncio.sleep(self.disconnect_poll_interval)
+
+    @asynccontextmanager
+    async def track(self, render_id: Optional[str] = None, http_request=None):
+        """登记渲染任务并在客户端断开时自动取消
+
+        用法：
+            async with render_service.track(render_id, http_request) as token:
+                await pdf_service.generate_pdf_preview(..., cancel_token=token)
+        """
+        token = self.begin(render_id)
+        watcher = None
+        if http_request is not None:
+            watcher = asyncio.create_task(self.watch_disconnect(http_request, token))
+        try:
+            yield token
+        except asyncio.CancelledError:
+            token.cancel("请求已被取消")
+            raise
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            self.finish(render_id, token)
+
+
+# 全局实例
+render_service = RenderService()
@@ -0,0 +1,307 @@
+"""
+简单算式的快速排版
+练习册中的公式大多是 6 \\times 7 = 42、\\frac{3}{4} 这样的四则运算和分数，
+这类公式直接用与matplotlib公式渲染器相同的Computer Modern字体排出文字、用矩形画出分数线，
+不经过matplotlib解析和转换轮廓，
+只有上下标、根号等真正复杂的公式才交给完整的公式渲染器
+"""
+
+import hashlib
+import importlib.util
+import io
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+from app.core.config import settings
+
+# 公式字体：与完整公式渲染器（mathtext的cm字体）使用同一套Computer Modern字体，
+# 同一文档中的简单算式和复杂公式字形、基线一致。优先使用字体目录中的文件，否则使用matplotlib自带的字体
+MATH_FONT = 'MathRoman'  # cmr10：数字、+、=、括号
+MATH_FONT_ITALIC = 'MathItalic'  # cmmi10：变量、<、>、逗号、小数点
+MATH_FONT_SYMBOL = 'MathSymbol'  # cmsy10：减号、×、÷ 等运算符
+_FONT_FILES = {MATH_FONT: 'cmr10.ttf', MATH_FONT_ITALIC: 'cmmi10.ttf', MATH_FONT_SYMBOL: 'cmsy10.ttf'}
+
+# 公式四周的留白(pt)，与矢量公式一致
+TEXT_FORMULA_PADDING = 0.02 * 72
+
+# 以下尺寸均以字号为单位
+_DIGIT_HEIGHT = 0.66  # 数字和大写字母的高度
+_DESCENT = 0.25  # 带下伸部分的字符（括号、g、y 等）的深度
+# 运算符、关系符两侧和标点之后的间距，与mathtext相同，以斜体 m 的宽度为单位
+_OPERATOR_SPACE = 0.2
+_FRACTION_SCALE = 0.7  # 行内分数的分子分母缩小比例
+# 分数的位置按mathtext的排版结果取值，与复杂公式中的分数一致
+_FRACTION_RULE = 0.0625  # 分数线粗细
+_FRACTION_AXIS = 0.156  # 分数线中心距基线的高度
+_FRACTION_NUMERATOR_GAP = 0.2  # 分子底部与分数线的间距
+_FRACTION_DENOMINATOR_GAP = 0.08  # 分母顶部与分数线的间距
+_FRACTION_SPACE = 2 * _FRACTION_RULE  # 分数之后的间距
+
+# 命令和符号对应的字符、字体和类别。字符是字形在该字体中的编码，与mathtext的cm字体映射一致；
+# \neq 在mathtext中使用STIX字体，不在此列，交给完整的公式渲染器
+_COMMANDS = {
+    r'\times': ('\xa3', MATH_FONT_SYMBOL, 'bin'), r'\div': ('\xa5', MATH_FONT_SYMBOL, 'bin'),
+    r'\pm': ('\xa7', MATH_FONT_SYMBOL, 'bin'), r'\cdot': ('\xa2', MATH_FONT_SYMBOL, 'bin'),
+    r'\leq': ('\u2219', MATH_FONT_SYMBOL, 'rel'), r'\geq': ('\xb8', MATH_FONT_SYMBOL, 'rel'),
+    r'\approx': ('\xbc', MATH_FONT_SYMBOL, 'rel')
+}
+_SYMBOLS = {
+    '+': ('+', MATH_FONT, 'bin'), '-': ('\xa1', MATH_FONT_SYMBOL, 'bin'), '=': ('=', MATH_FONT, 'rel'),
+    '<': ('<', MATH_FONT_ITALIC, 'rel'), '>': ('>', MATH_FONT_ITALIC, 'rel'),
+    '(': ('(', MATH_FONT, 'open'), ')': (')', MATH_FONT, 'close'),
+    ',': (';', MATH_FONT_ITALIC, 'punct'), '.': (':', MATH_FONT_ITALIC, 'punct')
+}
+# 带下伸部分的字形（括号、逗号和下伸的字母）
+_DESCENDERS = set('();gjpqy')
+_FRACTIONS = {r'\frac': None, r'\dfrac': 1.0, r'\tfrac': _FRACTION_SCALE}
+
+_TOKEN_PATTERN = re.compile(r'\s+|\\[a-zA-Z]+|[0-9]+(?:\.[0-9]+)?|[a-zA-Z]|[{}]|[+\-=<>(),.]|.', re.S)
+
+
+class TextFormula:
+    """用文字和矩形排出的公式，坐标单位为pt，原点在左下角，接口与 VectorFormula 一致
+
+    runs 是 [(文字, 字体名, 字号, x, 基线y)]，rects 是 [(x, y, 宽, 高)]
+    """
+
+    def __init__(self, key: str, width: float, height: float, descent: float,
+                 runs: List[tuple], rects: List[tuple]):
+        self.key = key
+        self.width = width
+        self.height = height
+        self.descent = descent
+        self.runs = runs
+        self.rects = rects
+
+    def __deepcopy__(self, memo):
+        # 内容不可变，段落拆分复制文本片段时直接共用
+        return self
+
+
+def _font_path(filename: str) -> Optional[str]:
+    path = os.path.join(settings.FONT_DIR, filename)
+    if os.path.exists(path):
+        return path
+    # 只定位matplotlib的安装目录，不导入matplotlib
+    spec = importlib.util.find_spec('matplotlib')
+    if spec is None or not spec.origin:
+        return None
+    path = os.path.join(os.path.dirname(spec.origin), 'mpl-data', 'fonts', 'ttf', filename)
+    return path if os.path.exists(path) else None
+
+
+_font_lock = threading.Lock()
+_font_paths: Optional[dict] = None
+
+
+def _math_fonts() -> Optional[dict]:
+    """注册公式字体，返回 {字体名: 字体文件路径}，找不到字体时返回None（不使用快速排版）"""
+    global _font_paths
+    if _font_paths is None:
+        with _font_lock:
+            if _font_paths is None:
+                paths = {name: _font_path(filename) for name, filename in _FONT_FILES.items()}
+                if all(paths.values()):
+                    registered = pdfmetrics.getRegisteredFontNames()
+                    for name, path in paths.items():
+                        if name not in registered:
+                            pdfmetrics.registerFont(TTFont(name, path))
+                else:
+                    print("未找到公式字体，简单算式也使用完整的公式渲染器")
+                    paths = {}
+                _font_paths = paths
+    return _font_paths or None
+
+
+def _read_group(tokens: List[str], index: int) -> Tuple[Optional[List[str]], int]:
+    """读取 {...} 中的记号，不支持嵌套的花括号"""
+    while index < len(tokens) and tokens[index].isspace():
+        index += 1
+    if index >= len(tokens) or tokens[index] != '{':
+        return None, index
+    end = index + 1
+    while end < len(tokens) and tokens[end] not in '{}':
+        end += 1
+    if end >= len(tokens) or tokens[end] != '}':
+        return None, index
+    return tokens[index + 1:end], end + 1
+
+
+def _parse(tokens: List[str], allow_fraction: bool = True) -> Optional[List[tuple]]:
+    """把记号解析为 [(类别, 文字, 字体)] 和 ('frac', 分子, 分母, 缩小比例)，含不支持的写法时返回None"""
+    items = []
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        index += 1
+        if token.isspace():
+            continue
+        if token in _FRACTIONS:
+            if not allow_fraction:
+                return None
+            numerator, index = _read_group(tokens, index)
+            denominator, index = _read_group(tokens, index) if numerator is not None else (None, index)
+            if numerator is None or denominator is None:
+                return None
+            numerator, denominator = _parse(numerator, False), _parse(denominator, False)
+            if not numerator or not denominator:
+                return None
+            items.append(('frac', numerator, denominator, _FRACTIONS[token]))
+        elif token in _COMMANDS:
+            text, font, kind = _COMMANDS[token]
+            items.append((kind, text, font))
+        elif token in _SYMBOLS:
+            text, font, kind = _SYMBOLS[token]
+            items.append((kind, text, font))
+        elif token[0] in '0123456789':
+            items.append(('num', token, MATH_FONT))
+        elif token.isascii() and token.isalpha():
+            items.append(('var', token, MATH_FONT_ITALIC))
+        else:
+            return None
+    return items
+
+
+@lru_cache(maxsize=4096)
+def _parse_formula(formula: str) -> Optional[Tuple[tuple, ...]]:
+    formula = formula.strip()
+    if formula.startswith('$') or not formula:
+        return None
+    items = _parse(_TOKEN_PATTERN.findall(formula))
+    return tuple(items) if items else None
+
+
+def is_simple_formula(formula: str) -> bool:
+    """是否为可以快速排版的简单算式"""
+    return _parse_formula(formula) is not None and _math_fonts() is not None
+
+
+def _layout_row(items, size: float, fraction_scale: float, runs: List[tuple], rects: List[tuple],
+                x: float, y: float) -> Tuple[float, float, float]:
+    """从 (x, y) 起横向排列一行，返回 (宽度, 基线以上高度, 基线以下深度)"""
+    start = x
+    height = depth = 0.0
+    previous = None
+    operator_space = _OPERATOR_SPACE * pdfmetrics.stringWidth('m', MATH_FONT_ITALIC, size)
+    for item in items:
+        kind = item[0]
+        if kind == 'bin':
+            # 与mathtext一致：行首和左括号之后的正负号是一元运算符，两侧不留空
+            space = 0 if previous in (None, 'open') else operator_space
+        elif kind == 'rel':
+            space = operator_space
+        else:
+            space = 0
+
+        x += space
+        if kind == 'frac':
+            scale = item[3] or fraction_scale
+            width, top, bottom = _layout_fraction(item[1], item[2], size, scale, runs, rects, x, y)
+        else:
+            text, font = item[1], item[2]
+            runs.append((text, font, size, round(x, 3), round(y, 3)))
+            width = pdfmetrics.stringWidth(text, font, size)
+            top = _DIGIT_HEIGHT * size
+            bottom = _DESCENT * size if _DESCENDERS.intersection(text) else 0
+        x += width + space
+        if kind == 'punct':
+            x += operator_space
+        elif kind == 'frac':
+            x += _FRACTION_SPACE * size
+        height = max(height, top)
+        depth = max(depth, bottom)
+        previous = kind
+    return x - start, height, depth
+
+
+def _layout_fraction(numerator, denominator, size: float, scale: float, runs: List[tuple], rects: List[tuple],
+                     x: float, y: float) -> Tuple[float, float, float]:
+    """排列分数，返回 (宽度, 基线以上高度, 基线以下深度)"""
+    part_size = size * scale
+    # 先在原点试排得到分子分母的尺寸，再按居中后的位置重新排列
+    numerator_width, numerator_height, numerator_depth = _layout_row(numerator, part_size, scale, [], [], 0, 0)
+    denominator_width, denominator_height, denominator_depth = _layout_row(denominator, part_size, scale, [], [], 0, 0)
+
+    width = max(numerator_width, denominator_width)
+    rule = _FRACTION_RULE * size
+    axis = _FRACTION_AXIS * size
+    numerator_y = axis + rule / 2 + _FRACTION_NUMERATOR_GAP * size + numerator_depth
+    denominator_y = axis - rule / 2 - _FRACTION_DENOMINATOR_GAP * size - denominator_height
+    _layout_row(numerator, part_size, scale, runs, rects, x + (width - numerator_width) / 2, y + numerator_y)
+    _layout_row(denominator, part_size, scale, runs, rects, x + (width - denominator_width) / 2, y + denominator_y)
+    rects.append((round(x, 3), round(y + axis - rule / 2, 3), round(width, 3), round(rule, 3)))
+
+    return width, numerator_y + numerator_height, -(denominator_y - denominator_depth)
+
+
+@lru_cache(maxsize=4096)
+def text_formula(formula: str, font_size: float, display: bool = False) -> Optional[TextFormula]:
+    """
+    快速排版简单算式
+
+    Args:
+        formula: LaTeX公式字符串
+        font_size: 公式字号(pt)
+        display: 是否为块级公式（块级公式中的分数不缩小）
+
+    Returns:
+        TextFormula，不是简单算式或没有公式字体时返回None
+    """
+    items = _parse_formula(formula)
+    if items is None or _math_fonts() is None:
+        return None
+
+    runs = []
+    rects = []
+    padding = TEXT_FORMULA_PADDING
+    fraction_scale = 1.0 if display else _FRACTION_SCALE
+    width, height, depth = _layout_row(items, font_size, fraction_scale, runs, rects, 0, 0)
+
+    # 基线上移到留白和深度之上，与 VectorFormula 的坐标系一致
+    offset = padding + depth
+    return TextFormula(
+        hashlib.sha1(f"text\0{font_size!r}\0{display}\0{formula}".encode('utf-8')).hexdigest()[:16],
+        round(width + 2 * padding, 3),
+        round(height + depth + 2 * padding, 3),
+        round(offset, 3),
+        [(text, font, size, round(x + padding, 3), round(y + offset, 3)) for text, font, size, x, y in runs],
+        [(round(x + padding, 3), round(y + offset, 3), w, h) for x, y, w, h in rects]
+    )
+
+
+def render_png(formula: str, font_size: float, dpi: int, display: bool = False) -> Optional[bytes]:
+    """把简单算式绘制为透明背景的黑色PNG，不是简单算式时返回None"""
+    layout = text_formula(formula, font_size, display)
+    if layout is None:
+        return None
+
+    from PIL import Image, ImageDraw
+
+    fonts = _math_fonts()
+    scale = dpi / 72
+    image = Image.new('RGBA', (max(1, round(layout.width * scale)), max(1, round(layout.height * scale))), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+
+    # 图片坐标的y轴向下
+    for text, font, size, x, y in layout.runs:
+        image_font = _image_font(fonts[font], round(size * scale))
+        draw.text((x * scale, (layout.height - y) * scale), text, font=image_font, fill=(0, 0, 0, 255), anchor='ls')
+    for x, y, width, height in layout.rects:
+        top = (layout.height - y - height) * scale
+        draw.rectangle((x * scale, top, (x + width) * scale, top + max(height * scale, 1) - 1), fill=(0, 0, 0, 255))
+
+    buf = io.BytesIO()
+    image.save(buf, format='png', dpi=(dpi, dpi))
+    return buf.getvalue()
+
+
+@lru_cache(maxsize=64)
+def _image_font(path: str, pixel_size: int):
+    from PIL import ImageFont
+    return ImageFont.truetype(path, pixel_size)
@@ -0,0 +1,145 @@
+"""
+文本测量缓存
+段落断行时ReportLab把连续的中文当作一个长词，再逐字调用stringWidth拆分到各行，
+TTF字体逐字查字典求宽度因此成为中文练习册排版的主要开销。
+这里为每个TTF字体建立按码位索引的字宽数组用于测量，并缓存长词的拆分结果。
+
+install() 替换 TTFont.stringWidth 和 reportlab.platypus.paragraph._splitWord，影响整个进程，
+因此不在导入时执行，由 PDFService 初始化时调用。替换的是ReportLab的内部函数，
+已按 VALIDATED_REPORTLAB_VERSION 验证排版结果与原实现一致，升级ReportLab后需要重新验证。
+"""
+
+import threading
+import weakref
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import reportlab
+from reportlab.lib import rl_accel
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import paragraph as rl_paragraph
+
+# 字宽数组覆盖基本多文种平面，其余码位直接查字体表
+_BMP_SIZE = 0x10000
+
+# 验证过的ReportLab版本（与 requirements.txt 一致）
+VALIDATED_REPORTLAB_VERSION = "4.0.7"
+
+
+class GlyphAdvanceCache:
+    """按字体缓存的字宽数组（单位为千分之一字号）"""
+
+    def __init__(self):
+        self._tables = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def table(self, font: TTFont) -> Tuple[List[float], dict, float]:
+        """返回 (按码位索引的字宽数组, 字体字宽表, 默认字宽)
+
+        用列表而不是array存放，取值时直接返回字体表中的数值对象，不必每次重新装箱
+        """
+        table = self._tables.get(font)
+        if table is None:
+            with self._lock:
+                face = font.face
+                advances = [face.defaultWidth] * _BMP_SIZE
+                for code, width in face.charWidths.items():
+                    if code < _BMP_SIZE:
+                        advances[code] = width
+                table = (advances, face.charWidths, face.defaultWidth)
+                self._tables[font] = table
+        return table
+
+    def string_width(self, font: TTFont, text: str, size: float) -> float:
+        """字符串宽度，与ReportLab的TTF宽度计算结果一致"""
+        advances, char_widths, default_width = self.table(font)
+        try:
+            total = sum(map(advances.__getitem__, map(ord, text)))
+        except IndexError:
+            # 含有基本多文种平面以外的字符
+            total = sum(
+                advances[code] if code < _BMP_SIZE else char_widths.get(code, default_width)
+                for code in map(ord, text)
+            )
+        return 0.001 * size * total
+
+    def char_widths(self, text: str, font_name: str, font_size: float) -> Optional[List[float]]:
+        """逐字宽度（与 stringWidth 逐字测量的结果一致），非TTF字体返回None"""
+        font = pdfmetrics.getFont(font_name)
+        if not isinstance(font, TTFont):
+            return None
+        advances, char_widths, default_width = self.table(font)
+        scale = 0.001 * font_size
+        try:
+            return [scale * width for width in map(advances.__getitem__, map(ord, text))]
+        except IndexError:
+            return [
+                scale * (advances[code] if code < _BMP_SIZE else char_widths.get(code, default_width))
+                for code in map(ord, text)
+            ]
+
+
+# 全局实例
+glyph_advances = GlyphAdvanceCache()
+
+_rl_split_word = rl_paragraph._splitWord
+
+
+@lru_cache(maxsize=8192)
+def _split_word_cached(word: str, line_width: float, max_widths: Tuple[float, ...], lineno: int,
+                       font_name: str, font_size: float) -> Optional[tuple]:
+    widths = glyph_advances.char_widths(word, font_name, font_size)
+    if widths is None:
+        return None
+
+    result = []
+    max_lineno = len(max_widths) - 1
+    start = 0
+    max_width = max_widths[min(max_lineno, lineno)]
+    for index, char_width in enumerate(widths):
+        new_line_width = line_width + char_width
+        if new_line_width > max_width:
+            result.append(rl_paragraph._SplitWord(word[start:index]))
+            lineno += 1
+            max_width = max_widths[min(max_lineno, lineno)]
+            new_line_width = char_width
+            start = index
+        line_width = new_line_width
+    result.append(rl_paragraph._SplitWordEnd(word[start:]))
+    return tuple(result)
+
+
+def split_word(w, lineWidth, maxWidths, lineno, fontName, fontSize, encoding='utf8'):
+    """按行宽把长词拆分到多行，替代ReportLab逐字调用stringWidth的实现"""
+    if isinstance(w, bytes):
+        w = w.decode(encoding)
+    result = _split_word_cached(w, lineWidth, tuple(maxWidths), lineno, fontName, fontSize)
+    if result is None:
+        return _rl_split_word(w, lineWidth, maxWidths, lineno, fontName, fontSize, encoding)
+    return list(result)
+
+
+def _ttf_string_width(self, text, size, encoding='utf8'):
+    if not isinstance(text, str):
+        text = text.decode(encoding or 'utf-8')
+    return glyph_advances.string_width(self, text, size)
+
+
+_install_lock = threading.Lock()
+_installed = False
+
+
+def install():
+    """让TTF字体测量和ReportLab段落断行使用缓存的字宽，同一进程内只安装一次"""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        if reportlab.Version != VALIDATED_REPORTLAB_VERSION:
+            print(f"文本测量缓存按ReportLab {VALIDATED_REPORTLAB_VERSION} 验证，当前版本为 {reportlab.Version}")
+        # 安装了rl_accel C扩展时沿用其宽度计算
+        if 'instanceStringWidthTTF' in getattr(rl_accel, '_py_funcs', {}):
+            TTFont.stringWidth = _ttf_string_width
+        rl_paragraph._splitWord = split_word
+        _installed = True
@@ -0,0 +1,113 @@
+"""
+矢量公式
+公式的字形轮廓、位置和尺寸，不依赖matplotlib，PDF排版和SVG输出只需要这个模块
+"""
+
+import json
+from typing import Dict, List
+
+
+class VectorFormula:
+    """矢量公式：由字形轮廓和分数线等矩形组成，坐标单位为pt，原点在左下角
+
+    glyphs 是 {字形键: (外框, 路径指令)}，路径指令为 ('m', x, y)、('l', x, y)、
+    ('c', x1, y1, x2, y2, x3, y3)、('h',)，坐标以字号100为单位；
+    placements 是 [(字形键, x, y, 缩放)]，rects 是 [(x, y, 宽, 高)]，
+    descent 是基线到底边的距离。相同字形在各公式间共用同一份轮廓
+    """
+
+    def __init__(self, key: str, width: float, height: float, descent: float,
+                 placements: List[tuple], rects: List[tuple], glyphs: Dict[str, tuple]):
+        self.key = key
+        self.width = width
+        self.height = height
+        self.descent = descent
+        self.placements = placements
+        self.rects = rects
+        self.glyphs = glyphs
+
+    def __deepcopy__(self, memo):
+        # 内容不可变，段落拆分复制文本片段时直接共用
+        return self
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "key": self.key,
+            "width": self.width,
+            "height": self.height,
+            "descent": self.descent,
+            "placements": self.placements,
+            "rects": self.rects,
+            "glyphs": self.glyphs
+        }, separators=(',', ':'))
+
+    def to_svg(self) -> str:
+        """转换为SVG，尺寸单位为pt，相同字形只定义一次路径"""
+        defs = [f'<path id="g{key}" d="{_svg_path(commands)}"/>' for key, (_, commands) in self.glyphs.items()]
+
+        shapes = [
+            f'<use href="#g{key}" transform="matrix({_svg_number(scale)} 0 0 {_svg_number(scale)} '
+            f'{_svg_number(x)} {_svg_number(y)})"/>'
+            for key, x, y, scale in self.placements
+        ]
+        shapes.extend(
+            f'<rect x="{_svg_number(x)}" y="{_svg_number(y)}" width="{_svg_number(width)}" height="{_svg_number(height)}"/>'
+            for x, y, width, height in self.rects
+        )
+
+        width, height = _svg_number(self.width), _svg_number(self.height)
+        # SVG的y轴向下，翻转为与PDF一致的坐标系
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}pt" height="{height}pt" '
+            f'viewBox="0 0 {width} {height}">'
+            f'<defs>{"".join(defs)}</defs>'
+            f'<g fill="#000" transform="matrix(1 0 0 -1 0 {height})">{"".join(shapes)}</g>'
+            f'</svg>'
+        )
+
+    @classmethod
+    def from_json(cls, data: str) -> "VectorFormula":
+        value = json.loads(data)
+        return cls(
+            value["key"], value["width"], value["height"], value["descent"],
+            [tuple(placement) for placement in value["placements"]],
+            [tuple(rect) for rect in value["rects"]],
+            {key: (tuple(bbox), [tuple(command) for command in commands])
+             for key, (bbox, commands) in value["glyphs"].items()}
+        )
+
+
+def _svg_number(value: float) -> str:
+    text = f"{value:.3f}".rstrip('0').rstrip('.')
+    if text.startswith('0.'):
+        text = text[1:]
+    elif text.startswith('-0.'):
+        text = '-' + text[2:]
+    return '0' if text in ('', '-0') else text
+
+
+def _svg_path(commands: List[tuple]) -> str:
+    """把路径指令编码为紧凑的SVG路径：使用相对坐标，能省略的分隔空格都省略"""
+    parts = []
+    current = start = (0.0, 0.0)
+    for command in commands:
+        op = command[0]
+        if op == 'h':
+            parts.append('z')
+            current = start
+            continue
+
+        parts.append(op)
+        previous = None
+        for index in range(1, len(command), 2):
+            for axis, value in enumerate(command[index:index + 2]):
+                number = _svg_number(round(value - current[axis], 1))
+                # 负号、以及前一个数已有小数点时的小数点都能直接分隔两个数
+                if previous is not None and not (number[0] == '-' or (number[0] == '.' and '.' in previous)):
+                    parts.append(' ')
+                parts.append(number)
+                previous = number
+        current = (command[-2], command[-1])
+        if op == 'm':
+            start = current
+    return ''.join(parts)
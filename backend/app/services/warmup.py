@@ -0,0 +1,194 @@
+"""
+启动预热
+部署后的首个PDF请求需要解析字体文件、建立matplotlib字体缓存、初始化公式解析器并加载图片素材，
+启动时先完成这些工作再对外报告就绪，负载均衡不会把用户请求转发到尚未预热的实例。
+多个API工作进程时，负载均衡的探测只会落到其中一个进程，因此各进程通过标记文件汇总就绪状态。
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from app.core.config import settings
+from .formula_pool import formula_pool
+from .render_pool import render_pool
+
+# 预热文档：覆盖中文字体、标题、答案/解析标签图片、简单算式、矢量公式和块级公式
+WARMUP_DOCUMENT = r"""# 预热
+
+计算 $\frac{1}{2} + 3$ 的值，并化简 $x^2 + \sqrt{y}$。
+
+$$\int_0^1 x^2 \, dx = \frac{1}{3}$$
+
+答案：$\frac{7}{2}$
+
+解析：**略**
+"""
+
+
+def reset_ready_markers():
+    """清空就绪标记目录（gunicorn主进程fork工作进程前调用，清除上次运行遗留的标记）"""
+    shutil.rmtree(settings.READY_MARKER_DIR, ignore_errors=True)
+    os.makedirs(settings.READY_MARKER_DIR, exist_ok=True)
+
+
+def remove_ready_marker(pid: int):
+    """删除已退出的工作进程的就绪标记"""
+    try:
+        os.remove(os.path.join(settings.READY_MARKER_DIR, str(pid)))
+    except OSError:
+        pass
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def ready_worker_count() -> int:
+    """已完成预热且仍在运行的工作进程数"""
+    try:
+        names = os.listdir(settings.READY_MARKER_DIR)
+    except OSError:
+        return 0
+    return sum(1 for name in names if name.isdigit() and _pid_alive(int(name)))
+
+
+def _create_pdf_service():
+    # 在使用时导入，API进程启动时不加载ReportLab
+    from .pdf_service import PDFService
+    return PDFService()
+
+
+def warm_render(pdf_service) -> None:
+    """用预热文档完整排版一次PDF，结果写入临时文件后删除"""
+    from app.models.schemas import LayoutConfig
+
+    fd, output_path = tempfile.mkstemp(prefix="warmup_", suffix=".pdf")
+    os.close(fd)
+    try:
+        pdf_service._generate_pdf_sync(WARMUP_DOCUMENT, LayoutConfig(), output_path)
+    finally:
+        os.remove(output_path)
+
+
+class WarmupService:
+    """启动预热：依次执行各预热步骤，全部结束后标记为就绪
+
+    启动公式渲染进程或PDF渲染进程失败说明实例无法正常渲染，状态为 degraded，/ready 保持503；
+    注册字体和试渲染只是预先填充缓存，失败时首个请求会慢一些，仍然标记为就绪，失败信息保留在状态中
+    """
+
+    def __init__(self):
+        self.state = "pending"
+        self.stage: Optional[str] = None
+        self.stages: List[dict] = []
+        self.elapsed: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        """当前进程是否已完成预热"""
+        return self.state == "ready"
+
+    @property
+    def all_ready(self) -> bool:
+        """当前进程以及其余工作进程是否都已完成预热"""
+        if not self.ready:
+            return False
+        return settings.READY_WORKERS <= 1 or ready_worker_count() >= settings.READY_WORKERS
+
+    def skip(self):
+        """未启用预热时直接标记为就绪"""
+        self._mark_ready()
+
+    def status(self) -> dict:
+        if self.all_ready:
+            state = "ready"
+        elif self.state == "degraded":
+            state = "degraded"
+        else:
+            state = "warming_up"
+        status = {
+            "status": state,
+            "stage": self.stage,
+            "stages": self.stages,
+            "elapsed": self.elapsed
+        }
+        if settings.READY_WORKERS > 1:
+            status["workers"] = {"ready": ready_worker_count(), "expected": settings.READY_WORKERS}
+        return status
+
+    def _mark_ready(self):
+        self.state = "ready"
+        if settings.READY_WORKERS > 1:
+            os.makedirs(settings.READY_MARKER_DIR, exist_ok=True)
+            with open(os.path.join(settings.READY_MARKER_DIR, str(os.getpid())), "w"):
+                pass
+
+    async def run(self):
+        """执行全部预热步骤"""
+        if self.state != "pending":
+            return
+        self.state = "running"
+        started = time.perf_counter()
+
+        # (步骤名称, 步骤, 失败时是否不能对外提供服务)
+        steps: List[tuple] = [
+            ("注册字体", self._register_fonts, False),
+            ("公式渲染进程", formula_pool.warmup, True),
+            ("PDF渲染进程", render_pool.warmup, True),
+            ("试渲染PDF", self._render_sample, False),
+        ]
+        failed = []
+        for name, step, required in steps:
+            ok = await self._run_step(name, step)
+            if required and not ok:
+                failed.append(name)
+
+        self.stage = None
+        self.elapsed = round(time.perf_counter() - started, 3)
+        if failed:
+            self.state = "degraded"
+            print(f"预热失败（{'、'.join(failed)}），/ready 保持503，耗时 {self.elapsed:.2f}s")
+            return
+        self._mark_ready()
+        print(f"预热完成，耗时 {self.elapsed:.2f}s")
+
+    async def _run_step(self, name: str, step: Callable[[], Awaitable[None]]) -> bool:
+        """执行一个预热步骤并记录耗时，返回是否成功"""
+        self.stage = name
+        step_started = time.perf_counter()
+        error = None
+        try:
+            await step()
+        except Exception as e:
+            error = str(e)
+            print(f"预热步骤失败（{name}）: {e}")
+        seconds = round(time.perf_counter() - step_started, 3)
+        self.stages.append({"name": name, "seconds": seconds, "error": error})
+        print(f"预热步骤 {name}: {seconds:.2f}s")
+        return error is None
+
+    async def _register_fonts(self):
+        """导入排版模块并注册中文字体"""
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, _create_pdf_service)
+
+    async def _render_sample(self):
+        """经过公式预渲染和渲染进程池，端到端生成一份预热文档的PDF"""
+        from app.models.schemas import LayoutConfig
+
+        pdf_service = _create_pdf_service()
+        await pdf_service.generate_pdf_preview(WARMUP_DOCUMENT, LayoutConfig())
+
+
+# 全局实例
+warmup_service = WarmupService()
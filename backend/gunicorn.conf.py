@@ -0,0 +1,44 @@
+"""
+多进程部署的gunicorn配置
+主进程先导入应用并完成预加载（字体、图片素材、matplotlib），再fork出各API工作进程，
+工作进程以写时复制方式共享预加载的内存。
+
+每个API工作进程各自拥有 RENDER_WORKERS 个渲染进程和 FORMULA_WORKERS 个公式渲染进程，
+CPU密集的进程总数约为 WEB_CONCURRENCY × (RENDER_WORKERS + FORMULA_WORKERS)，
+按机器核数设置，例如16核：WEB_CONCURRENCY=4、RENDER_WORKERS=3、FORMULA_WORKERS=1
+"""
+
+import os
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# 在主进程中导入应用，工作进程fork后共享
+preload_app = True
+
+# 单次渲染最长 RENDER_JOB_TIMEOUT(120秒)，工作进程超时需大于此值
+timeout = int(os.getenv("WORKER_TIMEOUT", "180"))
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    """主进程启动时完成预加载，之后才fork出工作进程
+
+    /ready 需要全部工作进程完成预热才返回200，这里设置工作进程数并清空上次运行的就绪标记
+    """
+    from app.core.config import settings
+    from app.services.preload import preload
+    from app.services.warmup import reset_ready_markers
+
+    settings.READY_WORKERS = server.num_workers
+    reset_ready_markers()
+    preload()
+
+
+def child_exit(server, worker):
+    """工作进程退出后删除其就绪标记，重启的进程完成预热前 /ready 返回503"""
+    from app.services.warmup import remove_ready_marker
+
+    remove_ready_marker(worker.pid)
@@ -0,0 +1,84 @@
+"""
+行内标记渲染与原有逐条正则替换实现的等价性检查
+"""
+
+import re
+
+import pytest
+
+from app.services.inline_markup import InlineMarkupRenderer
+
+
+def _map_font(font_family: str) -> str:
+    return 'KaiTi' if 'KaiTi' in font_family else 'ChineseFont'
+
+
+def _legacy_inline_markdown(text: str) -> str:
+    """原 _process_inline_markdown：依次替换字体span、（（…））、粗体、斜体、连续空格"""
+    text = re.sub(r'<span style="font-family:\s*([^"]+)">(.*?)</span>',
+                  lambda m: f'<font name="{_map_font(m.group(1))}">{m.group(2)}</font>', text)
+    text = re.sub(r'（（(.*?)））', r'<font color="#FF8C00" name="KaiTi">（\1）</font>', text)
+    text = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', text)
+    text = re.sub(r'__(.*?)__', r'<b>\1</b>', text)
+    text = re.sub(r'\*(.*?)\*', r'<i>\1</i>', text)
+    text = re.sub(r'_(.*?)_', r'<i>\1</i>', text)
+    return re.sub(r'  +', lambda m: '&nbsp;' * len(m.group(0)), text)
+
+
+SAMPLES = [
+    '',
+    '普通文字，没有任何标记',
+    '**粗体**和*斜体*',
+    '__粗体__和_斜体_',
+    # 嵌套
+    '*a **b** c*',
+    '_a __b__ c_',
+    '**a *b* c**',
+    '__a _b_ c__',
+    '*a __b__ c*',
+    '**a _b_ c**',
+    '***粗斜体***',
+    # 交叉、未闭合和连续标记
+    '**a *b** c*',
+    '*a **b* c**',
+    '__a _b__ c_',
+    'a**b',
+    '*a **b*',
+    '**a***b**',
+    '****',
+    '*****a',
+    '**未闭合',
+    '*第一行\n第二行*',
+    '**a**\n*b*',
+    'x_1 + y_2',
+    # 字体span、（（…））与其他标记组合
+    '<span style="font-family: KaiTi">楷体**粗体**</span>',
+    '*a <span style="font-family: SimSun">宋体</span> b*',
+    '（（重点））和**粗体**',
+    '**（（加粗的重点））**',
+    '（（*斜体*））',
+    '<span style="font-family: Arial">a</span><span style="font-family: KaiTi">（（b））</span>',
+    # 空格
+    '第1题  （  ）',
+    '   *a*   **b**   ',
+]
+
+
+@pytest.fixture
+def renderer():
+    return InlineMarkupRenderer(map_font=_map_font, emphasis_font='KaiTi')
+
+
+@pytest.mark.parametrize('text', SAMPLES)
+def test_matches_legacy_output(renderer, text):
+    assert renderer.render(text) == _legacy_inline_markdown(text)
+
+
+def test_nested_bold_inside_italic(renderer):
+    assert renderer.render('*a **b** c*') == '<i>a <b>b</b> c</i>'
+    assert renderer.render('_a __b__ c_') == '<i>a <b>b</b> c</i>'
+
+
+def test_replace_math():
+    renderer = InlineMarkupRenderer(map_font=_map_font, emphasis_font='KaiTi', replace_math=True)
+    assert renderer.render('求 $x_1 + x_2$ 的*值*') == '求 [数学公式] 的<i>值</i>'
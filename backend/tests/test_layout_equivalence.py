@@ -0,0 +1,117 @@
+"""
+段落断行缓存、文本测量缓存和简单算式快速排版与原实现的等价性检查
+"""
+
+import io
+import os
+
+import matplotlib
+import pytest
+from matplotlib.font_manager import FontProperties
+from matplotlib.mathtext import MathTextParser
+from reportlab.lib import rl_accel
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import Paragraph
+
+from app.services import text_metrics
+from app.services.paragraph_cache import CachedParagraph, paragraph_layout_cache
+from app.services.text_formula import TEXT_FORMULA_PADDING, is_simple_formula, text_formula
+
+FONT_NAME = 'TestSans'
+pdfmetrics.registerFont(TTFont(FONT_NAME, os.path.join(matplotlib.get_data_path(), 'fonts', 'ttf', 'DejaVuSans.ttf')))
+text_metrics.install()
+
+STYLE = ParagraphStyle('test', fontName=FONT_NAME, fontSize=12, leading=18, wordWrap='CJK')
+
+PARAGRAPHS = [
+    '第1题 计算下列各题，并写出计算过程。',
+    '这是一段很长的中文题目说明，' * 12,
+    '<b>答案：</b>略　<i>解析：</i>按照运算顺序先乘除后加减，' * 4,
+    'Mixed English words and 中文混排 text with a verylongwordthatmustbesplitacrosslines' * 3,
+]
+WIDTHS = [120.0, 250.5, 480.0]
+
+
+def _draw(paragraph, width: float) -> bytes:
+    buf = io.BytesIO()
+    canvas = Canvas(buf, invariant=1)
+    paragraph.wrap(width, 10000)
+    paragraph.drawOn(canvas, 0, 0)
+    canvas.save()
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize('text', PARAGRAPHS)
+@pytest.mark.parametrize('width', WIDTHS)
+def test_cached_paragraph_matches_paragraph(text, width):
+    paragraph_layout_cache.clear()
+    expected = Paragraph(text, STYLE)
+    expected_size = expected.wrap(width, 10000)
+    # 第一次断行写入缓存，第二次复用缓存
+    for _ in range(2):
+        cached = CachedParagraph(text, STYLE)
+        assert cached.wrap(width, 10000) == expected_size
+        assert _draw(cached, width) == _draw(Paragraph(text, STYLE), width)
+
+
+@pytest.mark.parametrize('text', PARAGRAPHS[1:3])
+def test_cached_paragraph_split_matches_paragraph(text):
+    paragraph_layout_cache.clear()
+    CachedParagraph(text, STYLE).wrap(120.0, 10000)
+    cached = CachedParagraph(text, STYLE)
+    cached.wrap(120.0, 10000)
+    expected = Paragraph(text, STYLE)
+    expected.wrap(120.0, 10000)
+
+    parts = cached.split(120.0, 40)
+    expected_parts = expected.split(120.0, 40)
+    assert len(parts) == len(expected_parts) == 2
+    for part, expected_part in zip(parts, expected_parts):
+        assert _draw(part, 120.0) == _draw(expected_part, 120.0)
+
+
+def test_cached_paragraph_rejects_narrow_width():
+    paragraph_layout_cache.clear()
+    for _ in range(2):
+        assert CachedParagraph(PARAGRAPHS[0], STYLE).wrap(0, 10000) == (0, 0x7fffffff)
+
+
+@pytest.mark.parametrize('text', ['abc', '中文字符宽度', 'Mixed 中文 123', '\U0001F600 emoji'])
+def test_string_width_matches_reportlab(text):
+    font = pdfmetrics.getFont(FONT_NAME)
+    assert text_metrics.glyph_advances.string_width(font, text, 12) == \
+        pytest.approx(rl_accel.instanceStringWidthTTF(font, text, 12))
+
+
+@pytest.mark.parametrize('word', ['这是一个需要拆分到多行的很长的中文词语' * 3, 'verylongwordwithoutanybreaks' * 4])
+def test_split_word_matches_reportlab(word):
+    args = (word, 30.0, [100.0, 150.0], 0, FONT_NAME, 12)
+    assert text_metrics.split_word(*args) == text_metrics._rl_split_word(*args)
+
+
+SIMPLE_FORMULAS = [
+    r'6 \times 7 = 42',
+    r'\frac{3}{4} + x - 1 \div 2',
+    r'(a + b) \cdot c \leq 10, 3.5 \approx 4',
+    r'-3 + 5 = 2',
+    r'12 \pm 0.5',
+    r'\dfrac{12}{5} \geq x',
+]
+
+
+@pytest.mark.parametrize('formula', SIMPLE_FORMULAS)
+def test_text_formula_matches_mathtext_width(formula):
+    assert is_simple_formula(formula)
+    width, _, _, _, _ = MathTextParser('path').parse(
+        f'${formula}$', 72, FontProperties(size=40, math_fontfamily='cm'))
+    layout = text_formula(formula, 40)
+    # mathtext的外框宽度向上取整到整数pt
+    assert layout.width - 2 * TEXT_FORMULA_PADDING == pytest.approx(width, abs=1.0)
+
+
+@pytest.mark.parametrize('formula', [r'x^2', r'\sqrt{2}', r'\frac{\frac{1}{2}}{3}', r'a \neq b', r'a \le b'])
+def test_complex_formulas_use_full_renderer(formula):
+    assert not is_simple_formula(formula)
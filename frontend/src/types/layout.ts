@@ -42,6 +42,7 @@ export interface PDFGenerationRequest {
   content: string
   layout_config: LayoutConfig
   filename?: string
+  render_id?: string
 }
 
 export interface PDFGenerationResponse {
@@ -89,6 +89,11 @@ export const pdfAPI = {
     return api.post('/api/pdf/preview', request)
   },
 
+  // 取消正在进行的渲染
+  cancel: async (renderId: string) => {
+    return api.post(`/api/pdf/cancel/${renderId}`)
+  },
+
   // 获取PDF列表
   list: async () => {
     return api.get('/api/pdf/list')